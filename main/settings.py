@@ -13,6 +13,8 @@ https://docs.djangoproject.com/en/5.0/ref/settings/
 from pathlib import Path
 import os
 
+from django.core.exceptions import ImproperlyConfigured
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -52,8 +54,11 @@ EMAIL_HOST_USER = '1099vladimir@mail.ru'
 EMAIL_HOST_PASSWORD = 'Barionix1'
 SERVER_EMAIL = EMAIL_HOST_USER
 DEFAULT_FROM_EMAIL = EMAIL_HOST_USER
+# Письма отправляет обработчик очереди задач, а не запрос, но и он не должен зависать на SMTP
+EMAIL_TIMEOUT = 10
 
 MIDDLEWARE = [
+    'shop.middleware.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -65,20 +70,34 @@ MIDDLEWARE = [
 
 ROOT_URLCONF = 'main.urls'
 
+# Профиль шаблонов (TEMPLATE_PROFILE): development - шаблоны читаются с диска при каждой
+# загрузке, production - скомпилированные шаблоны хранятся в памяти процесса, а шаблоны
+# shop/ и registration/ компилируются при запуске (TEMPLATE_WARMUP)
+TEMPLATE_PROFILE = os.environ.get('TEMPLATE_PROFILE', 'development' if DEBUG else 'production')
+TEMPLATE_LOADERS = [
+    'django.template.loaders.filesystem.Loader',
+    'django.template.loaders.app_directories.Loader',
+]
+TEMPLATE_WARMUP_PREFIXES = ('shop/', 'registration/')
+TEMPLATE_WARMUP = TEMPLATE_PROFILE == 'production'
+
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # DjangoTemplates с замером времени отрисовки для RequestMetricsMiddleware
+        'BACKEND': 'shop.metrics.TimedDjangoTemplates',
+        # Имя по умолчанию берется из модуля бэкенда, оставляем прежнее engines['django']
+        'NAME': 'django',
         'DIRS': [Path(BASE_DIR) / 'shop/templates'],
-        'APP_DIRS': True,
         'OPTIONS': {
+            'loaders': (TEMPLATE_LOADERS if TEMPLATE_PROFILE == 'development'
+                        else [('django.template.loaders.cached.Loader', TEMPLATE_LOADERS)]),
+            # Процессоры вызываются при каждой отрисовке. user, perms и messages ленивые:
+            # сессия и пользователь загружаются, только если шаблон к ним обращается.
+            # debug (без INTERNAL_IPS ничего не добавляет), media и static шаблоны не используют
             'context_processors': [
-                'django.template.context_processors.debug',
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
-                'django.template.context_processors.media',
-                'django.template.context_processors.static',
-                'shop.context_processors.user_status',
             ],
         },
     },
@@ -90,12 +109,81 @@ WSGI_APPLICATION = 'main.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.0/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# Профиль базы выбирается переменной DB_PROFILE:
+# sqlite - SQLite в режиме WAL с настройками для параллельной записи (по умолчанию),
+# sqlite-basic - SQLite с настройками по умолчанию (для сравнения в benchmark_checkout),
+# postgres - PostgreSQL с постоянными соединениями, параметры в POSTGRES_*.
+DB_PROFILE = os.environ.get('DB_PROFILE', 'sqlite')
+CONN_MAX_AGE = int(os.environ.get('CONN_MAX_AGE', 60))
+
+if DB_PROFILE == 'postgres':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('POSTGRES_DB', 'shop'),
+            'USER': os.environ.get('POSTGRES_USER', 'shop'),
+            'PASSWORD': os.environ.get('POSTGRES_PASSWORD', ''),
+            'HOST': os.environ.get('POSTGRES_HOST', 'localhost'),
+            'PORT': os.environ.get('POSTGRES_PORT', '5432'),
+            # Соединение переиспользуется между запросами одного процесса,
+            # перед повторным использованием проверяется, что оно живо
+            'CONN_MAX_AGE': CONN_MAX_AGE,
+            'CONN_HEALTH_CHECKS': True,
+            # За PgBouncer в режиме transaction серверные курсоры не работают
+            'DISABLE_SERVER_SIDE_CURSORS': os.environ.get('POSTGRES_PGBOUNCER') == '1',
+            'OPTIONS': {'connect_timeout': 5},
+        }
+    }
+    DATABASES['replica'] = {
+        **DATABASES['default'],
+        'HOST': os.environ.get('POSTGRES_REPLICA_HOST', DATABASES['default']['HOST']),
+        'PORT': os.environ.get('POSTGRES_REPLICA_PORT', DATABASES['default']['PORT']),
+        'TEST': {'MIRROR': 'default'},
+    }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.environ.get('SQLITE_PATH', BASE_DIR / 'db.sqlite3'),
+            # Тестовая база в файле, а не в памяти: так тесты могут писать в нее из нескольких потоков
+            'TEST': {
+                'NAME': BASE_DIR / 'test_db.sqlite3',
+            },
+        }
+    }
+    if DB_PROFILE == 'sqlite':
+        DATABASES['default'].update({
+            'ENGINE': 'shop.db_backends.sqlite3',
+            'CONN_MAX_AGE': CONN_MAX_AGE,
+            'OPTIONS': {
+                # Сколько секунд ждать освобождения блокировки записи
+                'timeout': float(os.environ.get('SQLITE_BUSY_TIMEOUT', 20)),
+                'transaction_mode': 'IMMEDIATE',
+                'init_command': (
+                    'PRAGMA journal_mode=WAL;'
+                    'PRAGMA synchronous=NORMAL;'
+                    f'PRAGMA mmap_size={int(os.environ.get("SQLITE_MMAP_SIZE", 256 * 1024 * 1024))};'
+                    'PRAGMA cache_size=-20000;'
+                    'PRAGMA temp_store=MEMORY'
+                ),
+            },
+        })
+    # Локальная реплика - копия файла основной базы
+    DATABASES['replica'] = {
+        **DATABASES['default'],
+        'NAME': os.environ.get('SQLITE_REPLICA_PATH', BASE_DIR / 'db_replica.sqlite3'),
+        'TEST': {
+            'NAME': BASE_DIR / 'test_db_replica.sqlite3',
+        },
     }
-}
+
+# Чтение каталога (главная, список и страница товара) с реплики включается REPLICA_ENABLED=1.
+# Допустимое отставание реплики: столько секунд после изменения каталога (в любом процессе:
+# время изменения - версия каталога в общем кэше страниц) и после оформления заказа
+# пользователем каталог читается с основной базы.
+DATABASE_ROUTERS = ['shop.routers.ReplicaRouter']
+REPLICA_DATABASE = 'replica' if os.environ.get('REPLICA_ENABLED') == '1' else None
+REPLICA_MAX_LAG = float(os.environ.get('REPLICA_MAX_LAG', 2))
 
 
 # Password validation
@@ -148,3 +236,123 @@ SITE_ID = 1
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 MEDIA_URL = 'main/media/'
 
+# Миниатюры изображений товаров (shop.images): ширины в пикселях, форматы и качество.
+# Файлы лежат в MEDIA_ROOT/PRODUCT_IMAGE_DIR, имена строятся из хэша исходника.
+PRODUCT_IMAGE_DIR = 'products'
+PRODUCT_IMAGE_WIDTHS = [200, 400, 800]
+PRODUCT_IMAGE_FORMATS = ['webp', 'jpeg']
+PRODUCT_IMAGE_QUALITY = 80
+PRODUCT_IMAGE_FETCH_TIMEOUT = 10
+PRODUCT_IMAGE_MAX_BYTES = 20 * 1024 * 1024
+
+
+# Каталог товаров: размер страницы для курсорной пагинации и потоковый режим
+PRODUCT_LIST_PAGE_SIZE = int(os.environ.get('PRODUCT_LIST_PAGE_SIZE', 24))
+PRODUCT_LIST_MAX_PAGE_SIZE = 100
+PRODUCT_LIST_STREAMING = os.environ.get('PRODUCT_LIST_STREAMING') == '1'
+
+
+# Границы диапазонов цен для фильтра каталога (руб.), последний диапазон открытый
+PRICE_FACET_BOUNDS = [0, 1000, 5000, 10000, 50000]
+
+# Корзина: ключ в сессии, где хранить корзины пользователей (session, db или cache)
+# и сколько разных товаров может быть в одной корзине
+CART_SESSION_ID = 'cart'
+CART_STORAGE = os.environ.get('CART_STORAGE', 'session')
+CART_CACHE_ALIAS = 'default'
+CART_CACHE_TIMEOUT = 30 * 24 * 60 * 60
+CART_MAX_LINES = 100
+
+# Сколько секунд держится резерв товаров корзины на время оформления заказа
+STOCK_RESERVATION_TTL = 15 * 60
+
+# Сколько товаров показывать в результатах поиска и сколько совпадений ранжировать
+SEARCH_RESULTS_LIMIT = 50
+SEARCH_CANDIDATES_LIMIT = 200
+
+# Кэш отрисованных страниц каталога и версий товаров и каталога: в файлах (file, по умолчанию)
+# или в памяти процесса (locmem). Версии меняются при сохранении товара, и файловый кэш
+# общий для всех процессов сервера: после изменения цены никакой процесс не отдаст
+# старую страницу. Кэш в памяти у каждого процесса свой, поэтому допустим только при DEBUG.
+# В обоих случаях при переполнении вытесняются давно не использованные записи.
+PAGE_CACHE_ALIAS = 'pages'
+PAGE_CACHE_TIMEOUT = 60 * 60
+PAGE_CACHE_MAX_ENTRIES = int(os.environ.get('PAGE_CACHE_MAX_ENTRIES', 5000))
+# Сколько секунд обратный прокси может отдавать из своего кэша страницы каталога
+# запросам без cookie сессии (anonymous_fast_path)
+ANONYMOUS_PAGE_MAX_AGE = int(os.environ.get('ANONYMOUS_PAGE_MAX_AGE', 60))
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+}
+PAGE_CACHE_BACKEND = os.environ.get('PAGE_CACHE_BACKEND', 'file')
+if PAGE_CACHE_BACKEND == 'locmem':
+    if not DEBUG:
+        raise ImproperlyConfigured('Кэш страниц в памяти процесса допустим только при DEBUG')
+    CACHES[PAGE_CACHE_ALIAS] = {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'pages',
+        'OPTIONS': {'MAX_ENTRIES': PAGE_CACHE_MAX_ENTRIES},
+    }
+else:
+    CACHES[PAGE_CACHE_ALIAS] = {
+        'BACKEND': 'shop.cache_backends.LRUFileBasedCache',
+        'LOCATION': os.environ.get('PAGE_CACHE_DIR', os.path.join(BASE_DIR, 'cache', 'pages')),
+        'OPTIONS': {'MAX_ENTRIES': PAGE_CACHE_MAX_ENTRIES},
+    }
+# Фрагменты шаблонов ({% cache %}): меню по состоянию входа, карточки товаров по их полям
+CACHES['template_fragments'] = {
+    'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    'LOCATION': 'template_fragments',
+    'OPTIONS': {'MAX_ENTRIES': int(os.environ.get('TEMPLATE_FRAGMENT_MAX_ENTRIES', 20000))},
+}
+# Сессии читаются из кэша и пишутся в кэш и в базу (cached_db). Кэш общий для всех
+# процессов на сервере (файловый): выход или изменение корзины в одном процессе
+# видят остальные. Кэш в памяти (SESSION_CACHE_BACKEND=locmem) у каждого процесса свой,
+# поэтому он допускается только при DEBUG, для одного процесса runserver.
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+SESSION_CACHE_ALIAS = 'sessions'
+SESSION_CACHE_BACKEND = os.environ.get('SESSION_CACHE_BACKEND', 'file')
+if SESSION_CACHE_BACKEND == 'locmem':
+    if not DEBUG:
+        raise ImproperlyConfigured('Кэш сессий в памяти процесса допустим только при DEBUG')
+    CACHES[SESSION_CACHE_ALIAS] = {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'sessions',
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    }
+else:
+    CACHES[SESSION_CACHE_ALIAS] = {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ.get('SESSION_CACHE_DIR', os.path.join(BASE_DIR, 'cache', 'sessions')),
+        'OPTIONS': {'MAX_ENTRIES': 100000},
+    }
+# Просроченные сессии удаляются командой clear_expired_sessions пачками
+SESSION_CLEANUP_BATCH_SIZE = 1000
+
+# Замеры запросов (число запросов к базе, время в базе и шаблонах) для доли запросов
+# от 0 до 1. Одинаковый SQL больше порога раз за запрос считается признаком N+1.
+REQUEST_METRICS_SAMPLE_RATE = float(os.environ.get('REQUEST_METRICS_SAMPLE_RATE', 1.0))
+REQUEST_METRICS_N_PLUS_ONE_THRESHOLD = int(os.environ.get('REQUEST_METRICS_N_PLUS_ONE_THRESHOLD', 5))
+
+# Асинхронные представления каталога и корзины (shop.async_views) для запуска под ASGI
+ASYNC_VIEWS = os.environ.get('ASYNC_VIEWS') == '1'
+
+# Очередь фоновых задач (shop.tasks): db - таблица задач, которую выполняет команда
+# run_task_worker, immediate - задачи выполняются сразу после коммита в том же процессе.
+# Неудачная задача повторяется через TASK_RETRY_DELAY * 2^(попытка - 1) секунд.
+TASK_QUEUE_BACKEND = os.environ.get('TASK_QUEUE_BACKEND', 'db')
+TASK_BATCH_SIZE = 100
+TASK_MAX_ATTEMPTS = 5
+TASK_RETRY_DELAY = 30
+# Через сколько секунд задачу, взятую упавшим обработчиком, можно взять снова
+TASK_LOCK_TIMEOUT = 5 * 60
+
+# Список заказов в админке: до этого числа заказы считаются точно, больше - по оценке базы
+ADMIN_EXACT_COUNT_LIMIT = 10000
+
+# Сводка продаж (shop.rollups): запас в секундах при поиске заказов, измененных
+# после прошлого обновления, на транзакции, закоммиченные с опозданием
+SALES_ROLLUP_OVERLAP = 5 * 60
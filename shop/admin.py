@@ -1,19 +1,190 @@
-from django.contrib import admin
-from .models import Product, User, Order, OrderItem
+from django import forms
+from django.conf import settings
+from django.contrib import admin, messages
+from django.contrib.admin.views.main import ORDER_VAR, ChangeList
+from django.contrib.admin.widgets import ForeignKeyRawIdWidget
+from django.urls import NoReverseMatch, reverse
+from django.utils.text import Truncator
+
+from .models import Product, User, Order, OrderItem, OrderStatusChange
+from .order_status import TRANSITIONS, bulk_advance, bulk_transition, record_transition
+from .pagination import bounded_count, decode_cursor, keyset_page, table_estimate
 
 admin.site.register(Product)
 admin.site.register(User)
 
+# Сортировка списка заказов по умолчанию и курсоры для нее
+ORDER_LIST_ORDERING = ('-created', '-pk')
+CURSOR_PARAMS = ('after', 'before')
+
+
+class PreloadedRawIdWidget(ForeignKeyRawIdWidget):
+    """
+    Поле id товара, подпись к которому берется из заранее загруженных товаров,
+    а не отдельным запросом на каждую строку заказа.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.preloaded = {}
+
+    def label_and_url_for_value(self, value):
+        obj = self.preloaded.get(str(value))
+        if obj is None:
+            return super().label_and_url_for_value(value)
+        try:
+            url = reverse(f'{self.admin_site.name}:{obj._meta.app_label}_{obj._meta.model_name}_change',
+                          args=(obj.pk,))
+        except NoReverseMatch:
+            url = ''
+        return Truncator(obj).words(14), url
+
+
 class OrderItemInline(admin.TabularInline):
     model = OrderItem
     raw_id_fields = ['product']
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('product')
+
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        if db_field.name == 'product':
+            kwargs['widget'] = PreloadedRawIdWidget(db_field.remote_field, self.admin_site, using=kwargs.get('using'))
+        return super().formfield_for_foreignkey(db_field, request, **kwargs)
+
+    def get_formset(self, request, obj=None, **kwargs):
+        formset = super().get_formset(request, obj, **kwargs)
+        if obj is not None:
+            # Товары всех строк заказа одним запросом; копии виджета в формах делят этот словарь
+            formset.form.base_fields['product'].widget.preloaded.update(
+                (str(item.product_id), item.product) for item in self.get_queryset(request).filter(order=obj))
+        return formset
+
+
+class KeysetChangeList(ChangeList):
+    """
+    Список заказов с курсорной пагинацией по (created, id) вместо OFFSET и без
+    COUNT(*) по всей таблице: для всей таблицы число заказов берется из оценки
+    базы, для отфильтрованного списка считается не больше ADMIN_EXACT_COUNT_LIMIT.
+    При сортировке по колонке используется обычная постраничная навигация.
+    """
+    def get_filters_params(self, params=None):
+        lookup_params = super().get_filters_params(params)
+        for name in CURSOR_PARAMS:
+            lookup_params.pop(name, None)
+        return lookup_params
+
+    def get_results(self, request):
+        self.keyset_page = None
+        if ORDER_VAR in self.params:
+            return super().get_results(request)
+
+        cursors = {name: decode_cursor(self.params[name], ORDER_LIST_ORDERING, self.model)
+                   for name in CURSOR_PARAMS if name in self.params}
+        page = keyset_page(self.queryset, per_page=self.list_per_page, ordering=ORDER_LIST_ORDERING, **cursors)
+        limit = settings.ADMIN_EXACT_COUNT_LIMIT
+        estimate = None
+        if not self.queryset.query.has_filters():
+            estimate = table_estimate(self.model, self.queryset.db)
+        if estimate is not None and estimate > limit:
+            self.result_count, self.result_count_display = estimate, f'≈{estimate}'
+        else:
+            count = bounded_count(self.queryset, limit)
+            self.result_count, self.result_count_display = count, str(count) if count <= limit else f'>{limit}'
+
+        self.keyset_page = page
+        self.result_list = page.object_list
+        self.show_full_result_count = False
+        self.full_result_count = None
+        self.show_admin_actions = True
+        self.can_show_all = False
+        self.multi_page = page.has_next or page.has_previous
+        self.paginator = None
+
+    def cursor_url(self, name, cursor):
+        return self.get_query_string({name: cursor}, remove=[param for param in CURSOR_PARAMS if param != name])
+
+    @property
+    def next_url(self):
+        return self.cursor_url('after', self.keyset_page.next_cursor)
+
+    @property
+    def prev_url(self):
+        return self.cursor_url('before', self.keyset_page.prev_cursor)
+
+
+class OrderAdminForm(forms.ModelForm):
+    """
+    Форма заказа, в которой статус можно оставить прежним или перевести в следующий.
+    """
+    class Meta:
+        model = Order
+        fields = '__all__'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if self.instance.pk and 'status' in self.fields:
+            allowed = (self.instance.status, *TRANSITIONS[self.instance.status])
+            self.fields['status'].choices = [choice for choice in Order.STATUS_CHOICES if choice[0] in allowed]
+
+
+class OrderStatusChangeInline(admin.TabularInline):
+    model = OrderStatusChange
+    fields = readonly_fields = ['from_status', 'to_status', 'changed_at', 'user']
+    extra = 0
+    can_delete = False
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('user')
+
+
+def transition_action(status, label):
+    def action(modeladmin, request, queryset):
+        selected = queryset.count()
+        moved = bulk_transition(queryset, status, user=request.user)
+        modeladmin.message_user(request, f'Переведено в статус "{label}": {moved} из {selected}',
+                                messages.SUCCESS if moved == selected else messages.WARNING)
+    action.__name__ = f'transition_to_{status}'
+    action.short_description = f'Перевести в статус "{label}"'
+    action.allowed_permissions = ('change',)
+    return action
+
+
+@admin.action(description='Перевести в следующий статус', permissions=['change'])
+def advance_status(modeladmin, request, queryset):
+    moved = bulk_advance(queryset, user=request.user)
+    modeladmin.message_user(request, f'Переведено заказов: {sum(moved.values())}')
+
+
 class OrderAdmin(admin.ModelAdmin):
     list_display = ['id', 'full_name', 'email',
                     'address', 'postal_code', 'city', 'paid',
-                    'created', 'updated', 'status']
-    list_filter = ['paid', 'created', 'updated']
-    inlines = [OrderItemInline]
+                    'created', 'updated', 'status', 'total', 'item_count']
+    list_filter = ['paid', 'status', 'created', 'updated']
+    # В списке нет связанных полей, JOIN не нужен; сумма и число товаров хранятся в заказе
+    list_select_related = False
+    list_per_page = 50
+    ordering = ORDER_LIST_ORDERING
+    show_full_result_count = False
+    show_facets = admin.ShowFacets.NEVER
+    change_list_template = 'admin/shop/order/change_list.html'
+    form = OrderAdminForm
+    # Сумма и число товаров пересчитываются по строкам заказа, правка вручную разошлась бы с ними
+    readonly_fields = ['total', 'item_count']
+    inlines = [OrderItemInline, OrderStatusChangeInline]
+    # Массовые переходы: один UPDATE на исходный статус вместо save() каждого заказа
+    actions = [advance_status] + [transition_action(status, label) for status, label in Order.STATUS_CHOICES
+                                  if any(status in targets for targets in TRANSITIONS.values())]
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        if change and 'status' in form.changed_data:
+            record_transition(obj, form.initial['status'], user=request.user)
+
+    def get_changelist(self, request, **kwargs):
+        return KeysetChangeList
 
 
 admin.site.register(Order, OrderAdmin)
@@ -0,0 +1,128 @@
+"""
+Асинхронные варианты представлений каталога и корзины для запуска под ASGI
+(включаются ASYNC_VIEWS=1). Запросы к базе идут через асинхронный ORM,
+поэтому поток на запрос нужен только для синхронных частей: сессии,
+файлового кэша страниц и отрисовки шаблонов.
+"""
+import functools
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib import messages
+from django.contrib.auth.models import AnonymousUser
+from django.contrib.auth.views import redirect_to_login
+from django.http import HttpResponse, StreamingHttpResponse
+from django.shortcuts import aget_object_or_404, redirect, render
+from django.template.loader import render_to_string
+
+from .cart import Cart, CartLimitError
+from .facets import aget_facets
+from .filters import get_filters, filter_products, filter_query, price_facets
+from .models import Product
+from .page_cache import acached_page, anonymous_fast_path
+from .pagination import akeyset_page, aiter_keyset_chunks, get_cursor, get_page_size, DEFAULT_ORDERING
+from .routers import replica_reads
+from .views import product_detail_cache_key, product_list_cache_key, stream_page_parts
+
+
+async def load_user(request):
+    """
+    Загружает пользователя заранее: шаблоны и контекстные процессоры обращаются
+    к request.user синхронно, а из корутины запрос к базе недопустим.
+    Вместе с пользователем загружается и сессия. Без cookie сессии
+    (в том числе после anonymous_fast_path) пользователь - гость без перехода в поток.
+    """
+    if settings.SESSION_COOKIE_NAME not in request.COOKIES:
+        request.user = AnonymousUser()
+        return
+    request.user = await request.auser()
+
+
+def alogin_required(view):
+    # login_required в Django 5.0 не поддерживает async-представления
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        await load_user(request)
+        if not request.user.is_authenticated:
+            return redirect_to_login(request.get_full_path())
+        return await view(request, *args, **kwargs)
+    return wrapper
+
+
+@anonymous_fast_path
+@replica_reads
+async def product_list(request):
+    await load_user(request)
+    filters = get_filters(request)
+    ordering = filters.get('sort', DEFAULT_ORDERING)
+    products = filter_products(Product.objects.all(), filters)
+    after = get_cursor(request, 'after', ordering, Product)
+    per_page = get_page_size(request)
+    if settings.PRODUCT_LIST_STREAMING or request.GET.get('stream') == '1':
+        # Шаблоны отрисовываются в потоке, чтобы не блокировать цикл событий
+        head, tail = await sync_to_async(stream_page_parts)(request)
+
+        async def content():
+            yield head
+            async for chunk in aiter_keyset_chunks(products, after=after, chunk_size=per_page, ordering=ordering):
+                yield await sync_to_async(render_to_string)('shop/product_cards.html', {'products': chunk})
+            yield tail
+
+        return StreamingHttpResponse(content())
+    before = get_cursor(request, 'before', ordering, Product)
+
+    async def get_context():
+        page = await akeyset_page(products, after=after, before=before, per_page=per_page, ordering=ordering)
+        return {'products': page.object_list, 'page': page, 'per_page': per_page, 'filters': filters,
+                'page_query': filter_query(filters, per_page=per_page),
+                'facets': price_facets(filters, await aget_facets())}
+
+    # Версия каталога для ключа читается из файлового кэша страниц, тоже в потоке
+    key = await sync_to_async(product_list_cache_key)(request, filters, after, before, per_page)
+    return await acached_page(request, key, 'shop/product_list.html', get_context)
+
+
+@anonymous_fast_path
+@replica_reads
+async def product_detail(request, pk):
+    await load_user(request)
+
+    async def get_context():
+        return {'product': await aget_object_or_404(Product, pk=pk)}
+
+    key = await sync_to_async(product_detail_cache_key)(pk)
+    return await acached_page(request, key, 'shop/product_detail.html', get_context)
+
+
+@alogin_required
+async def add_to_cart(request, product_id):
+    if request.method == 'POST':
+        quantity = int(request.POST.get('quantity', 1))
+        product = await aget_object_or_404(Product, id=product_id)
+        cart = await Cart.aload(request)
+        try:
+            await cart.aadd(product.id, quantity)
+        except CartLimitError as e:
+            messages.error(request, str(e))
+        return redirect('cart')
+    return HttpResponse("Only POST method is allowed", status=405)
+
+
+@alogin_required
+async def cart_view(request):
+    cart = await Cart.aload(request)
+    if request.method == 'POST':
+        index = 1
+        while f'product_id_{index}' in request.POST:
+            product_id = int(request.POST[f'product_id_{index}'])
+            new_quantity = int(request.POST.get(f'quantity_{index}', 0))
+            if new_quantity <= 0:
+                await cart.aremove(product_id)
+            elif product_id in cart.lines:
+                await cart.aadd(product_id, new_quantity, update_quantity=True)
+            index += 1
+        return redirect('cart')
+
+    contents = await cart.aget_contents()
+    return await sync_to_async(render)(request, 'shop/cart.html',
+                                       {'products': contents.items, 'total_price': contents.total_price})
@@ -0,0 +1,495 @@
+import copy
+import csv
+import http.client
+import json
+import random
+import re
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from datetime import timedelta
+from decimal import Decimal
+from itertools import accumulate
+from urllib.parse import urlencode
+
+from django.conf import settings
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.cache import caches
+from django.core.servers.basehttp import ThreadedWSGIServer, WSGIRequestHandler
+from django.core.wsgi import get_wsgi_application
+from django.db import DatabaseError, connection, reset_queries, transaction
+from django.db.models import Max
+from django.test import Client, RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.crypto import get_random_string
+
+from .cart import Cart
+from .catalog_io import FIELDS as CATALOG_FIELDS
+from .facets import rebuild_facets
+from .forms import OrderCreateForm
+from .models import Order, OrderItem, Product
+from .orders import place_order
+from .search import rebuild_index
+from .template_warmup import warm_templates
+
+SCENARIOS = ('index', 'product_list', 'cart_view', 'add_to_cart', 'create_order')
+PERCENTILES = (('p50', 0.5), ('p95', 0.95), ('p99', 0.99))
+WORDS = ('телефон ноутбук планшет наушники колонка зарядка кабель чехол часы камера '
+         'черный белый красный большой маленький новый игровой офисный').split()
+# Профили шаблонов для benchmark_templates: без кэша шаблонов, прежняя настройка
+# (APP_DIRS, Django сам кэширует скомпилированные шаблоны) и production
+TEMPLATE_PROFILES = ('uncached', 'default', 'production')
+TEMPLATE_PAGES = ('index', 'product_list', 'product_detail', 'search', 'cart', 'account', 'login')
+SERVER_TIMING_TEMPLATE = re.compile(r'tpl;dur=([\d.]+)')
+ORDER_FORM = {'full_name': 'Иван Иванов', 'email': 'buyer@example.com', 'address': 'ул. Ленина, 1',
+              'postal_code': '101000', 'city': 'Москва'}
+
+
+def percentiles(values):
+    values = sorted(values)
+    if not values:
+        return {name: 0.0 for name, _ in PERCENTILES}
+    return {name: values[max(0, int(len(values) * q) - 1)] for name, q in PERCENTILES}
+
+
+def seed(products, users, cart_items, rnd=None, batch_size=1000):
+    """
+    Заполняет базу синтетическим каталогом из products товаров и users покупателями,
+    у каждого корзина из cart_items товаров. Возвращает [(пользователь, корзина)].
+    """
+    rnd = rnd or random.Random(0)
+    # bulk_create не вызывает сигналов, поэтому индекс поиска и счетчики пересчитываются в конце
+    batch = []
+    for number in range(products):
+        batch.append(Product(name=' '.join(rnd.choices(WORDS, k=3)) + f' {number}', characteristics='',
+                             price=Decimal(rnd.randint(100, 100000)), quantity=rnd.choice((0, 10 ** 6))))
+        if len(batch) == batch_size:
+            Product.objects.bulk_create(batch)
+            batch = []
+    Product.objects.bulk_create(batch)
+    rebuild_index()
+    rebuild_facets()
+
+    in_stock = list(Product.objects.filter(quantity__gt=0).values_list('pk', flat=True))
+    password = make_password(None)
+    User = get_user_model()
+    prefix = get_random_string(8).lower()
+    User.objects.bulk_create([
+        User(username=f'bench-{prefix}-{number}', email=f'bench-{prefix}-{number}@example.com', password=password)
+        for number in range(users)
+    ])
+    customers = User.objects.filter(username__startswith=f'bench-{prefix}-').order_by('pk')
+    return [(user, {pk: 1 for pk in rnd.sample(in_stock, min(cart_items, len(in_stock)))})
+            for user in customers]
+
+
+def write_catalog_file(stream, fmt, rows, rnd=None):
+    """
+    Пишет в stream синтетический файл импорта каталога из rows товаров.
+    """
+    rnd = rnd or random.Random(0)
+    writer = csv.writer(stream) if fmt == 'csv' else None
+    if writer:
+        writer.writerow(CATALOG_FIELDS)
+    for number in range(rows):
+        values = (f'SKU-{number:08d}', ' '.join(rnd.choices(WORDS, k=3)) + f' {number}',
+                  ' '.join(rnd.choices(WORDS, k=12)), f'{rnd.randint(100, 100000)}.00', rnd.choice((0, 5, 100)), '')
+        if writer:
+            writer.writerow(values)
+        else:
+            stream.write(json.dumps(dict(zip(CATALOG_FIELDS, values)), ensure_ascii=False) + '\n')
+
+
+def seed_sales(items, items_per_order=10, products=1000, days=365, rnd=None, batch_size=10000):
+    """
+    Заполняет базу синтетическими продажами: items строк заказов по items_per_order
+    в заказе из products товаров, даты заказов за последние days дней. Заказы и строки вставляются
+    executemany пачками по batch_size в обход моделей, сумма и число товаров
+    заказа считаются здесь же. Возвращает число заказов.
+    """
+    rnd = rnd or random.Random(0)
+    catalog = [Product(name=' '.join(rnd.choices(WORDS, k=3)) + f' {number}', characteristics='',
+                       price=Decimal(rnd.randint(100, 100000)), quantity=100) for number in range(products)]
+    Product.objects.bulk_create(catalog, batch_size=batch_size)
+    prices = list(Product.objects.values_list('pk', 'price'))
+    # Продажи по товарам с длинным хвостом: товар с номером n продается в ~1/n раз реже первого
+    weights = list(accumulate(1 / rank for rank in range(1, len(prices) + 1)))
+    statuses = [status for status, _ in Order.STATUS_CHOICES]
+    now = timezone.now()
+    ops = connection.ops
+    quote = ops.quote_name
+    order_columns = ('id', 'full_name', 'email', 'address', 'postal_code', 'city', 'created', 'updated',
+                     'paid', 'order_number', 'status', 'total', 'item_count')
+    item_columns = ('order_id', 'product_id', 'quantity', 'price')
+    insert_order = (f'INSERT INTO {quote(Order._meta.db_table)} ({", ".join(map(quote, order_columns))}) '
+                    f'VALUES ({", ".join(["%s"] * len(order_columns))})')
+    insert_item = (f'INSERT INTO {quote(OrderItem._meta.db_table)} ({", ".join(map(quote, item_columns))}) '
+                   f'VALUES ({", ".join(["%s"] * len(item_columns))})')
+    first_id = (Order.objects.aggregate(last=Max('pk'))['last'] or 0) + 1
+    orders = -(-items // items_per_order)
+    order_rows, item_rows = [], []
+    with connection.cursor() as cursor:
+        for number in range(orders):
+            order_id = first_id + number
+            total, count = Decimal(0), 0
+            for _ in range(min(items_per_order, items - number * items_per_order)):
+                product_id, price = rnd.choices(prices, cum_weights=weights)[0]
+                quantity = rnd.randint(1, 3)
+                item_rows.append((order_id, product_id, quantity, ops.adapt_decimalfield_value(price)))
+                total += price * quantity
+                count += quantity
+            created = ops.adapt_datetimefield_value(now - timedelta(seconds=rnd.randrange(days * 86400)))
+            status = rnd.choice(statuses)
+            order_rows.append((order_id, 'Иван Иванов', 'buyer@example.com', 'ул. Ленина, 1', '101000', 'Москва',
+                               created, created, status != 'created', _base36(order_id).rjust(6, '0'), status,
+                               ops.adapt_decimalfield_value(total), count))
+            if len(item_rows) >= batch_size:
+                _insert_sales(cursor, insert_order, order_rows, insert_item, item_rows)
+                order_rows, item_rows = [], []
+        _insert_sales(cursor, insert_order, order_rows, insert_item, item_rows)
+    return orders
+
+
+def _base36(number):
+    digits = ''
+    while True:
+        number, digit = divmod(number, 36)
+        digits = '0123456789abcdefghijklmnopqrstuvwxyz'[digit] + digits
+        if not number:
+            return digits
+
+
+def _insert_sales(cursor, insert_order, order_rows, insert_item, item_rows):
+    with transaction.atomic():
+        cursor.executemany(insert_order, order_rows)
+        cursor.executemany(insert_item, item_rows)
+    # При DEBUG=True Django хранит текст всех запросов
+    reset_queries()
+
+
+def scenario_requests(name, cart, rnd, product_ids):
+    """
+    Запросы сценария [(метод, путь, данные)]. Замеряется последний,
+    предыдущие готовят состояние (например, наполняют корзину перед заказом).
+    """
+    if name == 'index':
+        return [('GET', reverse('home'), None)]
+    if name == 'product_list':
+        params = rnd.choice(({}, {'sort': 'price'}, {'in_stock': '1', 'min_price': '1000', 'max_price': '50000'},
+                             {'per_page': 48, 'after': rnd.choice(product_ids)}))
+        return [('GET', f'{reverse("product_list")}?{urlencode(params)}', None)]
+    if name == 'cart_view':
+        return [('GET', reverse('cart'), None)]
+    if name == 'add_to_cart':
+        return [('POST', reverse('add_to_cart', args=[rnd.choice(product_ids)]), {'quantity': 1})]
+    if name == 'create_order':
+        refill = [('POST', reverse('add_to_cart', args=[product_id]), {'quantity': 1}) for product_id in cart]
+        return refill + [('GET', reverse('create_order'), None), ('POST', reverse('create_order'), ORDER_FORM)]
+    raise ValueError(f'Неизвестный сценарий: {name}')
+
+
+def _summary(timings, errors, queries=None, memory=None):
+    result = {'requests': len(timings), 'errors': errors}
+    result.update({name: round(value, 3) for name, value in percentiles(timings).items()})
+    if queries:
+        result['queries'] = round(sum(queries) / len(queries), 2)
+        result['queries_max'] = max(queries)
+    if memory:
+        result['memory_kib'] = round(sum(memory) / len(memory) / 1024, 1)
+        result['memory_kib_max'] = round(max(memory) / 1024, 1)
+    return result
+
+
+def run_client(customers, scenarios, requests, rnd=None, memory_every=5):
+    """
+    Прогоняет сценарии через тестовый клиент Django в одном потоке: задержка,
+    число запросов к базе и пик выделенной памяти на замеряемый запрос.
+    Память считается под tracemalloc на каждом memory_every-м запросе,
+    эти запросы в задержку не входят.
+    """
+    rnd = rnd or random.Random(0)
+    product_ids = list(Product.objects.filter(quantity__gt=0).values_list('pk', flat=True))
+    clients = []
+    for user, cart in customers:
+        client = Client()
+        client.force_login(user)
+        _store_cart(client, user, cart)
+        clients.append((client, cart))
+
+    results = {}
+    for name in scenarios:
+        timings, queries, memory, errors = [], [], [], 0
+        for number in range(requests):
+            client, cart = clients[number % len(clients)]
+            *setup, measured = scenario_requests(name, cart, rnd, product_ids)
+            for request in setup:
+                _client_request(client, request)
+            traced = memory_every and number % memory_every == memory_every - 1
+            if traced:
+                tracemalloc.start()
+            started = time.perf_counter()
+            with CaptureQueriesContext(connection) as captured:
+                response = _client_request(client, measured)
+            elapsed = (time.perf_counter() - started) * 1000
+            if traced:
+                memory.append(tracemalloc.get_traced_memory()[1])
+                tracemalloc.stop()
+            else:
+                timings.append(elapsed)
+            queries.append(len(captured))
+            errors += response.status_code >= 400
+        results[name] = _summary(timings, errors, queries, memory)
+    return results
+
+
+def _client_request(client, request):
+    method, path, data = request
+    if method == 'POST':
+        return client.post(path, data)
+    return client.get(path)
+
+
+def _store_cart(client, user, cart):
+    # Корзина пишется через Cart, чтобы попасть в настроенное хранилище (CART_STORAGE)
+    request = RequestFactory().get('/')
+    request.user = user
+    request.session = client.session
+    stored = Cart(request)
+    stored.lines = dict(cart)
+    stored.save_cart()
+    request.session.save()
+
+
+def template_profile_settings(profile):
+    """
+    Настройки для override_settings: загрузчики шаблонов и кэш фрагментов профиля.
+    Кэш страниц отключен, чтобы шаблоны рендерились при каждом запросе.
+    """
+    templates = copy.deepcopy(settings.TEMPLATES)
+    options = templates[0]['OPTIONS']
+    if profile == 'uncached':
+        options['loaders'] = list(settings.TEMPLATE_LOADERS)
+    elif profile == 'default':
+        options.pop('loaders', None)
+        templates[0]['APP_DIRS'] = True
+    else:
+        options['loaders'] = [('django.template.loaders.cached.Loader', list(settings.TEMPLATE_LOADERS))]
+    dummy = {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}
+    return {
+        'TEMPLATES': templates,
+        'CACHES': {**settings.CACHES, 'benchmark_pages': dummy,
+                   'template_fragments': settings.CACHES['template_fragments'] if profile == 'production' else dummy},
+        'PAGE_CACHE_ALIAS': 'benchmark_pages',
+    }
+
+
+def template_page_path(name, product_id):
+    if name == 'product_detail':
+        return reverse('product_detail', args=[product_id])
+    if name == 'search':
+        return f'{reverse("search")}?{urlencode({"q": WORDS[0]})}'
+    if name == 'index':
+        return reverse('home')
+    return reverse(name)
+
+
+def run_template_profiles(profiles, user, requests, rnd=None):
+    """
+    Время страниц витрины в профилях шаблонов: первый запрос после запуска
+    (с компиляцией шаблонов, если их не прогрели) и задержка и время шаблонов
+    (из Server-Timing) следующих requests запросов.
+    """
+    rnd = rnd or random.Random(0)
+    product_ids = list(Product.objects.values_list('pk', flat=True))
+    results = {}
+    for profile in profiles:
+        with override_settings(**template_profile_settings(profile)):
+            caches['template_fragments'].clear()
+            if profile == 'production':
+                warm_templates()
+            client, anonymous = Client(), Client()
+            client.force_login(user)
+            results[profile] = {}
+            for name in TEMPLATE_PAGES:
+                first, timings, template_ms = None, [], []
+                for number in range(requests + 1):
+                    path = template_page_path(name, rnd.choice(product_ids))
+                    started = time.perf_counter()
+                    response = (anonymous if name == 'login' else client).get(path)
+                    elapsed = (time.perf_counter() - started) * 1000
+                    if number == 0:
+                        first = elapsed
+                        continue
+                    timings.append(elapsed)
+                    match = SERVER_TIMING_TEMPLATE.search(response.get('Server-Timing', ''))
+                    template_ms.append(float(match.group(1)) if match else 0.0)
+                results[profile][name] = dict(first_ms=round(first, 3),
+                                              template_ms=round(sum(template_ms) / len(template_ms), 3),
+                                              **{key: value for key, value in _summary(timings, 0).items()
+                                                 if key != 'errors'})
+    return results
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def start_server():
+    """
+    Локальный многопоточный WSGI-сервер на свободном порту, работающий в фоне.
+    """
+    server = ThreadedWSGIServer(('127.0.0.1', 0), QuietRequestHandler)
+    server.set_app(get_wsgi_application())
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+def run_wsgi(customers, scenarios, requests, concurrency, rnd=None):
+    """
+    Прогоняет сценарии через локальный WSGI-сервер: concurrency клиентов
+    параллельно, у каждого свои сессия и корзина. Считаются задержка и пропускная способность.
+    """
+    rnd = rnd or random.Random(0)
+    product_ids = list(Product.objects.filter(quantity__gt=0).values_list('pk', flat=True))
+    sessions = []
+    for user, cart in customers[:concurrency]:
+        client = Client()
+        client.force_login(user)
+        _store_cart(client, user, cart)
+        sessions.append((client.cookies['sessionid'].value, cart))
+
+    server = start_server()
+    host, port = server.server_address[:2]
+    results = {}
+    try:
+        for name in scenarios:
+            timings, errors, lock = [], [0], threading.Lock()
+            per_client = max(1, requests // len(sessions))
+
+            def worker(session_id, cart, seed):
+                worker_rnd = random.Random(seed)
+                csrf_token = get_random_string(32)
+                headers = {'Cookie': f'sessionid={session_id}; csrftoken={csrf_token}', 'X-CSRFToken': csrf_token}
+                for _ in range(per_client):
+                    *setup, measured = scenario_requests(name, cart, worker_rnd, product_ids)
+                    for request in setup:
+                        _http_request(host, port, request, headers)
+                    started = time.perf_counter()
+                    status = _http_request(host, port, measured, headers)
+                    elapsed = (time.perf_counter() - started) * 1000
+                    with lock:
+                        timings.append(elapsed)
+                        errors[0] += status >= 400
+
+            threads = [threading.Thread(target=worker, args=(session_id, cart, rnd.random()))
+                       for session_id, cart in sessions]
+            started = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            duration = time.perf_counter() - started
+            results[name] = _summary(timings, errors[0])
+            results[name]['rps'] = round(len(timings) / duration, 1)
+    finally:
+        server.shutdown()
+        server.server_close()
+    return results
+
+
+def _http_request(host, port, request, headers):
+    method, path, data = request
+    headers = dict(headers)
+    body = None
+    if data is not None:
+        body = urlencode(data)
+        headers['Content-Type'] = 'application/x-www-form-urlencoded'
+    conn = http.client.HTTPConnection(host, port, timeout=60)
+    try:
+        conn.request(method, path, body=body, headers=headers)
+        response = conn.getresponse()
+        response.read()
+        return response.status
+    except OSError:
+        return 599
+    finally:
+        conn.close()
+
+
+def run_checkouts(threads, orders, cart_items, hot_products, rnd=None):
+    """
+    threads потоков параллельно оформляют по orders заказов из cart_items товаров,
+    выбранных среди hot_products популярных: заказы пишут в одни и те же строки склада.
+    Возвращает пропускную способность записи, задержки и число ошибок базы.
+    """
+    rnd = rnd or random.Random(0)
+    hot = list(Product.objects.filter(quantity__gt=0).order_by('pk').values_list('pk', flat=True)[:hot_products])
+    timings, errors, lock = [], Counter(), threading.Lock()
+
+    def worker(seed):
+        worker_rnd = random.Random(seed)
+        try:
+            for _ in range(orders):
+                form = OrderCreateForm(ORDER_FORM)
+                form.is_valid()
+                cart = {pk: worker_rnd.randint(1, 3) for pk in worker_rnd.sample(hot, min(cart_items, len(hot)))}
+                started = time.perf_counter()
+                try:
+                    place_order(form, cart)
+                except DatabaseError as e:
+                    with lock:
+                        errors[str(e)] += 1
+                    continue
+                elapsed = (time.perf_counter() - started) * 1000
+                with lock:
+                    timings.append(elapsed)
+        finally:
+            connection.close()
+
+    workers = [threading.Thread(target=worker, args=(rnd.random(),)) for _ in range(threads)]
+    started = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    duration = time.perf_counter() - started
+    result = _summary(timings, sum(errors.values()))
+    result.update({'orders_per_second': round(len(timings) / duration, 1), 'error_kinds': dict(errors)})
+    return result
+
+
+def find_regressions(baseline, results, tolerance):
+    """
+    Сравнивает результаты с сохраненным прогоном: p95 хуже больше чем на tolerance
+    (доля), больше запросов к базе или ошибки, которых не было, считаются регрессией.
+    """
+    regressions = []
+    for mode, scenarios in results.items():
+        for name, current in scenarios.items():
+            previous = baseline.get(mode, {}).get(name)
+            if not previous:
+                continue
+            if current['p95'] > previous['p95'] * (1 + tolerance):
+                regressions.append(f'{mode}/{name}: p95 {current["p95"]} мс, было {previous["p95"]} мс')
+            if 'queries' in previous and current.get('queries', 0) > previous['queries']:
+                regressions.append(f'{mode}/{name}: запросов к базе {current["queries"]}, было {previous["queries"]}')
+            if current['errors'] > previous['errors']:
+                regressions.append(f'{mode}/{name}: ошибок {current["errors"]}, было {previous["errors"]}')
+    return regressions
+
+
+def load_baseline(path):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)['results']
+
+
+def save_baseline(path, config, results):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'config': config, 'results': results}, f, ensure_ascii=False, indent=2)
@@ -0,0 +1,35 @@
+"""
+Массовая вставка строк без создания объектов модели: bulk_create тратит
+большую часть времени на pre_save и сборку SQL для каждого поля каждой строки.
+"""
+from itertools import islice
+
+from django.db import connections, router
+
+
+def insert_rows(model, fields, rows, batch_size=10000, using=None):
+    """
+    Вставляет в таблицу model строки rows - кортежи значений полей fields
+    (имена полей модели, для внешнего ключа - значение id) - запросами
+    INSERT ... executemany по batch_size строк. rows читается пачками,
+    поэтому может быть генератором. Значения готовит get_db_prep_save поля,
+    как при save(), но pre_save не вызывается: значения по умолчанию и auto_now
+    нужно передать явно. Сигналы не отправляются. База по умолчанию
+    выбирается роутером, как для записи через ORM. Возвращает число строк.
+    """
+    connection = connections[using or router.db_for_write(model)]
+    ops = connection.ops
+    fields = [model._meta.get_field(name) for name in fields]
+    columns = ', '.join(ops.quote_name(field.column) for field in fields)
+    sql = (f'INSERT INTO {ops.quote_name(model._meta.db_table)} ({columns}) '
+           f'VALUES ({", ".join(["%s"] * len(fields))})')
+    rows = iter(rows)
+    inserted = 0
+    with connection.cursor() as cursor:
+        while True:
+            batch = [[field.get_db_prep_save(value, connection) for field, value in zip(fields, row)]
+                     for row in islice(rows, batch_size)]
+            if not batch:
+                return inserted
+            cursor.executemany(sql, batch)
+            inserted += len(batch)
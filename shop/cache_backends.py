@@ -0,0 +1,39 @@
+import os
+
+from django.core.cache.backends.filebased import FileBasedCache
+
+
+class LRUFileBasedCache(FileBasedCache):
+    """
+    Файловый кэш с вытеснением давно не использованных записей.
+    Стандартный FileBasedCache при переполнении удаляет случайные файлы,
+    здесь каждое чтение обновляет время изменения файла, а удаляются
+    файлы с самым старым временем.
+    """
+    def get(self, key, default=None, version=None):
+        missing = object()
+        value = super().get(key, missing, version)
+        if value is missing:
+            return default
+        try:
+            os.utime(self._key_to_file(key, version))
+        except FileNotFoundError:
+            pass
+        return value
+
+    def _cull(self):
+        filelist = self._list_cache_files()
+        num_entries = len(filelist)
+        if num_entries < self._max_entries:
+            return
+        if self._cull_frequency == 0:
+            return self.clear()
+        ages = []
+        for fname in filelist:
+            try:
+                ages.append((os.path.getmtime(fname), fname))
+            except FileNotFoundError:
+                pass
+        ages.sort()
+        for _, fname in ages[:max(1, num_entries // self._cull_frequency)]:
+            self._delete(fname)
@@ -1,5 +1,194 @@
+from decimal import Decimal
+
+from asgiref.sync import sync_to_async
 from django.conf import settings
-from .models import Product
+from django.core.cache import caches
+
+from .models import Product, StoredCart
+
+# Версия формата корзины. Строка корзины: "1|id:количество,id:количество"
+CART_FORMAT_VERSION = 1
+
+
+class CartLimitError(Exception):
+    """
+    В корзине уже максимальное число разных товаров.
+    """
+    def __init__(self, limit):
+        self.limit = limit
+        super().__init__(f'В корзине может быть не больше {limit} разных товаров')
+
+
+class CartContents(object):
+    """
+    Содержимое корзины с загруженными товарами и посчитанными суммами.
+    """
+    def __init__(self, items, total_price, stale_ids):
+        self.items = items
+        self.total_price = total_price
+        # Ключи корзины, для которых товар больше не существует
+        self.stale_ids = stale_ids
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return sum(item['quantity'] for item in self.items)
+
+
+def parse_cart(cart):
+    """
+    Приводит корзину к виду {ключ: (id товара, количество)}.
+    Возвращает также список ключей, которые не удалось разобрать.
+    """
+    quantities = {}
+    invalid = []
+    for key, line in cart.items():
+        quantity = line['quantity'] if isinstance(line, dict) else line
+        try:
+            quantities[key] = (int(key), int(quantity))
+        except (TypeError, ValueError):
+            invalid.append(key)
+    return quantities, invalid
+
+
+def hydrate_cart(cart):
+    """
+    Загружает все товары корзины одним запросом id__in и за один проход
+    считает стоимость строк и общую сумму. Подходит и для корзины вида
+    {id: количество}, и для {id: {'quantity': ..., 'price': ...}}.
+    """
+    quantities, stale_ids = parse_cart(cart)
+    products = Product.objects.in_bulk([product_id for product_id, _ in quantities.values()])
+    return _contents(quantities, stale_ids, products)
+
+
+async def ahydrate_cart(cart):
+    # Асинхронный вариант hydrate_cart, тоже один запрос id__in
+    quantities, stale_ids = parse_cart(cart)
+    products = await Product.objects.ain_bulk([product_id for product_id, _ in quantities.values()])
+    return _contents(quantities, stale_ids, products)
+
+
+def _contents(quantities, stale_ids, products):
+    items = []
+    total_price = Decimal('0')
+    for key, (product_id, quantity) in quantities.items():
+        product = products.get(product_id)
+        if product is None:
+            stale_ids.append(key)
+            continue
+        line_price = product.price * quantity
+        total_price += line_price
+        items.append({'product': product, 'quantity': quantity,
+                      'price': product.price, 'total_price': line_price})
+    return CartContents(items, total_price, stale_ids)
+
+
+def encode_cart(lines):
+    """
+    Корзина {id товара: количество} в компактную строку с версией формата.
+    """
+    return f'{CART_FORMAT_VERSION}|' + ','.join(f'{product_id}:{quantity}' for product_id, quantity in lines.items())
+
+
+def decode_cart(value):
+    """
+    Корзина {id товара: количество} из строки encode_cart. Понимает и старые
+    корзины-словари из сессии. Некорректные строки и строки сверх
+    CART_MAX_LINES отбрасываются.
+    """
+    if isinstance(value, dict):
+        pairs = parse_cart(value)[0].values()
+    elif isinstance(value, str) and value.startswith(f'{CART_FORMAT_VERSION}|'):
+        pairs = []
+        for line in value.split('|', 1)[1].split(','):
+            product_id, _, quantity = line.partition(':')
+            try:
+                pairs.append((int(product_id), int(quantity)))
+            except ValueError:
+                continue
+    else:
+        return {}
+    lines = {}
+    for product_id, quantity in pairs:
+        if product_id > 0 and quantity > 0 and (product_id in lines or len(lines) < settings.CART_MAX_LINES):
+            lines[product_id] = lines.get(product_id, 0) + quantity
+    return lines
+
+
+def drop_stale_ids(cart, contents):
+    # Убираем из корзины удаленные товары, возвращает True если корзина изменилась
+    for key in contents.stale_ids:
+        cart.pop(key, None)
+    return bool(contents.stale_ids)
+
+
+class SessionCartStore(object):
+    """
+    Корзина в сессии под ключом CART_SESSION_ID.
+    """
+    def __init__(self, request):
+        self.session = request.session
+
+    def load(self):
+        return self.session.get(settings.CART_SESSION_ID)
+
+    def save(self, value):
+        if value is None:
+            self.session.pop(settings.CART_SESSION_ID, None)
+        else:
+            self.session[settings.CART_SESSION_ID] = value
+
+
+class DatabaseCartStore(object):
+    """
+    Корзина пользователя в отдельной таблице: запись корзины не переписывает строку сессии.
+    """
+    def __init__(self, request):
+        self.user_id = request.user.pk
+
+    def load(self):
+        return StoredCart.objects.filter(user_id=self.user_id).values_list('data', flat=True).first()
+
+    def save(self, value):
+        if value is None:
+            StoredCart.objects.filter(user_id=self.user_id).delete()
+        elif not StoredCart.objects.filter(user_id=self.user_id).update(data=value):
+            StoredCart.objects.update_or_create(user_id=self.user_id, defaults={'data': value})
+
+
+class CacheCartStore(object):
+    """
+    Корзина пользователя в кэше CART_CACHE_ALIAS.
+    """
+    def __init__(self, request):
+        self.cache = caches[settings.CART_CACHE_ALIAS]
+        self.key = f'cart:{request.user.pk}'
+
+    def load(self):
+        return self.cache.get(self.key)
+
+    def save(self, value):
+        if value is None:
+            self.cache.delete(self.key)
+        else:
+            self.cache.set(self.key, value, settings.CART_CACHE_TIMEOUT)
+
+
+CART_STORES = {
+    'session': SessionCartStore,
+    'db': DatabaseCartStore,
+    'cache': CacheCartStore,
+}
+
+
+def get_cart_store(request):
+    # Корзины гостей всегда хранятся в сессии: у них нет пользователя для ключа
+    user = getattr(request, 'user', None)
+    if user is None or not user.is_authenticated:
+        return SessionCartStore(request)
+    return CART_STORES[settings.CART_STORAGE](request)
 
 
 class Cart(object):
@@ -7,37 +196,93 @@ class Cart(object):
         """
         Инициализируем корзину
         """
-        self.session = request.session
-        cart = self.session.get(settings.CART_SESSION_ID)
-        if not cart:
-            cart = self.session[settings.CART_SESSION_ID] = {}
-        self.cart = cart
+        self.store = get_cart_store(request)
+        self._stored = self.store.load()
+        self.lines = decode_cart(self._stored)
 
     def add_to_cart(self, product, quantity=1, update_quantity=False):
         """
         Добавить продукт в корзину или обновить его количество.
         """
-        product_id = str(product.id)
-        if product_id not in self.cart:
-            self.cart[product_id] = {'quantity': 0,
-                                     'price': str(product.price)}
-        if update_quantity:
-            self.cart[product_id]['quantity'] = quantity
-        else:
-            self.cart[product_id]['quantity'] += quantity
+        self.add(product.id, quantity, update_quantity)
+
+    @classmethod
+    async def aload(cls, request):
+        # Хранилище корзины синхронное (сессия, таблица или кэш), читаем его в потоке
+        return await sync_to_async(cls)(request)
+
+    def add(self, product_id, quantity=1, update_quantity=False):
+        self._set_quantity(product_id, quantity, update_quantity)
         self.save_cart()
 
+    async def aadd(self, product_id, quantity=1, update_quantity=False):
+        self._set_quantity(product_id, quantity, update_quantity)
+        await self.asave_cart()
+
+    def _set_quantity(self, product_id, quantity, update_quantity):
+        if product_id not in self.lines and len(self.lines) >= settings.CART_MAX_LINES:
+            raise CartLimitError(settings.CART_MAX_LINES)
+        if not update_quantity:
+            quantity += self.lines.get(product_id, 0)
+        if quantity > 0:
+            self.lines[product_id] = quantity
+        else:
+            self.lines.pop(product_id, None)
+
+    def _encoded(self):
+        return encode_cart(self.lines) if self.lines else None
+
     def save_cart(self):
-        # Обновление сессии cart
-        self.session[settings.CART_SESSION_ID] = self.cart
-        # Отметить сеанс как "измененный", чтобы убедиться, что он сохранен
-        self.session.modified = True
+        # Хранилище пишется, только если содержимое корзины действительно изменилось
+        value = self._encoded()
+        if value != self._stored:
+            self.store.save(value)
+            self._stored = value
+
+    async def asave_cart(self):
+        value = self._encoded()
+        if value != self._stored:
+            await sync_to_async(self.store.save)(value)
+            self._stored = value
 
     def remove_from_cart(self, product):
         """
         Удаление товара из корзины.
         """
-        product_id = str(product.id)
-        if product_id in self.cart:
-            del self.cart[product_id]
+        self.remove(product.id)
+
+    def remove(self, product_id):
+        if self.lines.pop(product_id, None) is not None:
+            self.save_cart()
+
+    def clear(self):
+        self.lines = {}
+        self.save_cart()
+
+    def get_contents(self):
+        """
+        Товары корзины с суммами. Удаленные товары убираются из корзины.
+        """
+        contents = hydrate_cart(self.lines)
+        if drop_stale_ids(self.lines, contents):
             self.save_cart()
+        return contents
+
+    async def aget_contents(self):
+        contents = await ahydrate_cart(self.lines)
+        if drop_stale_ids(self.lines, contents):
+            await self.asave_cart()
+        return contents
+
+    async def aremove(self, product_id):
+        if self.lines.pop(product_id, None) is not None:
+            await self.asave_cart()
+
+    def __iter__(self):
+        return iter(self.get_contents())
+
+    def __len__(self):
+        return sum(self.lines.values())
+
+    def get_total_price(self):
+        return self.get_contents().total_price
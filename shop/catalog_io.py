@@ -0,0 +1,174 @@
+"""
+Потоковый импорт и экспорт каталога в CSV и JSONL. Строки читаются и пишутся
+по одной, товары сохраняются пачками, поэтому память не зависит от размера файла.
+"""
+import csv
+import json
+import time
+from decimal import Decimal, InvalidOperation
+
+from django.db import reset_queries, transaction
+
+from .facets import facet_keys, product_changed
+from .models import Product
+from .page_cache import invalidate_products
+from .search import index_products
+
+FIELDS = ('sku', 'name', 'characteristics', 'price', 'quantity', 'image')
+# Поля, которые импорт обновляет у существующего товара с тем же артикулом
+UPDATE_FIELDS = ('name', 'characteristics', 'price', 'quantity', 'image')
+FORMATS = ('csv', 'jsonl')
+# Product.price: 10 знаков, из них 2 после запятой
+MAX_PRICE = Decimal(10) ** 8
+
+
+class RowError(Exception):
+    """
+    Строка файла импорта с ошибкой, line - ее номер.
+    """
+    def __init__(self, line, message):
+        self.line = line
+        super().__init__(f'Строка {line}: {message}')
+
+
+def detect_format(path, default='csv'):
+    for name in FORMATS:
+        if str(path).endswith(f'.{name}'):
+            return name
+    return default
+
+
+def read_rows(stream, fmt):
+    """
+    Строки файла [(номер строки, словарь)] по одной.
+    """
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+    else:
+        for line, text in enumerate(stream, 1):
+            if text.strip():
+                try:
+                    yield line, json.loads(text)
+                except ValueError as e:
+                    yield line, RowError(line, f'некорректный JSON: {e}')
+
+
+def parse_row(line, row):
+    """
+    Товар из строки импорта. Ошибки данных - RowError.
+    """
+    if isinstance(row, RowError):
+        raise row
+    sku = str(row.get('sku') or '').strip()
+    name = str(row.get('name') or '').strip()
+    if not sku:
+        raise RowError(line, 'нет артикула')
+    if not name or len(name) > Product._meta.get_field('name').max_length:
+        raise RowError(line, 'пустое или слишком длинное название')
+    if len(sku) > Product._meta.get_field('sku').max_length:
+        raise RowError(line, 'слишком длинный артикул')
+    try:
+        price = Decimal(str(row.get('price')))
+        # NaN и Infinity Decimal принимает, но quantize и сравнение с ними падают
+        if not price.is_finite():
+            raise ValueError(price)
+        price = price.quantize(Decimal('0.01'))
+        quantity = int(row.get('quantity') or 0)
+    except (InvalidOperation, TypeError, ValueError):
+        raise RowError(line, 'некорректная цена или количество')
+    if price < 0 or quantity < 0:
+        raise RowError(line, 'отрицательная цена или количество')
+    if price >= MAX_PRICE:
+        raise RowError(line, 'слишком большая цена')
+    return Product(sku=sku, name=name, characteristics=str(row.get('characteristics') or ''),
+                   price=price, quantity=quantity, image=row.get('image') or None)
+
+
+def _save_batch(batch, reindex):
+    # Повтор артикула в одной пачке: INSERT ... ON CONFLICT не может обновить строку дважды
+    products = list({product.sku: product for product in batch}.values())
+    skus = [product.sku for product in products]
+    with transaction.atomic():
+        if reindex:
+            previous = list(Product.objects.filter(sku__in=skus).values_list('price', 'quantity'))
+        Product.objects.bulk_create(products, update_conflicts=True, unique_fields=['sku'],
+                                    update_fields=list(UPDATE_FIELDS))
+        if reindex:
+            # bulk_create не вызывает сигналов: индекс, счетчики и кэш обновляются
+            # так же, как при сохранении товара, только для товаров пачки
+            product_ids = list(Product.objects.filter(sku__in=skus).values_list('pk', flat=True))
+            index_products(product_ids)
+            product_changed([key for price, quantity in previous for key in facet_keys(price, quantity)],
+                            [key for product in products for key in facet_keys(product.price, product.quantity)])
+            invalidate_products(product_ids)
+    # При DEBUG=True Django хранит текст всех запросов, а INSERT пачки большой
+    reset_queries()
+    return len(products)
+
+
+def import_products(rows, batch_size=2000, errors=None, progress=None, progress_every=100000, rebuild=True):
+    """
+    Добавляет товары из rows (результат read_rows) и обновляет товары с теми же
+    артикулами одним INSERT ... ON CONFLICT DO UPDATE на пачку из batch_size строк,
+    каждая пачка в своей транзакции. Строки с ошибками пропускаются и передаются
+    в errors(RowError), примерно каждые progress_every строк вызывается progress(stats).
+    С rebuild в той же транзакции обновляются индекс поиска, счетчики каталога и кэш
+    страниц товаров пачки; без него индекс и счетчики нужно перестроить отдельно
+    (rebuild_search_index, rebuild_catalog_facets).
+    Возвращает {'rows', 'saved', 'errors', 'seconds', 'rows_per_second'}.
+    """
+    started = time.perf_counter()
+    stats = {'rows': 0, 'saved': 0, 'errors': 0}
+    batch = []
+    report_at = progress_every
+    for line, row in rows:
+        stats['rows'] += 1
+        try:
+            batch.append(parse_row(line, row))
+        except RowError as e:
+            stats['errors'] += 1
+            if errors:
+                errors(e)
+            continue
+        if len(batch) == batch_size:
+            stats['saved'] += _save_batch(batch, rebuild)
+            batch = []
+            if progress and stats['rows'] >= report_at:
+                progress(stats)
+                report_at += progress_every
+    if batch:
+        stats['saved'] += _save_batch(batch, rebuild)
+    return _with_rate(stats, started)
+
+
+def export_products(stream, fmt, chunk_size=2000, progress=None, progress_every=100000):
+    """
+    Пишет каталог в stream по одной строке. Товары читаются курсором базы
+    пачками по chunk_size, а не загружаются в память целиком.
+    Каждые progress_every строк вызывается progress(stats).
+    """
+    started = time.perf_counter()
+    stats = {'rows': 0}
+    rows = Product.objects.order_by('pk').values_list(*FIELDS).iterator(chunk_size=chunk_size)
+    writer = csv.writer(stream) if fmt == 'csv' else None
+    if writer:
+        writer.writerow(FIELDS)
+    for values in rows:
+        values = [str(value) if isinstance(value, Decimal) else value for value in values]
+        if writer:
+            writer.writerow(['' if value is None else value for value in values])
+        else:
+            stream.write(json.dumps(dict(zip(FIELDS, values)), ensure_ascii=False) + '\n')
+        stats['rows'] += 1
+        if progress and stats['rows'] % progress_every == 0:
+            progress(stats)
+    return _with_rate(stats, started)
+
+
+def _with_rate(stats, started):
+    seconds = time.perf_counter() - started
+    stats['seconds'] = round(seconds, 2)
+    stats['rows_per_second'] = round(stats['rows'] / seconds) if seconds else 0
+    return stats
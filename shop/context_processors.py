@@ -1,2 +0,0 @@
-def user_status(request):
-    return {'user': request.user}
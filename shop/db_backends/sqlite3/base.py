@@ -0,0 +1,35 @@
+"""
+Бэкенд SQLite с настройками соединения из OPTIONS:
+
+init_command - PRAGMA (через ';'), выполняемые при открытии соединения;
+transaction_mode - режим BEGIN для transaction.atomic (DEFERRED, IMMEDIATE, EXCLUSIVE).
+
+В Django 5.1 такие же параметры есть у встроенного бэкенда.
+"""
+from django.core.exceptions import ImproperlyConfigured
+from django.db.backends.sqlite3 import base
+
+TRANSACTION_MODES = ('DEFERRED', 'IMMEDIATE', 'EXCLUSIVE')
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    def get_connection_params(self):
+        params = super().get_connection_params()
+        self.init_command = params.pop('init_command', '')
+        self.transaction_mode = (params.pop('transaction_mode', None) or 'DEFERRED').upper()
+        if self.transaction_mode not in TRANSACTION_MODES:
+            raise ImproperlyConfigured(f'transaction_mode должен быть одним из {", ".join(TRANSACTION_MODES)}')
+        return params
+
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        for statement in self.init_command.split(';'):
+            if statement.strip():
+                conn.execute(statement)
+        return conn
+
+    def _start_transaction_under_autocommit(self):
+        # BEGIN IMMEDIATE сразу берет блокировку записи: транзакция, которая
+        # сначала читает, а потом пишет, ждет busy timeout, а не падает
+        # с "database is locked" при попытке повысить блокировку
+        self.cursor().execute(f'BEGIN {self.transaction_mode}')
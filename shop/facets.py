@@ -0,0 +1,130 @@
+from collections import Counter
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, Count, F, IntegerField, Q, Value, When
+
+from .models import CatalogFacet, Product
+
+# Ключи счетчиков: все товары, товары в наличии и диапазоны цен.
+# Для диапазонов цен есть отдельные счетчики по товарам в наличии.
+TOTAL = 'total'
+IN_STOCK = 'in_stock'
+IN_STOCK_PREFIX = 'in_stock:'
+
+
+def price_buckets():
+    """
+    Диапазоны цен [(ключ, от, до)], "до" не включается, у последнего диапазона его нет.
+    """
+    bounds = settings.PRICE_FACET_BOUNDS
+    buckets = []
+    for index, low in enumerate(bounds):
+        high = bounds[index + 1] if index + 1 < len(bounds) else None
+        buckets.append((f'price:{low}-{"" if high is None else high}', low, high))
+    return buckets
+
+
+def _bucket_condition(low, high):
+    condition = Q(price__gte=low)
+    if high is not None:
+        condition &= Q(price__lt=high)
+    return condition
+
+
+def bucket_key(price):
+    for key, low, high in price_buckets():
+        if price >= low and (high is None or price < high):
+            return key
+    return None
+
+
+def facet_keys(price, quantity):
+    """
+    Счетчики, в которые входит товар с ценой price и количеством quantity.
+    """
+    bucket = bucket_key(price)
+    keys = [TOTAL] + ([bucket] if bucket else [])
+    if quantity > 0:
+        keys += [IN_STOCK] + ([IN_STOCK_PREFIX + bucket] if bucket else [])
+    return keys
+
+
+def in_stock_keys(prices):
+    # Счетчики наличия для товаров с ценами prices
+    deltas = Counter()
+    for price in prices:
+        deltas.update(key for key in facet_keys(price, 1) if key == IN_STOCK or key.startswith(IN_STOCK_PREFIX))
+    return deltas
+
+
+@transaction.atomic
+def apply_deltas(deltas):
+    """
+    Изменяет счетчики на deltas ({ключ: изменение}) одним UPDATE с F(),
+    без пересчета по таблице товаров.
+    """
+    deltas = {key: delta for key, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    # Новые счетчики (например, после изменения PRICE_FACET_BOUNDS) создаются с нулем,
+    # уже существующие INSERT пропускает
+    CatalogFacet.objects.bulk_create([CatalogFacet(key=key) for key in deltas], ignore_conflicts=True)
+    amount = Case(*[When(key=key, then=Value(delta)) for key, delta in deltas.items()],
+                  output_field=IntegerField())
+    CatalogFacet.objects.filter(key__in=deltas).update(count=F('count') + amount)
+
+
+@transaction.atomic
+def recount_in_stock(prices):
+    """
+    Заново считает счетчик наличия и счетчики наличия диапазонов цен, в которые
+    входят цены prices, по частичным индексам товаров в наличии. В отличие от
+    apply_deltas, повторный вызов безопасен и исправляет накопившееся расхождение.
+    """
+    in_stock = Product.objects.filter(quantity__gt=0)
+    keys = {bucket_key(price) for price in prices}
+    counts = {IN_STOCK: in_stock.count()}
+    for key, low, high in price_buckets():
+        if key in keys:
+            counts[IN_STOCK_PREFIX + key] = in_stock.filter(_bucket_condition(low, high)).count()
+    CatalogFacet.objects.bulk_create([CatalogFacet(key=key) for key in counts], ignore_conflicts=True)
+    CatalogFacet.objects.filter(key__in=counts).update(
+        count=Case(*[When(key=key, then=Value(count)) for key, count in counts.items()], output_field=IntegerField()))
+    return counts
+
+
+def product_changed(old_keys, new_keys):
+    deltas = Counter(new_keys)
+    deltas.subtract(old_keys)
+    apply_deltas(deltas)
+
+
+@transaction.atomic
+def rebuild_facets():
+    """
+    Пересчитывает все счетчики одним агрегирующим запросом по таблице товаров.
+    """
+    in_stock = Q(quantity__gt=0)
+    aggregates = {TOTAL: Count('pk'), IN_STOCK: Count('pk', filter=in_stock)}
+    for key, low, high in price_buckets():
+        aggregates[key] = Count('pk', filter=_bucket_condition(low, high))
+        aggregates[IN_STOCK_PREFIX + key] = Count('pk', filter=_bucket_condition(low, high) & in_stock)
+    # Имена агрегатов не могут содержать ':' и '-', поэтому передаются по номерам
+    keys = list(aggregates)
+    counts = Product.objects.aggregate(**{f'f{index}': aggregates[key] for index, key in enumerate(keys)})
+    CatalogFacet.objects.all().delete()
+    CatalogFacet.objects.bulk_create([CatalogFacet(key=key, count=counts[f'f{index}'])
+                                      for index, key in enumerate(keys)])
+    return {key: counts[f'f{index}'] for index, key in enumerate(keys)}
+
+
+def get_facets():
+    """
+    Счетчики каталога {ключ: число товаров}, отсутствующие счетчики равны 0.
+    """
+    return Counter(dict(CatalogFacet.objects.values_list('key', 'count')))
+
+
+async def aget_facets():
+    return Counter({key: count async for key, count in CatalogFacet.objects.values_list('key', 'count')})
@@ -0,0 +1,96 @@
+"""
+Локальный SMTP-сервер для тестов и разработки: принимает письма и хранит их
+в памяти, ничего никуда не отправляя. Считает соединения, чтобы проверять,
+что письма пачки отправляются через одно соединение.
+"""
+import socketserver
+import threading
+
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write(f'{line}\r\n'.encode())
+
+    def handle(self):
+        server = self.server.owner
+        with server.lock:
+            server.connections += 1
+        self.reply('220 localhost fake SMTP')
+        mail_from, recipients = None, []
+        for raw in self.rfile:
+            command, _, argument = raw.decode().rstrip('\r\n').partition(' ')
+            command = command.upper()
+            if command == 'EHLO':
+                self.reply('250-localhost')
+                self.reply('250 8BITMIME')
+            elif command == 'HELO':
+                self.reply('250 localhost')
+            elif command == 'MAIL':
+                mail_from, recipients = _address(argument), []
+                self.reply('250 OK')
+            elif command == 'RCPT':
+                address = _address(argument)
+                if address in server.reject:
+                    self.reply('550 Mailbox unavailable')
+                else:
+                    recipients.append(address)
+                    self.reply('250 OK')
+            elif command == 'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                lines = []
+                for data in self.rfile:
+                    data = data.decode().rstrip('\r\n')
+                    if data == '.':
+                        break
+                    lines.append(data[1:] if data.startswith('..') else data)
+                with server.lock:
+                    server.messages.append({'from': mail_from, 'to': recipients, 'data': '\n'.join(lines)})
+                self.reply('250 OK')
+            elif command in ('RSET', 'NOOP'):
+                self.reply('250 OK')
+            elif command == 'QUIT':
+                self.reply('221 Bye')
+                return
+            else:
+                self.reply('502 Command not implemented')
+
+
+def _address(argument):
+    # "FROM:<a@example.com> SIZE=100" -> a@example.com
+    return argument.partition(':')[2].split(' ')[0].strip('<>')
+
+
+class FakeSMTPServer(object):
+    """
+    Запускается в фоновом потоке на свободном порту:
+
+        with FakeSMTPServer() as smtp:
+            with override_settings(EMAIL_HOST=smtp.host, EMAIL_PORT=smtp.port, ...):
+                ...
+            smtp.messages
+
+    Письма на адреса из reject отклоняются с кодом 550.
+    """
+    def __init__(self, host='127.0.0.1', port=0, reject=()):
+        self.reject = set(reject)
+        self.messages = []
+        self.connections = 0
+        self.lock = threading.Lock()
+        self._server = socketserver.ThreadingTCPServer((host, port), _SMTPHandler)
+        self._server.daemon_threads = True
+        self._server.owner = self
+        self.host, self.port = self._server.server_address[:2]
+
+    def start(self):
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
@@ -0,0 +1,90 @@
+from decimal import Decimal, InvalidOperation
+from urllib.parse import urlencode
+
+from django.db.models import Q
+
+from .facets import IN_STOCK, IN_STOCK_PREFIX, TOTAL, price_buckets
+from .pagination import DEFAULT_ORDERING, get_ordering
+from .search import name_filter
+
+
+def _price(value):
+    # Некорректную цену в URL считаем отсутствующей
+    try:
+        price = Decimal(value)
+    except (TypeError, InvalidOperation):
+        return None
+    return price if price.is_finite() and price >= 0 else None
+
+
+def get_filters(request):
+    """
+    Фильтры каталога из GET-параметров: цена от (включительно) и до (не включительно),
+    только в наличии, слова в названии, сортировка. Пустые фильтры отбрасываются,
+    поэтому одинаковые выборки дают одинаковый ключ кэша.
+    """
+    filters = {}
+    for name in ('min_price', 'max_price'):
+        price = _price(request.GET.get(name))
+        if price is not None:
+            filters[name] = str(price)
+    if request.GET.get('in_stock') == '1':
+        filters['in_stock'] = '1'
+    query = ' '.join(request.GET.get('q', '').split())
+    if query:
+        filters['q'] = query
+    ordering = get_ordering(request)
+    if ordering != DEFAULT_ORDERING:
+        filters['sort'] = ordering
+    return filters
+
+
+def filter_products(queryset, filters):
+    condition = Q()
+    if 'min_price' in filters:
+        condition &= Q(price__gte=filters['min_price'])
+    if 'max_price' in filters:
+        condition &= Q(price__lt=filters['max_price'])
+    if 'in_stock' in filters:
+        condition &= Q(quantity__gt=0)
+    if 'q' in filters:
+        condition &= name_filter(filters['q'])
+    return queryset.filter(condition)
+
+
+def filter_query(filters, **changes):
+    """
+    Строка запроса с фильтрами filters, измененными на changes (None убирает фильтр).
+    """
+    params = dict(filters)
+    for name, value in changes.items():
+        if value is None:
+            params.pop(name, None)
+        else:
+            params[name] = str(value)
+    return urlencode(params)
+
+
+def price_facets(filters, counts):
+    """
+    Ссылки фильтра по диапазонам цен с числом товаров из счетчиков counts.
+    При фильтре "в наличии" показываются счетчики товаров в наличии.
+    """
+    in_stock = 'in_stock' in filters
+    links = []
+    for key, low, high in price_buckets():
+        links.append({
+            'low': low,
+            'high': high,
+            'count': counts[IN_STOCK_PREFIX + key if in_stock else key],
+            'query': filter_query(filters, min_price=low, max_price=high),
+            'active': filters.get('min_price') == str(Decimal(low))
+                      and filters.get('max_price') == (None if high is None else str(Decimal(high))),
+        })
+    return {
+        'prices': links,
+        'total': counts[IN_STOCK if in_stock else TOTAL],
+        'in_stock': counts[IN_STOCK],
+        'all_prices_query': filter_query(filters, min_price=None, max_price=None),
+        'in_stock_query': filter_query(filters, in_stock=None if in_stock else '1'),
+    }
@@ -0,0 +1,149 @@
+"""
+Миниатюры изображений товаров. Исходное изображение скачивается (или берется
+из хранилища файлов) один раз, из него делаются уменьшенные копии в WebP и JPEG
+для ширин PRODUCT_IMAGE_WIDTHS. Имена файлов строятся из хэша содержимого
+исходника, поэтому одинаковые картинки разных товаров хранятся один раз,
+а повторная обработка не переписывает готовые файлы.
+"""
+import hashlib
+import io
+from urllib.parse import urlsplit
+from urllib.request import Request, urlopen
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured, SuspiciousOperation
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+
+from .models import Product
+from .page_cache import invalidate_products
+from .tasks import task
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = ImageOps = None
+
+# Формат Pillow и расширение файла для каждого формата миниатюр
+FORMATS = {'webp': ('WEBP', 'webp'), 'jpeg': ('JPEG', 'jpg')}
+
+
+class ImageSourceError(Exception):
+    """
+    Исходное изображение не удалось получить или прочитать.
+    """
+
+
+def fetch_source(source):
+    """
+    Содержимое исходного изображения: http(s)-адрес скачивается,
+    иначе source считается именем файла в хранилище (импорт).
+    Другие схемы (file:, ftp:) и имена вне хранилища (../x) - ошибка источника.
+    """
+    limit = settings.PRODUCT_IMAGE_MAX_BYTES
+    scheme = urlsplit(source).scheme
+    if scheme not in ('', 'http', 'https'):
+        raise ImageSourceError(f'{source}: неподдерживаемая схема {scheme}')
+    try:
+        if scheme:
+            request = Request(source, headers={'User-Agent': 'shop-image-pipeline'})
+            with urlopen(request, timeout=settings.PRODUCT_IMAGE_FETCH_TIMEOUT) as response:
+                data = response.read(limit + 1)
+        else:
+            with default_storage.open(source) as f:
+                data = f.read(limit + 1)
+    except (OSError, ValueError, SuspiciousOperation) as e:
+        raise ImageSourceError(f'{source}: {e}') from e
+    if len(data) > limit:
+        raise ImageSourceError(f'{source}: больше {limit} байт')
+    return data
+
+
+def variant_name(digest, width, extension):
+    # Каталоги по первым символам хэша, чтобы в одном каталоге не было слишком много файлов
+    return f'{settings.PRODUCT_IMAGE_DIR}/{digest[:2]}/{digest}-{width}.{extension}'
+
+
+def _resized(image, width):
+    if image.width <= width:
+        return image
+    return image.resize((width, round(image.height * width / image.width)), Image.LANCZOS)
+
+
+def _jpeg_ready(image):
+    # В JPEG нет прозрачности: прозрачные области заливаются белым
+    if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, 'white')
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+    return image.convert('RGB')
+
+
+def make_variants(data, source=''):
+    """
+    Сохраняет миниатюры изображения data и возвращает их описание для
+    Product.image_variants: {'source', 'hash', 'width', 'height', формат: {ширина: имя файла}}.
+    Ширины больше исходной не делаются, кроме самой маленькой.
+    """
+    if Image is None:
+        raise ImproperlyConfigured('Для миниатюр изображений нужен Pillow: pip install Pillow')
+    digest = hashlib.sha256(data).hexdigest()
+    try:
+        image = Image.open(io.BytesIO(data))
+        image = ImageOps.exif_transpose(image)
+    except (OSError, Image.DecompressionBombError) as e:
+        raise ImageSourceError(f'{source}: {e}') from e
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'transparency' in image.info or image.mode in ('LA', 'PA') else 'RGB')
+
+    widths = sorted(settings.PRODUCT_IMAGE_WIDTHS)
+    widths = [widths[0]] + [width for width in widths[1:] if width <= image.width]
+    variants = {'source': source, 'hash': digest, 'width': image.width, 'height': image.height}
+    for name in settings.PRODUCT_IMAGE_FORMATS:
+        pil_format, extension = FORMATS[name]
+        variants[name] = {}
+        for width in widths:
+            path = variant_name(digest, width, extension)
+            if not default_storage.exists(path):
+                resized = _resized(image, width)
+                if pil_format == 'JPEG':
+                    resized = _jpeg_ready(resized)
+                buffer = io.BytesIO()
+                resized.save(buffer, pil_format, quality=settings.PRODUCT_IMAGE_QUALITY, optimize=True)
+                default_storage.save(path, ContentFile(buffer.getvalue()))
+            variants[name][str(width)] = path
+    return variants
+
+
+def process_source(source):
+    """
+    Скачивает источник и делает миниатюры. Не обращается к базе,
+    поэтому подходит для отдельных процессов.
+    """
+    return make_variants(fetch_source(source), source)
+
+
+def needs_processing(product, force=False):
+    return bool(product.image) and (force or product.image_variants.get('source') != product.image)
+
+
+def save_variants(product_ids, variants):
+    """
+    Записывает миниатюры товарам product_ids одним UPDATE. UPDATE не вызывает
+    сигналов, поэтому кэш страниц этих товаров сбрасывается отдельно.
+    """
+    updated = Product.objects.filter(pk__in=product_ids, image=variants['source']).update(image_variants=variants)
+    invalidate_products(product_ids)
+    return updated
+
+
+@task(name='process_product_image')
+def process_product_image(product_id, force=False):
+    product = Product.objects.filter(pk=product_id).first()
+    if product is not None and needs_processing(product, force):
+        save_variants([product.pk], process_source(product.image))
+
+
+def srcset(variants, name):
+    return ', '.join(f'{default_storage.url(path)} {width}w' for width, path in variants.get(name, {}).items())
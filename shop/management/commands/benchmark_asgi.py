@@ -0,0 +1,220 @@
+import asyncio
+import importlib.util
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.urls import reverse
+from django.utils.crypto import get_random_string
+
+from shop.benchmarks import _summary, seed
+from shop.models import Product
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает WSGI (runserver, поток на соединение) и ASGI (uvicorn, async-представления) '
+            'при большом числе одновременных медленных клиентов: запросы в секунду, задержки, '
+            'память и число потоков процесса сервера.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--modes', default='wsgi,asgi')
+        parser.add_argument('--products', type=int, default=5000)
+        parser.add_argument('--users', type=int, default=50)
+        parser.add_argument('--clients', type=int, default=200, help='Одновременных клиентов')
+        parser.add_argument('--requests', type=int, default=5, help='Запросов на клиента')
+        parser.add_argument('--slow', type=float, default=0.2,
+                            help='Сколько секунд клиент передает заголовки запроса')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help='Сохранить результаты в JSON')
+
+    def handle(self, *args, **options):
+        modes = [mode for mode in options['modes'].split(',') if mode]
+        if set(modes) - {'wsgi', 'asgi'}:
+            raise CommandError('Режимы: wsgi, asgi')
+        if 'asgi' in modes and importlib.util.find_spec('uvicorn') is None:
+            raise CommandError('Для режима asgi нужен uvicorn: pip install uvicorn')
+
+        rnd = random.Random(options['seed'])
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            customers = seed(options['products'], options['users'], cart_items=3, rnd=rnd)
+            sessions = []
+            for user, _ in customers:
+                client = Client()
+                client.force_login(user)
+                sessions.append(client.cookies[settings.SESSION_COOKIE_NAME].value)
+            product_ids = list(Product.objects.filter(quantity__gt=0).values_list('pk', flat=True))
+            database = str(connection.settings_dict['NAME'])
+            connection.close()
+
+            results = {}
+            for mode in modes:
+                results[mode] = self.run_mode(mode, database, sessions, product_ids, options, rnd)
+                self.stdout.write(f'{mode:5} ' + ' '.join(f'{key}={value}' for key, value in results[mode].items()))
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                json.dump({'config': {key: options[key] for key in ('products', 'users', 'clients', 'requests',
+                                                                      'slow')},
+                           'results': results}, f, ensure_ascii=False, indent=2)
+
+    def run_mode(self, mode, database, sessions, product_ids, options, rnd):
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            port = sock.getsockname()[1]
+        # Серверы работают с тестовой базой, заполненной этой командой
+        database_env = 'POSTGRES_DB' if connection.vendor == 'postgresql' else 'SQLITE_PATH'
+        # У каждого режима свои пустые файловые кэши страниц и сессий: иначе второй режим
+        # работал бы с кэшем, прогретым первым. Сессии есть в базе, кэш заполнится при чтении
+        cache_dir = tempfile.TemporaryDirectory(prefix=f'benchmark_{mode}_')
+        env = {**os.environ, database_env: database, 'ASYNC_VIEWS': '1' if mode == 'asgi' else '0',
+               'REQUEST_METRICS_SAMPLE_RATE': '0',
+               'PAGE_CACHE_DIR': os.path.join(cache_dir.name, 'pages'),
+               'SESSION_CACHE_DIR': os.path.join(cache_dir.name, 'sessions')}
+        if mode == 'asgi':
+            command = [sys.executable, '-m', 'uvicorn', 'main.asgi:application', '--host', '127.0.0.1',
+                       '--port', str(port), '--log-level', 'warning', '--no-access-log']
+        else:
+            command = [sys.executable, os.path.join(settings.BASE_DIR, 'manage.py'), 'runserver',
+                       f'127.0.0.1:{port}', '--noreload', '--skip-checks']
+        server = subprocess.Popen(command, env=env, cwd=settings.BASE_DIR,
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            self.wait_for_port(port, server)
+            usage = ProcessUsage(server.pid)
+            usage.start()
+            started = time.perf_counter()
+            timings, errors = asyncio.run(self.drive(port, sessions, product_ids, options, rnd))
+            duration = time.perf_counter() - started
+            usage.stop()
+        finally:
+            server.terminate()
+            server.wait()
+            cache_dir.cleanup()
+        result = _summary(timings, errors)
+        result['rps'] = round(len(timings) / duration, 1)
+        result.update(usage.report())
+        return result
+
+    def wait_for_port(self, port, server, timeout=30):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if server.poll() is not None:
+                raise CommandError('Сервер завершился при запуске')
+            try:
+                with socket.create_connection(('127.0.0.1', port), timeout=1):
+                    return
+            except OSError:
+                time.sleep(0.1)
+        raise CommandError('Сервер не запустился')
+
+    async def drive(self, port, sessions, product_ids, options, rnd):
+        timings, errors = [], [0]
+
+        async def client(number, seed):
+            client_rnd = random.Random(seed)
+            session_id = sessions[number % len(sessions)]
+            csrf_token = get_random_string(32)
+            for _ in range(options['requests']):
+                method, path, body = self.pick_request(client_rnd, product_ids)
+                started = time.perf_counter()
+                try:
+                    status = await self.slow_request(port, method, path, body, session_id, csrf_token,
+                                                     options['slow'])
+                except OSError:
+                    status = 599
+                if status >= 400:
+                    errors[0] += 1
+                else:
+                    timings.append((time.perf_counter() - started) * 1000)
+
+        await asyncio.gather(*(client(number, rnd.random()) for number in range(options['clients'])))
+        return timings, errors[0]
+
+    def pick_request(self, rnd, product_ids):
+        kind = rnd.choice(('product_list', 'product_detail', 'cart', 'add_to_cart'))
+        if kind == 'product_list':
+            params = rnd.choice(({}, {'sort': 'price'}, {'in_stock': '1', 'min_price': '1000'}))
+            return 'GET', f'{reverse("product_list")}?{urlencode(params)}', None
+        if kind == 'product_detail':
+            return 'GET', reverse('product_detail', args=[rnd.choice(product_ids)]), None
+        if kind == 'cart':
+            return 'GET', reverse('cart'), None
+        return 'POST', reverse('add_to_cart', args=[rnd.choice(product_ids)]), 'quantity=1'
+
+    async def slow_request(self, port, method, path, body, session_id, csrf_token, slow):
+        # Медленный клиент: заголовки приходят серверу по частям в течение slow секунд
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        try:
+            headers = [
+                f'{method} {path} HTTP/1.1',
+                f'Host: 127.0.0.1:{port}',
+                f'Cookie: {settings.SESSION_COOKIE_NAME}={session_id}; {settings.CSRF_COOKIE_NAME}={csrf_token}',
+                f'X-CSRFToken: {csrf_token}',
+                'Connection: close',
+            ]
+            if body is not None:
+                headers += ['Content-Type: application/x-www-form-urlencoded', f'Content-Length: {len(body)}']
+            for header in headers:
+                writer.write(f'{header}\r\n'.encode())
+                await writer.drain()
+                await asyncio.sleep(slow / len(headers))
+            writer.write(b'\r\n' + (body or '').encode())
+            await writer.drain()
+            status_line = await reader.readline()
+            await reader.read()
+            return int(status_line.split()[1]) if status_line else 599
+        finally:
+            writer.close()
+
+
+class ProcessUsage(threading.Thread):
+    """
+    Следит за памятью (RSS) и числом потоков процесса сервера по /proc (Linux).
+    """
+    def __init__(self, pid, interval=0.05):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.rss_start = self.rss_peak = self.threads_peak = None
+
+    def read(self):
+        try:
+            with open(f'/proc/{self.pid}/status') as f:
+                status = dict(line.split(':', 1) for line in f if ':' in line)
+        except OSError:
+            return None, None
+        return int(status['VmRSS'].split()[0]) / 1024, int(status['Threads'])
+
+    def run(self):
+        self.rss_start, self.threads_peak = self.read()
+        self.rss_peak = self.rss_start
+        while not self.stopped.wait(self.interval):
+            rss, threads = self.read()
+            if rss is not None:
+                self.rss_peak = max(self.rss_peak, rss)
+                self.threads_peak = max(self.threads_peak, threads)
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+    def report(self):
+        if self.rss_start is None:
+            return {}
+        return {'rss_start_mib': round(self.rss_start, 1), 'rss_peak_mib': round(self.rss_peak, 1),
+                'rss_growth_mib': round(self.rss_peak - self.rss_start, 1), 'threads_peak': self.threads_peak}
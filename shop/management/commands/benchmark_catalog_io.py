@@ -0,0 +1,66 @@
+import json
+import os
+import random
+import resource
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from shop.benchmarks import write_catalog_file
+from shop.catalog_io import FORMATS, export_products, import_products, read_rows
+from shop.facets import rebuild_facets
+from shop.search import rebuild_index
+
+
+class Command(BaseCommand):
+    help = ('Замеряет импорт (добавление и обновление) и экспорт каталога на синтетическом файле '
+            'в отдельной тестовой базе: строк в секунду и пиковую память процесса.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=100000)
+        parser.add_argument('--format', choices=FORMATS, default='csv')
+        parser.add_argument('--batch-size', type=int, default=2000)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help='Сохранить результаты в JSON')
+
+    def handle(self, *args, **options):
+        fmt = options['format']
+        results = {}
+        with tempfile.TemporaryDirectory() as directory:
+            source = os.path.join(directory, f'catalog.{fmt}')
+            with open(source, 'w', encoding='utf-8', newline='') as f:
+                write_catalog_file(f, fmt, options['rows'], random.Random(options['seed']))
+
+            old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+            try:
+                # Первый прогон добавляет товары, второй обновляет те же артикулы;
+                # индекс поиска и счетчики перестраиваются и замеряются отдельно
+                for stage in ('insert', 'update'):
+                    with open(source, encoding='utf-8', newline='') as f:
+                        results[stage] = import_products(read_rows(f, fmt), batch_size=options['batch_size'],
+                                                         rebuild=False)
+                    results[stage]['max_rss_mib'] = self.max_rss()
+                started = time.perf_counter()
+                rebuild_index()
+                rebuild_facets()
+                seconds = time.perf_counter() - started
+                results['rebuild'] = {'rows': options['rows'], 'seconds': round(seconds, 2),
+                                      'rows_per_second': round(options['rows'] / seconds)}
+                with open(os.path.join(directory, f'export.{fmt}'), 'w', encoding='utf-8', newline='') as f:
+                    results['export'] = export_products(f, fmt)
+                results['export']['max_rss_mib'] = self.max_rss()
+            finally:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        for stage, result in results.items():
+            self.stdout.write(f'{stage:7} ' + ' '.join(f'{key}={value}' for key, value in result.items()))
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                json.dump({'config': {key: options[key] for key in ('rows', 'format', 'batch_size')},
+                           'results': results}, f, ensure_ascii=False, indent=2)
+
+    def max_rss(self):
+        # Пиковая память процесса с начала работы (Linux: ru_maxrss в КиБ)
+        return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
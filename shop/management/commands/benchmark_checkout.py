@@ -0,0 +1,56 @@
+import json
+import os
+import random
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from shop.benchmarks import run_checkouts, seed
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает пропускную способность записи при параллельном оформлении заказов '
+            'для профилей базы (DB_PROFILE). Каждый профиль запускается в отдельном процессе '
+            'на своей тестовой базе.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--profiles', default='sqlite-basic,sqlite',
+                            help='Профили через запятую: sqlite-basic, sqlite, postgres')
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--orders', type=int, default=100, help='Заказов на поток')
+        parser.add_argument('--cart-items', type=int, default=3)
+        parser.add_argument('--hot-products', type=int, default=20,
+                            help='Среди скольких товаров выбираются товары заказов')
+        parser.add_argument('--products', type=int, default=1000)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--run', action='store_true',
+                            help='Прогнать текущий профиль и вывести результат в JSON (для дочернего процесса)')
+
+    def handle(self, *args, **options):
+        if options['run']:
+            self.stdout.write(json.dumps(self.run(options)))
+            return
+
+        arguments = [f'--{name.replace("_", "-")}={options[name]}'
+                     for name in ('threads', 'orders', 'cart_items', 'hot_products', 'products', 'seed')]
+        for profile in options['profiles'].split(','):
+            process = subprocess.run(
+                [sys.executable, os.path.join(settings.BASE_DIR, 'manage.py'), 'benchmark_checkout', '--run',
+                 *arguments],
+                env={**os.environ, 'DB_PROFILE': profile}, capture_output=True, text=True)
+            if process.returncode:
+                raise CommandError(f'Профиль {profile} завершился с ошибкой:\n{process.stderr}')
+            result = json.loads(process.stdout.strip().splitlines()[-1])
+            self.stdout.write(f'{profile:12} ' + ' '.join(f'{key}={value}' for key, value in result.items()))
+
+    def run(self, options):
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            seed(options['products'], users=0, cart_items=0, rnd=random.Random(options['seed']))
+            return run_checkouts(options['threads'], options['orders'], options['cart_items'],
+                                 options['hot_products'], random.Random(options['seed']))
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
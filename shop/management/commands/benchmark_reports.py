@@ -0,0 +1,83 @@
+import json
+import os
+import random
+import resource
+import tempfile
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.utils import timezone
+
+from shop.benchmarks import seed_sales
+from shop.reports import EXPORT_FORMATS, GROUPINGS, export_lines, revenue_report
+from shop.rollups import rebuild_rollup, rollup_report
+
+
+class Command(BaseCommand):
+    help = ('Замеряет отчеты о выручке, пересчет и чтение сводки продаж и потоковую выгрузку заказов '
+            'на синтетических продажах в отдельной тестовой базе: время, строк в секунду и пиковую память.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--items', type=int, default=10000000, help='Строк заказов')
+        parser.add_argument('--items-per-order', type=int, default=10)
+        parser.add_argument('--products', type=int, default=1000)
+        parser.add_argument('--chunk-size', type=int, default=2000)
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help='Процессов для пересчета сводки продаж')
+        parser.add_argument('--window-days', type=int, default=30, help='Период отчетов панели, дней')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help='Сохранить результаты в JSON')
+
+    def handle(self, *args, **options):
+        results = {}
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            started = time.perf_counter()
+            orders = seed_sales(options['items'], options['items_per_order'], options['products'],
+                                rnd=random.Random(options['seed']))
+            results['seed'] = self.timing(options['items'], started)
+            self.stdout.write(f'Заказов: {orders}, строк заказов: {options["items"]}')
+
+            self.time_reports(results, 'report', revenue_report, options)
+            started = time.perf_counter()
+            rollup_rows = rebuild_rollup(workers=options['workers'])['rows']
+            results['rollup_rebuild'] = dict(self.timing(options['items'], started), rollup_rows=rollup_rows)
+            self.time_reports(results, 'rollup', rollup_report, options)
+
+            with tempfile.TemporaryDirectory() as directory:
+                for fmt in EXPORT_FORMATS:
+                    started = time.perf_counter()
+                    lines = 0
+                    with open(os.path.join(directory, f'orders.{fmt}'), 'w', encoding='utf-8', newline='') as f:
+                        for line in export_lines(fmt, chunk_size=options['chunk_size']):
+                            f.write(line)
+                            lines += 1
+                    results[f'export_{fmt}'] = dict(self.timing(options['items'], started), lines=lines)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        for stage, result in results.items():
+            self.stdout.write(f'{stage:14} ' + ' '.join(f'{key}={value}' for key, value in result.items()))
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                json.dump({'config': {key: options[key] for key in ('items', 'items_per_order', 'products',
+                                                                      'chunk_size', 'workers', 'window_days')},
+                           'results': results}, f, ensure_ascii=False, indent=2)
+
+    def time_reports(self, results, name, report, options):
+        # Вся история и последние window_days дней, как на панели отчетов
+        since = (timezone.localdate() - timedelta(days=options['window_days'])).isoformat()
+        for group_by in GROUPINGS:
+            for suffix, filters in (('', {}), (f'_{options["window_days"]}d', {'since': since})):
+                started = time.perf_counter()
+                groups = len(report(group_by, **filters))
+                seconds = time.perf_counter() - started
+                results[f'{name}_{group_by}{suffix}'] = {'ms': round(seconds * 1000, 1), 'groups': groups}
+
+    def timing(self, rows, started):
+        # rows - число строк заказов (или строк сводки), которые обработал этап
+        seconds = time.perf_counter() - started
+        return {'seconds': round(seconds, 2), 'rows_per_second': round(rows / seconds) if seconds else 0,
+                'max_rss_mib': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)}
@@ -0,0 +1,88 @@
+import itertools
+import random
+import sqlite3
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from shop.search import CREATE_INDEX_SQL, CREATE_TERMS_SQL, FTS_TABLE, TERMS_TABLE, search_ids, stem, write_documents
+
+WORDS = ('телефон смартфон ноутбук планшет наушники колонка зарядка кабель чехол стекло часы браслет камера '
+         'объектив штатив монитор клавиатура мышь принтер роутер телевизор холодильник пылесос чайник утюг '
+         'беспроводной черный белый красный синий зеленый большой маленький новый быстрый мощный легкий '
+         'металлический пластиковый кожаный водонепроницаемый игровой офисный детский домашний').split()
+SYLLABLES = 'ка ро ми ла то ве ны са ре до пу жи бо ле ти ма зо ку не ря'.split()
+
+
+class Command(BaseCommand):
+    help = ('Замеряет скорость полнотекстового поиска на синтетическом каталоге. '
+            'Индекс строится в отдельной временной базе SQLite.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=1000000)
+        parser.add_argument('--queries', type=int, default=1000)
+        parser.add_argument('--words', type=int, default=20000, help='Размер словаря синтетического каталога')
+        parser.add_argument('--candidates', type=int, default=settings.SEARCH_CANDIDATES_LIMIT,
+                            help='Сколько совпадений ранжировать на запрос')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--db', default=':memory:', help='Файл базы для индекса (по умолчанию в памяти)')
+        parser.add_argument('--max-p95-ms', type=float, help='Завершиться с ошибкой, если p95 больше')
+
+    def handle(self, *args, **options):
+        rnd = random.Random(options['seed'])
+        vocabulary = self.vocabulary(rnd, options['words'])
+        # Основы слов считаются один раз: документ каталога состоит из слов словаря
+        stems = [stem(word) for word in vocabulary]
+        # Частоты слов по закону Ципфа, накопленные заранее для random.choices
+        cum_weights = list(itertools.accumulate(1 / (rank + 1) for rank in range(len(vocabulary))))
+        indexes = range(len(stems))
+
+        db = sqlite3.connect(options['db'])
+        db.execute(f'DROP TABLE IF EXISTS {FTS_TABLE}')
+        db.execute(f'DROP TABLE IF EXISTS {TERMS_TABLE}')
+        db.execute(CREATE_INDEX_SQL)
+        db.execute(CREATE_TERMS_SQL)
+        started = time.perf_counter()
+        cursor = db.cursor()
+        batch = []
+        for pk in range(1, options['products'] + 1):
+            name = rnd.choices(indexes, cum_weights=cum_weights, k=3)
+            text = rnd.choices(indexes, cum_weights=cum_weights, k=20)
+            batch.append((pk, ' '.join(stems[i] for i in name), ' '.join(stems[i] for i in text)))
+            if len(batch) == 10000:
+                write_documents(cursor, batch, placeholder='?')
+                batch = []
+        write_documents(cursor, batch, placeholder='?')
+        db.execute(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('optimize')")
+        db.commit()
+        self.stdout.write(f'Индекс на {options["products"]} товаров построен за {time.perf_counter() - started:.1f} с')
+
+        timings = []
+        for _ in range(options['queries']):
+            words = rnd.choices(vocabulary, cum_weights=cum_weights, k=rnd.randint(1, 2))
+            # Часть запросов - незаконченное слово, как при наборе в строке поиска
+            if rnd.random() < 0.3:
+                words[-1] = words[-1][:max(3, len(words[-1]) // 2)]
+            query = ' '.join(words)
+            started = time.perf_counter()
+            search_ids(cursor, query, 50, candidates=options['candidates'], placeholder='?')
+            timings.append((time.perf_counter() - started) * 1000)
+        db.close()
+
+        timings.sort()
+        p50, p95, p99 = (timings[int(len(timings) * q) - 1] for q in (0.5, 0.95, 0.99))
+        self.stdout.write(f'Запросов: {len(timings)}, p50 {p50:.2f} мс, p95 {p95:.2f} мс, p99 {p99:.2f} мс')
+        if options['max_p95_ms'] is not None and p95 > options['max_p95_ms']:
+            raise CommandError(f'p95 {p95:.2f} мс больше допустимых {options["max_p95_ms"]} мс')
+
+    def vocabulary(self, rnd, size):
+        # Реальные слова товаров плюс псевдослова из слогов с русскими окончаниями
+        words = list(WORDS)
+        seen = set(words)
+        while len(words) < size:
+            word = ''.join(rnd.choices(SYLLABLES, k=rnd.randint(2, 4))) + rnd.choice(('', 'ный', 'ка', 'ер', 'ость'))
+            if word not in seen:
+                seen.add(word)
+                words.append(word)
+        return words
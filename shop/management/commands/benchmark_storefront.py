@@ -0,0 +1,71 @@
+import json
+import os
+import random
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from shop.benchmarks import SCENARIOS, find_regressions, load_baseline, run_client, run_wsgi, save_baseline, seed
+
+
+class Command(BaseCommand):
+    help = ('Нагрузочный прогон витрины (главная, каталог, корзина, добавление в корзину, заказ) '
+            'через тестовый клиент и локальный WSGI-сервер. Данные создаются в отдельной '
+            'тестовой базе, результат сравнивается с сохраненным прогоном.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=10000)
+        parser.add_argument('--users', type=int, default=50)
+        parser.add_argument('--cart-items', type=int, default=5)
+        parser.add_argument('--requests', type=int, default=200, help='Запросов на сценарий')
+        parser.add_argument('--concurrency', type=int, default=8, help='Параллельных клиентов WSGI-сервера')
+        parser.add_argument('--scenarios', default=','.join(SCENARIOS))
+        parser.add_argument('--modes', default='client,wsgi', help='client, wsgi или оба через запятую')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--baseline', default=os.path.join(settings.BASE_DIR, 'benchmarks', 'storefront.json'))
+        parser.add_argument('--save-baseline', action='store_true', help='Сохранить результат как новый эталон')
+        parser.add_argument('--tolerance', type=float, default=0.25,
+                            help='Допустимое ухудшение p95 относительно эталона (доля)')
+
+    def handle(self, *args, **options):
+        scenarios = [name for name in options['scenarios'].split(',') if name]
+        unknown = set(scenarios) - set(SCENARIOS)
+        if unknown:
+            raise CommandError(f'Неизвестные сценарии: {", ".join(sorted(unknown))}')
+        modes = [mode for mode in options['modes'].split(',') if mode]
+        if set(modes) - {'client', 'wsgi'}:
+            raise CommandError('Режимы: client, wsgi')
+
+        rnd = random.Random(options['seed'])
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            for cache in caches.all():
+                cache.clear()
+            customers = seed(options['products'], options['users'], options['cart_items'], rnd)
+            results = {}
+            if 'client' in modes:
+                results['client'] = run_client(customers, scenarios, options['requests'], rnd)
+            if 'wsgi' in modes:
+                results['wsgi'] = run_wsgi(customers, scenarios, options['requests'], options['concurrency'], rnd)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        for mode, scenario_results in results.items():
+            for name, result in scenario_results.items():
+                self.stdout.write(f'{mode:6} {name:14} ' + ' '.join(f'{key}={value}' for key, value in result.items()))
+
+        config = {key: options[key] for key in ('products', 'users', 'cart_items', 'requests', 'concurrency', 'seed')}
+        if options['save_baseline']:
+            os.makedirs(os.path.dirname(options['baseline']) or '.', exist_ok=True)
+            save_baseline(options['baseline'], config, results)
+            self.stdout.write(f'Эталон сохранен в {options["baseline"]}')
+            return
+        if not os.path.exists(options['baseline']):
+            self.stdout.write('Эталона нет, сравнение пропущено (сохраните его с --save-baseline)')
+            return
+        regressions = find_regressions(load_baseline(options['baseline']), results, options['tolerance'])
+        if regressions:
+            raise CommandError('Регрессии относительно эталона:\n' + '\n'.join(regressions))
+        self.stdout.write(self.style.SUCCESS('Регрессий нет'))
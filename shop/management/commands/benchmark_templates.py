@@ -0,0 +1,44 @@
+import json
+import random
+
+from django.core.cache import caches
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from shop.benchmarks import TEMPLATE_PROFILES, run_template_profiles, seed
+
+
+class Command(BaseCommand):
+    help = ('Замеряет время страниц витрины и отрисовки шаблонов в профилях шаблонов: без кэша, '
+            'прежняя настройка и production (кэширующий загрузчик, прогрев и кэш фрагментов).')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=1000)
+        parser.add_argument('--requests', type=int, default=100, help='Запросов на страницу')
+        parser.add_argument('--profiles', default=','.join(TEMPLATE_PROFILES))
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help='Сохранить результаты в JSON')
+
+    def handle(self, *args, **options):
+        profiles = [name for name in options['profiles'].split(',') if name]
+        unknown = set(profiles) - set(TEMPLATE_PROFILES)
+        if unknown:
+            raise CommandError(f'Неизвестные профили: {", ".join(sorted(unknown))}')
+
+        rnd = random.Random(options['seed'])
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            for cache in caches.all():
+                cache.clear()
+            (user, _), = seed(options['products'], 1, 5, rnd)
+            results = run_template_profiles(profiles, user, options['requests'], rnd)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        for profile, pages in results.items():
+            for page, result in pages.items():
+                self.stdout.write(f'{profile:10} {page:14} ' + ' '.join(f'{key}={value}' for key, value in result.items()))
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                json.dump({'config': {key: options[key] for key in ('products', 'requests', 'seed')},
+                           'results': results}, f, ensure_ascii=False, indent=2)
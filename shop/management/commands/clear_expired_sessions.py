@@ -0,0 +1,16 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from shop.sessions import clear_expired_sessions
+
+
+class Command(BaseCommand):
+    help = 'Удаляет просроченные сессии пачками, не блокируя базу надолго'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=settings.SESSION_CLEANUP_BATCH_SIZE)
+        parser.add_argument('--pause', type=float, default=0.05, help='Пауза между пачками, с')
+
+    def handle(self, *args, **options):
+        deleted = clear_expired_sessions(batch_size=options['batch_size'], pause=options['pause'])
+        self.stdout.write(f'Удалено сессий: {deleted}')
@@ -0,0 +1,40 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from shop.catalog_io import detect_format
+from shop.reports import EXPORT_FORMATS, ReportError, export_lines
+
+
+class Command(BaseCommand):
+    help = 'Выгружает заказы со строками в CSV или JSONL потоково, не загружая их в память'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Файл или - для стандартного вывода')
+        parser.add_argument('--format', choices=EXPORT_FORMATS, help='По умолчанию по расширению файла')
+        parser.add_argument('--since', help='С даты YYYY-MM-DD включительно')
+        parser.add_argument('--until', help='По дату YYYY-MM-DD включительно')
+        parser.add_argument('--status')
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        fmt = options['format'] or detect_format(options['path'])
+        to_stdout = options['path'] == '-'
+        report = self.stderr if to_stdout else self.stdout
+        try:
+            lines = export_lines(fmt, options['since'], options['until'], options['status'], options['chunk_size'])
+            stream = sys.stdout if to_stdout else open(options['path'], 'w', encoding='utf-8', newline='')
+        except (ReportError, OSError) as e:
+            raise CommandError(e)
+        started = time.perf_counter()
+        count = 0
+        try:
+            for line in lines:
+                stream.write(line)
+                count += 1
+        finally:
+            if not to_stdout:
+                stream.close()
+        seconds = time.perf_counter() - started
+        report.write(f'Строк: {count}, {seconds:.2f} с, {count / seconds if seconds else 0:.0f} строк/с')
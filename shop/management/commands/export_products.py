@@ -0,0 +1,31 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from shop.catalog_io import FORMATS, detect_format, export_products
+
+
+class Command(BaseCommand):
+    help = 'Выгружает каталог в CSV или JSONL потоково, не загружая товары в память целиком'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Файл или - для стандартного вывода')
+        parser.add_argument('--format', choices=FORMATS, help='По умолчанию по расширению файла')
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        fmt = options['format'] or detect_format(options['path'])
+        to_stdout = options['path'] == '-'
+        # Отчет при выводе в стандартный вывод пишется в поток ошибок, чтобы не смешивать его с данными
+        report = self.stderr if to_stdout else self.stdout
+        try:
+            stream = sys.stdout if to_stdout else open(options['path'], 'w', encoding='utf-8', newline='')
+        except OSError as e:
+            raise CommandError(e)
+        try:
+            stats = export_products(stream, fmt, chunk_size=options['chunk_size'],
+                                    progress=lambda stats: report.write(f'... {stats["rows"]} строк'))
+        finally:
+            if not to_stdout:
+                stream.close()
+        report.write(f'Выгружено товаров: {stats["rows"]}, {stats["seconds"]} с, {stats["rows_per_second"]} строк/с')
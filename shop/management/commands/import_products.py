@@ -0,0 +1,44 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from shop.catalog_io import FORMATS, detect_format, import_products, read_rows
+
+# Сколько ошибок в строках выводить, остальные только считаются
+SHOWN_ERRORS = 20
+
+
+class Command(BaseCommand):
+    help = ('Импортирует товары из CSV или JSONL: новые добавляются, товары с тем же артикулом (sku) '
+            'обновляются. Файл читается потоково, товары пишутся пачками.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Файл или - для стандартного ввода')
+        parser.add_argument('--format', choices=FORMATS, help='По умолчанию по расширению файла')
+        parser.add_argument('--batch-size', type=int, default=2000)
+        parser.add_argument('--no-rebuild', action='store_true',
+                            help='Не обновлять индекс поиска, счетчики каталога и кэш страниц '
+                                 '(их нужно перестроить отдельно)')
+
+    def handle(self, *args, **options):
+        fmt = options['format'] or detect_format(options['path'])
+        shown = []
+
+        def error(e):
+            if len(shown) < SHOWN_ERRORS:
+                shown.append(e)
+                self.stderr.write(str(e))
+
+        def progress(stats):
+            if options['verbosity'] >= 1:
+                self.stdout.write(f'... {stats["rows"]} строк')
+
+        try:
+            stream = sys.stdin if options['path'] == '-' else open(options['path'], encoding='utf-8', newline='')
+        except OSError as e:
+            raise CommandError(e)
+        with stream:
+            stats = import_products(read_rows(stream, fmt), batch_size=options['batch_size'], errors=error,
+                                    progress=progress, rebuild=not options['no_rebuild'])
+        self.stdout.write(f'Строк: {stats["rows"]}, сохранено товаров: {stats["saved"]}, '
+                          f'с ошибками: {stats["errors"]}, {stats["seconds"]} с, {stats["rows_per_second"]} строк/с')
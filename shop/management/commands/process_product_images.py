@@ -0,0 +1,47 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import django
+from django.core.management.base import BaseCommand
+
+from shop.images import ImageSourceError, needs_processing, process_source, save_variants
+from shop.models import Product
+
+
+class Command(BaseCommand):
+    help = ('Делает миниатюры WebP/JPEG для изображений всех товаров в нескольких процессах. '
+            'Каждый источник скачивается один раз, даже если он у нескольких товаров.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+        parser.add_argument('--force', action='store_true', help='Обработать и уже обработанные изображения')
+
+    def handle(self, *args, **options):
+        # Товары с одним источником обрабатываются вместе
+        sources = {}
+        for product in Product.objects.exclude(image=None).exclude(image='').only('pk', 'image', 'image_variants'):
+            if needs_processing(product, options['force']):
+                sources.setdefault(product.image, []).append(product.pk)
+        if not sources:
+            self.stdout.write('Нет изображений для обработки')
+            return
+
+        started = time.perf_counter()
+        processed = failed = updated = 0
+        # Процессы только скачивают и уменьшают изображения, в базу пишет этот процесс
+        with ProcessPoolExecutor(max_workers=options['workers'], initializer=django.setup) as pool:
+            futures = {pool.submit(process_source, source): source for source in sources}
+            for future in as_completed(futures):
+                source = futures[future]
+                try:
+                    variants = future.result()
+                except ImageSourceError as e:
+                    failed += 1
+                    self.stderr.write(f'Не обработано: {e}')
+                    continue
+                processed += 1
+                updated += save_variants(sources[source], variants)
+        duration = time.perf_counter() - started
+        self.stdout.write(f'Источников: {processed}, с ошибками: {failed}, товаров обновлено: {updated}, '
+                          f'{processed / duration:.1f} изображений/с')
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from shop.facets import TOTAL, rebuild_facets
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает счетчики фильтров каталога (диапазоны цен, наличие)'
+
+    def handle(self, *args, **options):
+        counts = rebuild_facets()
+        self.stdout.write(f'Пересчитано счетчиков: {len(counts)}, товаров: {counts[TOTAL]}')
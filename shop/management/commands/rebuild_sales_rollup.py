@@ -0,0 +1,28 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from shop.reports import ReportError
+from shop.rollups import rebuild_rollup
+
+
+class Command(BaseCommand):
+    help = ('Пересчитывает сводку продаж за период (по умолчанию за всю историю) '
+            'кусками по несколько дней в нескольких процессах.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', help='С даты YYYY-MM-DD включительно')
+        parser.add_argument('--until', help='По дату YYYY-MM-DD включительно')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+        parser.add_argument('--chunk-days', type=int, default=31, help='Дней в одном куске')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        try:
+            result = rebuild_rollup(options['since'], options['until'], workers=options['workers'],
+                                    chunk_days=max(1, options['chunk_days']))
+        except ReportError as e:
+            raise CommandError(e)
+        self.stdout.write(f'Дней пересчитано: {result["days"]}, строк сводки: {result["rows"]}, '
+                          f'{time.perf_counter() - started:.2f} с')
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from shop.totals import recompute_all_totals
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает сохраненные суммы и число товаров всех заказов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        processed = recompute_all_totals(batch_size=options['batch_size'])
+        self.stdout.write(f'Пересчитано заказов: {processed}')
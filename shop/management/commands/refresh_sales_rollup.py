@@ -0,0 +1,16 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from shop.rollups import refresh_rollup
+
+
+class Command(BaseCommand):
+    help = ('Обновляет сводку продаж: пересчитывает дни заказов, измененных после прошлого обновления. '
+            'Запускается по расписанию, например раз в несколько минут.')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        result = refresh_rollup()
+        self.stdout.write(f'Дней пересчитано: {result["days"]}, строк сводки: {result["rows"]}, '
+                          f'{time.perf_counter() - started:.2f} с')
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from shop.stock import release_expired
+
+
+class Command(BaseCommand):
+    help = 'Возвращает на склад товары из просроченных резервов брошенных корзин'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        released = release_expired(batch_size=options['batch_size'])
+        self.stdout.write(f'Снято резервов: {released}')
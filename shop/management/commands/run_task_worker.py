@@ -0,0 +1,20 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from shop.tasks import run_worker
+
+
+class Command(BaseCommand):
+    help = 'Выполняет фоновые задачи из таблицы очереди: письма о заказах и работу после оформления'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=settings.TASK_BATCH_SIZE)
+        parser.add_argument('--poll', type=float, default=1.0, help='Пауза при пустой очереди, с')
+        parser.add_argument('--once', action='store_true', help='Выполнить накопившиеся задачи и завершиться')
+
+    def handle(self, *args, **options):
+        try:
+            processed = run_worker(batch_size=options['batch_size'], poll=options['poll'], once=options['once'])
+        except KeyboardInterrupt:
+            return
+        self.stdout.write(f'Обработано задач: {processed}')
@@ -0,0 +1,32 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from shop.reports import GROUPINGS, ReportError, revenue_report
+from shop.rollups import rollup_report
+
+
+class Command(BaseCommand):
+    help = 'Выручка по дням, статусам или товарам, посчитанная агрегатами SQL по строкам заказов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--group-by', choices=GROUPINGS, default='day')
+        parser.add_argument('--since', help='С даты YYYY-MM-DD включительно')
+        parser.add_argument('--until', help='По дату YYYY-MM-DD включительно')
+        parser.add_argument('--status')
+        parser.add_argument('--json', action='store_true', help='Вывести JSON вместо таблицы')
+        parser.add_argument('--rollup', action='store_true',
+                            help='По сводке продаж и живым данным после ее обновления, без числа заказов')
+
+    def handle(self, *args, **options):
+        try:
+            report = rollup_report if options['rollup'] else revenue_report
+            rows = report(options['group_by'], options['since'], options['until'], options['status'])
+        except ReportError as e:
+            raise CommandError(e)
+        if options['json']:
+            self.stdout.write(json.dumps(rows, ensure_ascii=False, indent=2))
+            return
+        for row in rows:
+            self.stdout.write('\t'.join(str(value) for value in row.values()))
+        self.stdout.write(f'Итого: {sum(float(row["revenue"]) for row in rows):.2f}')
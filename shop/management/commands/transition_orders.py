@@ -0,0 +1,43 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from shop.models import Order
+from shop.order_status import STATUSES, InvalidTransitionError, bulk_advance, bulk_transition
+from shop.reports import ReportError, filter_orders
+
+
+class Command(BaseCommand):
+    help = ('Массово переводит заказы в статус (--to) или в следующий статус (--advance): '
+            'один UPDATE на исходный статус, переходы записываются в историю.')
+
+    def add_arguments(self, parser):
+        target = parser.add_mutually_exclusive_group(required=True)
+        target.add_argument('--to', choices=STATUSES, help='Новый статус')
+        target.add_argument('--advance', action='store_true', help='Каждый заказ в следующий статус')
+        parser.add_argument('--ids', help='Номера заказов (id) через запятую')
+        parser.add_argument('--status', choices=STATUSES, help='Только заказы в этом статусе')
+        parser.add_argument('--since', help='Созданные с даты YYYY-MM-DD включительно')
+        parser.add_argument('--until', help='Созданные по дату YYYY-MM-DD включительно')
+        parser.add_argument('--batch-size', type=int, default=10000)
+
+    def handle(self, *args, **options):
+        try:
+            orders = filter_orders(Order.objects.all(), options['since'], options['until'], options['status'])
+            if options['ids']:
+                orders = orders.filter(pk__in=[int(pk) for pk in options['ids'].split(',') if pk.strip()])
+        except (ReportError, ValueError) as e:
+            raise CommandError(e)
+        started = time.perf_counter()
+        try:
+            if options['advance']:
+                moved = bulk_advance(orders, batch_size=options['batch_size'])
+            else:
+                moved = {options['to']: bulk_transition(orders, options['to'], batch_size=options['batch_size'])}
+        except InvalidTransitionError as e:
+            raise CommandError(e)
+        seconds = time.perf_counter() - started
+        total = sum(moved.values())
+        details = ', '.join(f'{status}: {count}' for status, count in moved.items() if count)
+        self.stdout.write(f'Переведено заказов: {total}' + (f' ({details})' if details else '') +
+                          f', {seconds:.2f} с, {total / seconds if seconds else 0:.0f} заказов/с')
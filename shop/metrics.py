@@ -0,0 +1,171 @@
+import contextvars
+import threading
+import time
+from collections import Counter
+
+from django.template.backends.django import DjangoTemplates, Template
+
+# Границы корзин гистограмм задержки, мс; последняя корзина - все, что дольше
+LATENCY_BUCKETS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+# Сколько примеров повторяющихся запросов (N+1) хранить на одно имя URL
+N_PLUS_ONE_EXAMPLES = 5
+
+_current = contextvars.ContextVar('request_metrics', default=None)
+
+
+class RequestMetrics(object):
+    """
+    Замеры одного запроса: запросы к базе, время в базе и в шаблонах.
+    """
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.template_time = 0.0
+        self.template_depth = 0
+        self.statements = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - started
+            self.queries += 1
+            self.statements[sql] += 1
+
+    def repeated(self, threshold):
+        # Одинаковый SQL (с разными параметрами) больше threshold раз - признак N+1
+        return {sql: count for sql, count in self.statements.items() if count > threshold}
+
+
+def _execute(execute, sql, params, many, context):
+    # Обертка стоит на соединении постоянно, замеры идут в RequestMetrics текущего запроса.
+    # contextvars копируются в поток sync_to_async, поэтому запросы асинхронного ORM тоже учитываются
+    metrics = _current.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    return metrics(execute, sql, params, many, context)
+
+
+def install_query_timer(connection):
+    """
+    Ставит обертку замеров на соединение. Соединения у каждого потока свои, поэтому
+    обертка ставится при создании соединения (сигнал connection_created), а не на время запроса.
+    """
+    if _execute not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_execute)
+
+
+def activate(metrics):
+    return _current.set(metrics)
+
+
+def deactivate(token):
+    _current.reset(token)
+
+
+class TimedTemplate(Template):
+    """
+    Шаблон бэкенда, который засчитывает время отрисовки в замеры текущего запроса.
+    """
+    def render(self, context=None, request=None):
+        metrics = _current.get()
+        if metrics is None:
+            return super().render(context, request)
+        # Шаблоны, отрисованные внутри другого (render_to_string в теге), входят во время внешнего
+        metrics.template_depth += 1
+        started = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            metrics.template_depth -= 1
+            if not metrics.template_depth:
+                metrics.template_time += time.perf_counter() - started
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """
+    Бэкенд DjangoTemplates с замером времени отрисовки, подключается в TEMPLATES['BACKEND'].
+    {% include %} и {% extends %} отрисовываются внутри шаблона и в замер входят сами.
+    """
+    def from_string(self, template_code):
+        return TimedTemplate(super().from_string(template_code).template, self)
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name).template, self)
+
+
+def _empty_stats():
+    return {
+        'requests': 0,
+        'queries': 0,
+        'queries_max': 0,
+        'db_ms': 0.0,
+        'template_ms': 0.0,
+        'total_ms': 0.0,
+        'latency_histogram': [0] * (len(LATENCY_BUCKETS) + 1),
+        'queries_histogram': Counter(),
+        'n_plus_one': 0,
+        'n_plus_one_examples': [],
+    }
+
+
+_stats_lock = threading.Lock()
+_stats = {}
+
+
+def record(url_name, metrics, total, threshold):
+    """
+    Добавляет замеры запроса к статистике url_name. Возвращает повторяющиеся запросы (N+1).
+    """
+    repeated = metrics.repeated(threshold)
+    total_ms = total * 1000
+    bucket = next((index for index, bound in enumerate(LATENCY_BUCKETS) if total_ms <= bound), len(LATENCY_BUCKETS))
+    with _stats_lock:
+        stats = _stats.setdefault(url_name, _empty_stats())
+        stats['requests'] += 1
+        stats['queries'] += metrics.queries
+        stats['queries_max'] = max(stats['queries_max'], metrics.queries)
+        stats['db_ms'] += metrics.db_time * 1000
+        stats['template_ms'] += metrics.template_time * 1000
+        stats['total_ms'] += total_ms
+        stats['latency_histogram'][bucket] += 1
+        stats['queries_histogram'][metrics.queries] += 1
+        if repeated:
+            stats['n_plus_one'] += 1
+            examples = stats['n_plus_one_examples']
+            for sql, count in repeated.items():
+                if len(examples) < N_PLUS_ONE_EXAMPLES and sql not in (example['sql'] for example in examples):
+                    examples.append({'sql': sql[:500], 'count': count})
+    return repeated
+
+
+def request_stats():
+    """
+    Статистика по именам URL в текущем процессе: средние значения и гистограммы.
+    """
+    result = {}
+    with _stats_lock:
+        for url_name, stats in _stats.items():
+            requests = stats['requests']
+            result[url_name] = {
+                'requests': requests,
+                'queries_avg': round(stats['queries'] / requests, 2),
+                'queries_max': stats['queries_max'],
+                'db_ms_avg': round(stats['db_ms'] / requests, 3),
+                'template_ms_avg': round(stats['template_ms'] / requests, 3),
+                'total_ms_avg': round(stats['total_ms'] / requests, 3),
+                'latency_histogram': {
+                    f'<={bound}ms' if bound is not None else f'>{LATENCY_BUCKETS[-1]}ms': count
+                    for bound, count in zip(LATENCY_BUCKETS + (None,), stats['latency_histogram'])
+                },
+                'queries_histogram': dict(sorted(stats['queries_histogram'].items())),
+                'n_plus_one': stats['n_plus_one'],
+                'n_plus_one_examples': list(stats['n_plus_one_examples']),
+            }
+    return result
+
+
+def reset_stats():
+    with _stats_lock:
+        _stats.clear()
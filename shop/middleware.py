@@ -0,0 +1,116 @@
+import logging
+import random
+import time
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class RequestMetricsMiddleware(object):
+    """
+    Считает для доли запросов (REQUEST_METRICS_SAMPLE_RATE) число запросов к базе,
+    время в базе, время отрисовки шаблонов и общее время. Статистика копится
+    по имени URL, замеры запроса отдаются в заголовке Server-Timing. Время шаблонов
+    считает бэкенд shop.metrics.TimedDjangoTemplates.
+
+    Заголовки потокового ответа уходят раньше тела, поэтому Server-Timing у него нет,
+    а статистика записывается после отправки тела вместе с запросами, сделанными при его отдаче.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+        # Соединения, открытые до подключения сигнала connection_created
+        for connection in connections.all(initialized_only=True):
+            metrics.install_query_timer(connection)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if random.random() >= settings.REQUEST_METRICS_SAMPLE_RATE:
+            return self.get_response(request)
+
+        recorder = metrics.RequestMetrics()
+        started = time.perf_counter()
+        with self.measure(recorder):
+            response = self.get_response(request)
+        return self.finish(request, response, recorder, started)
+
+    async def __acall__(self, request):
+        # Под ASGI запросы к базе выполняются в потоке sync_to_async со своими соединениями;
+        # замеры туда попадают через contextvars (см. metrics.install_query_timer)
+        if random.random() >= settings.REQUEST_METRICS_SAMPLE_RATE:
+            return await self.get_response(request)
+
+        recorder = metrics.RequestMetrics()
+        started = time.perf_counter()
+        with self.measure(recorder):
+            response = await self.get_response(request)
+        return self.finish(request, response, recorder, started)
+
+    @contextmanager
+    def measure(self, recorder):
+        token = metrics.activate(recorder)
+        try:
+            yield
+        finally:
+            metrics.deactivate(token)
+
+    def finish(self, request, response, recorder, started):
+        if response.streaming:
+            if response.is_async:
+                response.streaming_content = self.astream(request, response.streaming_content, recorder, started)
+            else:
+                response.streaming_content = self.stream(request, response.streaming_content, recorder, started)
+            return response
+
+        total = time.perf_counter() - started
+        self.record(request, recorder, total)
+        response['Server-Timing'] = ', '.join((
+            f'db;dur={recorder.db_time * 1000:.2f};desc="{recorder.queries} queries"',
+            f'tpl;dur={recorder.template_time * 1000:.2f}',
+            f'total;dur={total * 1000:.2f}',
+        ))
+        return response
+
+    def stream(self, request, content, recorder, started):
+        # Каждая часть тела считается отдельно: между частями управление у сервера
+        iterator = iter(content)
+        try:
+            while True:
+                with self.measure(recorder):
+                    chunk = next(iterator, None)
+                if chunk is None:
+                    break
+                yield chunk
+        finally:
+            self.record(request, recorder, time.perf_counter() - started)
+
+    async def astream(self, request, content, recorder, started):
+        iterator = aiter(content)
+        try:
+            while True:
+                with self.measure(recorder):
+                    chunk = await anext(iterator, None)
+                if chunk is None:
+                    break
+                yield chunk
+        finally:
+            self.record(request, recorder, time.perf_counter() - started)
+
+    def record(self, request, recorder, total):
+        match = request.resolver_match
+        url_name = (match.view_name if match else None) or 'unresolved'
+        repeated = metrics.record(url_name, recorder, total, settings.REQUEST_METRICS_N_PLUS_ONE_THRESHOLD)
+        for sql, count in repeated.items():
+            logger.warning('Возможный N+1 в %s: запрос выполнен %s раз: %s', url_name, count, sql[:200])
@@ -0,0 +1,29 @@
+# Generated by Django 5.0.6 on 2026-10-18 04:29
+
+from django.db import migrations, models
+
+
+def seed_order_number(apps, schema_editor):
+    # Счетчик продолжает нумерацию уже существующих заказов
+    Order = apps.get_model('shop', 'Order')
+    Sequence = apps.get_model('shop', 'Sequence')
+    numbers = [int(n) for n in Order.objects.values_list('order_number', flat=True) if n.isdigit()]
+    Sequence.objects.create(name='order_number', value=max(numbers, default=0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0008_alter_product_image'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Sequence',
+            fields=[
+                ('name', models.CharField(max_length=50, primary_key=True, serialize=False)),
+                ('value', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(seed_order_number, migrations.RunPython.noop),
+    ]
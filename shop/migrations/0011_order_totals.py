@@ -0,0 +1,42 @@
+# Generated by Django 5.0.6 on 2026-10-18 04:33
+
+from django.db import migrations, models
+from django.db.models import F, Sum, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def fill_totals(apps, schema_editor):
+    # Для существующих заказов считаем суммы одним UPDATE по строкам заказа
+    Order = apps.get_model('shop', 'Order')
+    OrderItem = apps.get_model('shop', 'OrderItem')
+
+    def aggregate(expression, output_field):
+        items = (OrderItem.objects.filter(order=OuterRef('pk')).order_by().values('order')
+                 .annotate(value=Sum(expression, output_field=output_field)).values('value'))
+        return Coalesce(Subquery(items, output_field=output_field), Value(0), output_field=output_field)
+
+    Order.objects.update(
+        total=aggregate(F('price') * F('quantity'), models.DecimalField(max_digits=12, decimal_places=2)),
+        item_count=aggregate(F('quantity'), models.PositiveIntegerField()),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0010_stockreservation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='item_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='total',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=12),
+        ),
+        migrations.RunPython(fill_totals, migrations.RunPython.noop),
+    ]
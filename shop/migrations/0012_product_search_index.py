@@ -0,0 +1,34 @@
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    # Полнотекстовый индекс FTS5 есть только в SQLite. Миграция только создает таблицы:
+    # формат записей зависит от текущего стеммера в shop.search, поэтому индекс
+    # по существующим товарам заполняется командой rebuild_search_index после migrate
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS shop_product_fts USING fts5("
+        "name, characteristics, tokenize='unicode61 remove_diacritics 2', prefix='3 5 7')"
+    )
+    schema_editor.execute(
+        'CREATE TABLE IF NOT EXISTS shop_product_fts_terms '
+        '(term TEXT PRIMARY KEY, docs INTEGER NOT NULL) WITHOUT ROWID'
+    )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE IF EXISTS shop_product_fts')
+        schema_editor.execute('DROP TABLE IF EXISTS shop_product_fts_terms')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0011_order_totals'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
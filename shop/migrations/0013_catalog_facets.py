@@ -0,0 +1,49 @@
+# Generated by Django 5.0.6 on 2026-10-18 04:53
+
+from collections import Counter
+
+from django.db import migrations, models
+
+
+def fill_facets(apps, schema_editor):
+    from shop.facets import facet_keys
+    Product = apps.get_model('shop', 'Product')
+    CatalogFacet = apps.get_model('shop', 'CatalogFacet')
+    counts = Counter()
+    for price, quantity in Product.objects.values_list('price', 'quantity').iterator(chunk_size=2000):
+        counts.update(facet_keys(price, quantity))
+    CatalogFacet.objects.bulk_create([CatalogFacet(key=key, count=count) for key, count in counts.items()])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0012_product_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogFacet',
+            fields=[
+                ('key', models.CharField(max_length=50, primary_key=True, serialize=False)),
+                ('count', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['price', 'id'], name='product_price_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['name', 'id'], name='product_name_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('quantity__gt', 0)), fields=['price', 'id'], name='product_instock_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('quantity__gt', 0)), fields=['id'], name='product_instock_idx'),
+        ),
+        migrations.RunPython(fill_facets, migrations.RunPython.noop),
+    ]
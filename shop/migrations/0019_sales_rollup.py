@@ -0,0 +1,40 @@
+# Generated by Django 5.0.6 on 2026-10-18 05:53
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0018_order_admin_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RollupState',
+            fields=[
+                ('name', models.CharField(max_length=50, primary_key=True, serialize=False)),
+                ('updated_mark', models.DateTimeField(null=True)),
+                ('cutoff', models.DateTimeField(null=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='SalesRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('status', models.CharField(choices=[('created', 'Создан'), ('preparing', 'Собирается'), ('shipped', 'Отправляется'), ('waiting', 'Ожидает получения'), ('delivered', 'Доставлен')], max_length=20)),
+                ('quantity', models.PositiveBigIntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='shop.product')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'day'], name='sales_rollup_status_day_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='salesrollup',
+            constraint=models.UniqueConstraint(fields=('day', 'product', 'status'), name='sales_rollup_unique'),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.0.6 on 2026-10-18 06:15
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0019_sales_rollup'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderStatusChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('from_status', models.CharField(choices=[('created', 'Создан'), ('preparing', 'Собирается'), ('shipped', 'Отправляется'), ('waiting', 'Ожидает получения'), ('delivered', 'Доставлен')], max_length=20)),
+                ('to_status', models.CharField(choices=[('created', 'Создан'), ('preparing', 'Собирается'), ('shipped', 'Отправляется'), ('waiting', 'Ожидает получения'), ('delivered', 'Доставлен')], max_length=20)),
+                ('changed_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='status_changes', to='shop.order')),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['order', 'changed_at'], name='order_status_change_idx')],
+            },
+        ),
+    ]
@@ -1,17 +1,31 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F, Q
 from django.contrib.auth.models import AbstractUser
+from django.utils import timezone
 
 
 class Product(models.Model):
+    # Артикул - ключ товара при импорте каталога (import_products)
+    sku = models.CharField(max_length=64, unique=True, null=True, blank=True, verbose_name='Артикул')
     name = models.CharField(max_length=100, verbose_name='Название товара')
     characteristics = models.TextField(verbose_name='Описание товара')
     price = models.DecimalField(max_digits=10, decimal_places=2, verbose_name='Цена')
     quantity = models.PositiveIntegerField(verbose_name='Количество')
     image = models.URLField(null=True)
+    # Миниатюры изображения (shop.images): источник, хэш его содержимого и файлы по форматам и ширинам
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
 
     class Meta:
         verbose_name = 'Товар'
         verbose_name_plural = 'Товары'
+        # Индексы под фильтры и сортировки каталога: условие по полю сортировки
+        # и id из курсора читается из индекса без полного просмотра таблицы
+        indexes = [
+            models.Index(fields=['price', 'id'], name='product_price_id_idx'),
+            models.Index(fields=['name', 'id'], name='product_name_id_idx'),
+            models.Index(fields=['price', 'id'], condition=Q(quantity__gt=0), name='product_instock_price_idx'),
+            models.Index(fields=['id'], condition=Q(quantity__gt=0), name='product_instock_idx'),
+        ]
 
     def __str__(self):
         return self.name
@@ -44,30 +58,114 @@ class Order(models.Model):
     created = models.DateTimeField(auto_now_add=True)
     updated = models.DateTimeField(auto_now=True)
     paid = models.BooleanField(default=False)
-    order_number = models.CharField(max_length=6, unique=True)
+    # Номер из счетчика, дополненный нулями до 6 цифр; после 999999 номера длиннее
+    order_number = models.CharField(max_length=12, unique=True)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='created')
+    # Сумма заказа и число единиц товара, обновляются при записи строк заказа
+    total = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    item_count = models.PositiveIntegerField(default=0)
 
     class Meta:
         ordering = ('-created',)
         verbose_name = 'Заказ'
         verbose_name_plural = 'Заказы'
+        # Индексы под список заказов в админке: курсор по (created, id),
+        # фильтр по оплате с сортировкой по дате и фильтр по статусу
+        indexes = [
+            models.Index(fields=['created', 'id'], name='order_created_id_idx'),
+            models.Index(fields=['paid', 'created'], name='order_paid_created_idx'),
+            models.Index(fields=['status'], name='order_status_idx'),
+        ]
 
     def __str__(self):
         return f'Заказ #{self.id} - Статус: {self.get_status_display()}'
 
     def get_total_cost(self):
-        return sum(item.get_cost() for item in self.items.all())
+        return self.total
+
+    @staticmethod
+    def add_to_totals(order_id, cost, count):
+        """Изменяет сохраненные сумму и число товаров заказа на cost и count."""
+        # updated сдвигается и здесь: по нему сводка продаж находит измененные заказы
+        Order.objects.filter(pk=order_id).update(total=F('total') + cost, item_count=F('item_count') + count,
+                                                 updated=timezone.now())
 
     def save(self, *args, **kwargs):
-        if not self.id:
-            last_order = Order.objects.all().order_by('id').last()
-            if last_order:
-                self.order_number = '{:06}'.format(int(last_order.order_number) + 1)
-            else:
-                self.order_number = '000001'
+        if not self.id and not self.order_number:
+            # Номер берется из счетчика, а не из последнего заказа:
+            # так нет полного сканирования и дублей при параллельных заказах.
+            # place_order выдает номер заранее, вне транзакции оформления
+            from .sequences import next_order_number
+            self.order_number = next_order_number()
         super(Order, self).save(*args, **kwargs)
 
 
+class Sequence(models.Model):
+    """Счетчик для выдачи уникальных номеров (например, номеров заказов)."""
+    name = models.CharField(max_length=50, primary_key=True)
+    value = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f'{self.name}: {self.value}'
+
+
+class CatalogFacet(models.Model):
+    """Заранее посчитанное число товаров каталога для фильтра (например, диапазона цен)."""
+    key = models.CharField(max_length=50, primary_key=True)
+    count = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f'{self.key}: {self.count}'
+
+
+class StockReservation(models.Model):
+    """Товар, временно зарезервированный под корзину на время оформления заказа."""
+    key = models.CharField(max_length=64, db_index=True)
+    product = models.ForeignKey(Product, related_name='reservations', on_delete=models.CASCADE)
+    quantity = models.PositiveIntegerField()
+    expires_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return f'{self.product_id} x {self.quantity} до {self.expires_at}'
+
+
+class StoredCart(models.Model):
+    """Корзина пользователя в формате shop.cart.encode_cart, если корзины хранятся не в сессии."""
+    user = models.OneToOneField(User, primary_key=True, related_name='stored_cart', on_delete=models.CASCADE)
+    data = models.TextField()
+    updated = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'Корзина {self.user_id}'
+
+
+class Task(models.Model):
+    """Отложенная задача очереди shop.tasks, ее выполняет команда run_task_worker."""
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (QUEUED, 'В очереди'),
+        (RUNNING, 'Выполняется'),
+        (FAILED, 'Не выполнена'),
+    )
+
+    name = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    attempts = models.PositiveIntegerField(default=0)
+    run_at = models.DateTimeField(default=timezone.now)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'run_at'], name='task_status_run_at_idx')]
+
+    def __str__(self):
+        return f'{self.name} ({self.get_status_display()})'
+
+
 class OrderItem(models.Model):
     order = models.ForeignKey(Order, related_name='items', on_delete=models.DO_NOTHING)
     product = models.ForeignKey('Product', on_delete=models.DO_NOTHING)  # Убедитесь, что у вас есть модель Product
@@ -77,6 +175,24 @@ class OrderItem(models.Model):
     def get_cost(self):
         return self.price * self.quantity
 
+    def save(self, *args, **kwargs):
+        # Вместе со строкой обновляем сумму заказа на разницу старой и новой стоимости
+        with transaction.atomic():
+            previous = None
+            if not self._state.adding:
+                previous = OrderItem.objects.filter(pk=self.pk).values_list('order_id', 'price', 'quantity').first()
+            super(OrderItem, self).save(*args, **kwargs)
+            if previous:
+                order_id, price, quantity = previous
+                Order.add_to_totals(order_id, -price * quantity, -quantity)
+            Order.add_to_totals(self.order_id, self.get_cost(), self.quantity)
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            result = super(OrderItem, self).delete(*args, **kwargs)
+            Order.add_to_totals(self.order_id, -self.get_cost(), -self.quantity)
+        return result
+
     @property
     def total(self):
         """Общая стоимость товара в заказе."""
@@ -84,4 +200,45 @@ class OrderItem(models.Model):
 
     def __str__(self):
         return f'Товар: {self.product.name}, Кол-во: {self.quantity}, Общая стоимость: {self.total:.2f}'
+
+
+class OrderStatusChange(models.Model):
+    """Переход заказа из статуса в статус (shop.order_status), одна строка на переход."""
+    order = models.ForeignKey(Order, related_name='status_changes', on_delete=models.CASCADE)
+    from_status = models.CharField(max_length=20, choices=Order.STATUS_CHOICES)
+    to_status = models.CharField(max_length=20, choices=Order.STATUS_CHOICES)
+    changed_at = models.DateTimeField(default=timezone.now)
+    user = models.ForeignKey(User, related_name='+', null=True, blank=True, on_delete=models.SET_NULL)
+
+    class Meta:
+        indexes = [models.Index(fields=['order', 'changed_at'], name='order_status_change_idx')]
+
+    def __str__(self):
+        return f'{self.order_id}: {self.from_status} -> {self.to_status}'
+
+
+class SalesRollup(models.Model):
+    """Продажи за день по товару и статусу заказа, сводка shop.rollups по строкам заказов."""
+    day = models.DateField()
+    product = models.ForeignKey(Product, related_name='+', on_delete=models.DO_NOTHING)
+    status = models.CharField(max_length=20, choices=Order.STATUS_CHOICES)
+    quantity = models.PositiveBigIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['day', 'product', 'status'], name='sales_rollup_unique')]
+        indexes = [models.Index(fields=['status', 'day'], name='sales_rollup_status_day_idx')]
+
+    def __str__(self):
+        return f'{self.day} {self.product_id} {self.status}: {self.revenue}'
+
+
+class RollupState(models.Model):
+    """Докуда построена сводка: заказы, измененные до updated_mark и созданные до cutoff."""
+    name = models.CharField(max_length=50, primary_key=True)
+    updated_mark = models.DateTimeField(null=True)
+    cutoff = models.DateTimeField(null=True)
+
+    def __str__(self):
+        return f'{self.name}: {self.cutoff}'
 # Create your models here.
@@ -0,0 +1,95 @@
+"""
+Переходы заказов между статусами. Заказ проходит статусы по порядку
+created -> preparing -> shipped -> waiting -> delivered, каждый переход
+записывается в OrderStatusChange. Массовые переходы меняют статус одним UPDATE
+на исходный статус, без сохранения каждого заказа через save().
+"""
+from django.db import transaction
+from django.utils import timezone
+
+from .bulk import insert_rows
+from .models import Order, OrderStatusChange
+
+STATUSES = [status for status, _ in Order.STATUS_CHOICES]
+# Допустимые переходы: из статуса только в следующий
+TRANSITIONS = {status: tuple(STATUSES[position + 1:position + 2]) for position, status in enumerate(STATUSES)}
+HISTORY_FIELDS = ('order', 'from_status', 'to_status', 'changed_at', 'user')
+
+
+class InvalidTransitionError(ValueError):
+    """
+    Переход в статус недопустим или заказ уже в другом статусе.
+    """
+
+
+def can_transition(from_status, to_status):
+    return to_status in TRANSITIONS.get(from_status, ())
+
+
+def sources(status):
+    # Статусы, из которых можно перейти в status
+    if status not in TRANSITIONS:
+        raise InvalidTransitionError(f'Неизвестный статус: {status}')
+    return [source for source, targets in TRANSITIONS.items() if status in targets]
+
+
+def transition(order, status, user=None):
+    """
+    Переводит заказ в status и записывает переход. UPDATE проверяет прежний
+    статус, поэтому параллельное изменение того же заказа не перезаписывается.
+    """
+    if not can_transition(order.status, status):
+        raise InvalidTransitionError(f'Заказ {order.pk}: переход {order.status} -> {status} недопустим')
+    now = timezone.now()
+    with transaction.atomic():
+        if not Order.objects.filter(pk=order.pk, status=order.status).update(status=status, updated=now):
+            raise InvalidTransitionError(f'Заказ {order.pk}: статус уже изменен')
+        OrderStatusChange.objects.create(order_id=order.pk, from_status=order.status, to_status=status,
+                                         changed_at=now, user=user)
+    order.status, order.updated = status, now
+    return order
+
+
+def record_transition(order, from_status, user=None):
+    """
+    Записывает переход заказа, уже сохраненного с новым статусом (например, формой админки).
+    """
+    return OrderStatusChange.objects.create(order=order, from_status=from_status, to_status=order.status,
+                                            changed_at=order.updated, user=user)
+
+
+def _move(queryset, source, target, user, now, batch_size):
+    # Строки блокируются до UPDATE, чтобы история совпала с тем, что обновлено
+    ids = list(queryset.filter(status=source).order_by().select_for_update().values_list('pk', flat=True))
+    user_id = user.pk if user else None
+    for position in range(0, len(ids), batch_size):
+        chunk = ids[position:position + batch_size]
+        Order.objects.filter(pk__in=chunk, status=source).update(status=target, updated=now)
+        insert_rows(OrderStatusChange, HISTORY_FIELDS, [(pk, source, target, now, user_id) for pk in chunk],
+                    batch_size=batch_size)
+    return len(ids)
+
+
+def bulk_transition(queryset, status, user=None, batch_size=10000):
+    """
+    Переводит в status заказы queryset, для которых переход допустим; остальные
+    не меняются. На каждый исходный статус - один UPDATE на batch_size заказов.
+    Возвращает число переведенных заказов.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        return sum(_move(queryset, source, status, user, now, batch_size) for source in sources(status))
+
+
+def bulk_advance(queryset, user=None, batch_size=10000):
+    """
+    Переводит каждый заказ queryset в следующий статус. Статусы обходятся с конца,
+    чтобы заказ не прошел два шага за один вызов. Возвращает {статус: число заказов}.
+    """
+    now = timezone.now()
+    moved = {}
+    with transaction.atomic():
+        for source in reversed(STATUSES):
+            for target in TRANSITIONS[source]:
+                moved[target] = _move(queryset, source, target, user, now, batch_size)
+    return moved
@@ -0,0 +1,68 @@
+"""
+Работа после оформления заказа, которая выполняется очередью задач, а не запросом:
+письмо покупателю, сверка счетчиков наличия и пересчет суммы заказа.
+"""
+from django.core.mail import EmailMessage, get_connection
+from django.template.loader import render_to_string
+
+from .facets import recount_in_stock
+from .models import Order, Product
+from .tasks import enqueue_many, task
+from .totals import recompute_totals
+
+
+def order_confirmation_message(order):
+    context = {'order': order, 'items': order.items.all()}
+    subject = render_to_string('shop/emails/order_confirmation_subject.txt', context).strip()
+    body = render_to_string('shop/emails/order_confirmation.txt', context)
+    return EmailMessage(subject, body, to=[order.email])
+
+
+@task(name='send_order_confirmation', batch=True)
+def send_order_confirmations(payloads):
+    """
+    Отправляет письма о заказах пачки через одно SMTP-соединение. Ошибка
+    одного письма не мешает остальным: повторяется только его задача.
+    """
+    orders = Order.objects.prefetch_related('items__product').in_bulk(
+        [payload['order_id'] for payload in payloads])
+    results = []
+    with get_connection() as mail:
+        for payload in payloads:
+            order = orders.get(payload['order_id'])
+            if order is None:
+                # Заказ удален, отправлять нечего
+                results.append(None)
+                continue
+            try:
+                mail.send_messages([order_confirmation_message(order)])
+            except Exception as e:
+                results.append(e)
+            else:
+                results.append(None)
+    return results
+
+
+@task(name='sync_stock', batch=True)
+def sync_stock(payloads):
+    # Один пересчет на всю пачку: затронутые диапазоны цен всех заказов
+    product_ids = {product_id for payload in payloads for product_id in payload['product_ids']}
+    recount_in_stock(Product.objects.filter(pk__in=product_ids).values_list('price', flat=True))
+    return [None] * len(payloads)
+
+
+@task(name='recompute_order_totals', batch=True)
+def recompute_order_totals(payloads):
+    recompute_totals(Order.objects.filter(pk__in=[payload['order_id'] for payload in payloads]))
+    return [None] * len(payloads)
+
+
+def after_checkout(order, product_ids):
+    """
+    Ставит в очередь работу по оформленному заказу одним INSERT после коммита.
+    """
+    enqueue_many([
+        (send_order_confirmations, {'order_id': order.pk}),
+        (sync_stock, {'product_ids': sorted(product_ids)}),
+        (recompute_order_totals, {'order_id': order.pk}),
+    ])
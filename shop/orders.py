@@ -0,0 +1,58 @@
+from django.db import transaction
+
+from .cart import parse_cart
+from .models import Product, OrderItem, StockReservation
+from .order_tasks import after_checkout
+from .sequences import next_order_number
+from .stock import cart_lines, decrement_stock, release_reservations
+
+
+class MissingProductsError(Exception):
+    """
+    В корзине есть товары, которых уже нет в каталоге.
+    """
+    def __init__(self, product_ids):
+        self.product_ids = product_ids
+        super().__init__(f'Товары не найдены: {", ".join(map(str, product_ids))}')
+
+
+def place_order(form, cart, reservation_key=None):
+    """
+    Оформляет заказ из корзины: все товары загружаются одним запросом,
+    списываются со склада одним UPDATE, строки заказа пишутся одним
+    bulk_create, все в одной транзакции. Число запросов не зависит
+    от размера корзины. Резерв под reservation_key заменяется списанием.
+    Письмо и остальная работа по заказу ставятся в очередь задач после коммита.
+    Номер заказа выдается до транзакции: иначе строка счетчика была бы
+    заблокирована до конца оформления и параллельные заказы шли бы по одному.
+    Номер неудавшегося заказа пропускается.
+    """
+    order = form.save(commit=False)
+    order.order_number = next_order_number()
+    with transaction.atomic():
+        return _checkout(order, cart, reservation_key)
+
+
+def _checkout(order, cart, reservation_key):
+    lines, invalid = parse_cart(cart)
+    products = Product.objects.in_bulk([product_id for product_id, _ in lines.values()])
+    missing = invalid + [key for key, (product_id, _) in lines.items() if product_id not in products]
+    if missing:
+        raise MissingProductsError(missing)
+
+    if reservation_key:
+        release_reservations(StockReservation.objects.filter(key=reservation_key))
+    decrement_stock(cart_lines(lines))
+    items = [
+        OrderItem(product=products[product_id], quantity=quantity, price=products[product_id].price)
+        for product_id, quantity in lines.values()
+    ]
+    # bulk_create не вызывает OrderItem.save, поэтому сумму заказа задаем сразу
+    order.total = sum((item.get_cost() for item in items), 0)
+    order.item_count = sum(item.quantity for item in items)
+    order.save()
+    for item in items:
+        item.order = order
+    OrderItem.objects.bulk_create(items)
+    after_checkout(order, products)
+    return order
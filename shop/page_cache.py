@@ -0,0 +1,190 @@
+import functools
+import threading
+import time
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import caches
+from django.db import transaction
+from django.http import HttpResponse
+from django.middleware.csrf import get_token
+from django.template.loader import render_to_string
+from django.utils.cache import patch_cache_control, patch_vary_headers
+
+# Подставляется вместо токена CSRF в кэшируемые страницы и заменяется при каждом запросе
+CSRF_MARKER = '__csrf_token__'
+
+CATALOG_VERSION_KEY = 'catalog:version'
+
+_stats_lock = threading.Lock()
+_stats = {'hits': 0, 'misses': 0}
+
+
+def get_cache():
+    return caches[settings.PAGE_CACHE_ALIAS]
+
+
+def _record(name):
+    with _stats_lock:
+        _stats[name] += 1
+
+
+def cache_stats():
+    """
+    Счетчики попаданий и промахов кэша страниц в текущем процессе.
+    """
+    with _stats_lock:
+        hits, misses = _stats['hits'], _stats['misses']
+    total = hits + misses
+    return {'hits': hits, 'misses': misses, 'hit_ratio': hits / total if total else 0.0}
+
+
+def reset_stats():
+    with _stats_lock:
+        _stats.update(hits=0, misses=0)
+
+
+def _version(key):
+    # Версия - время последнего изменения. Если ключ версии вытеснен из кэша,
+    # берется новая версия, и старые записи больше не используются.
+    cache = get_cache()
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, time.time_ns(), None)
+        version = cache.get(key)
+    return version
+
+
+def product_version_key(product_id):
+    return f'product:{product_id}:version'
+
+
+def product_version(product_id):
+    return _version(product_version_key(product_id))
+
+
+def catalog_version():
+    return _version(CATALOG_VERSION_KEY)
+
+
+def _bump(product_ids, catalog):
+    version = time.time_ns()
+    keys = {product_version_key(product_id): version for product_id in product_ids}
+    if catalog:
+        keys[CATALOG_VERSION_KEY] = version
+    get_cache().set_many(keys, None)
+
+
+def invalidate_products(product_ids, catalog=True):
+    """
+    Сбрасывает кэш страниц товаров product_ids, а с catalog - и списков товаров.
+    Повторный сброс после коммита не дает закэшировать данные,
+    прочитанные параллельным запросом до коммита.
+    """
+    product_ids = list(product_ids)
+    _bump(product_ids, catalog)
+    transaction.on_commit(lambda: _bump(product_ids, catalog))
+
+
+def invalidate_all():
+    """
+    Сбрасывает весь кэш страниц, например, после массового импорта каталога.
+    """
+    get_cache().clear()
+    transaction.on_commit(get_cache().clear)
+
+
+def get_or_render(key, render):
+    """
+    Возвращает (значение, было ли оно в кэше). При промахе значение
+    считается через render() и сохраняется.
+    """
+    cache = get_cache()
+    value = cache.get(key)
+    if value is not None:
+        _record('hits')
+        return value, True
+    _record('misses')
+    value = render()
+    cache.set(key, value, settings.PAGE_CACHE_TIMEOUT)
+    return value, False
+
+
+def _page_key(request, key):
+    return f'{key}:{"user" if request.user.is_authenticated else "anon"}'
+
+
+def _page_response(request, html, hit):
+    if CSRF_MARKER in html:
+        html = html.replace(CSRF_MARKER, get_token(request))
+    response = HttpResponse(html)
+    response['X-Cache'] = 'HIT' if hit else 'MISS'
+    return response
+
+
+def cached_page(request, key, template_name, get_context):
+    """
+    Страница из кэша по ключу key. Меню в base.html зависит только от того,
+    вошел ли пользователь, поэтому это часть ключа. Токен CSRF
+    подставляется в готовую страницу при каждом запросе.
+    """
+    html, hit = get_or_render(_page_key(request, key), lambda: render_to_string(
+        template_name, {**get_context(), 'csrf_token': CSRF_MARKER}, request=request))
+    return _page_response(request, html, hit)
+
+
+async def acached_page(request, key, template_name, aget_context):
+    """
+    cached_page для async-представлений: контекст собирается корутиной aget_context.
+    Кэш страниц файловый, поэтому чтение и запись в него, как и отрисовка шаблона,
+    идут в потоке через асинхронный API кэша и sync_to_async, не блокируя цикл событий.
+    """
+    key = _page_key(request, key)
+    cache = get_cache()
+    html = await cache.aget(key)
+    if html is not None:
+        _record('hits')
+        return _page_response(request, html, True)
+    _record('misses')
+    context = {**await aget_context(), 'csrf_token': CSRF_MARKER}
+    html = await sync_to_async(render_to_string)(template_name, context, request=request)
+    await cache.aset(key, html, settings.PAGE_CACHE_TIMEOUT)
+    return _page_response(request, html, False)
+
+
+def _public(response, request):
+    # Страница общая для всех гостей, если в ответ не попал токен CSRF (он ставит cookie)
+    if response.status_code == 200 and not request.META.get('CSRF_COOKIE_NEEDS_UPDATE'):
+        patch_cache_control(response, public=True, max_age=settings.ANONYMOUS_PAGE_MAX_AGE)
+    # Без сессии SessionMiddleware не добавит Vary, а вошедшим нужна своя версия страницы
+    patch_vary_headers(response, ('Cookie',))
+    return response
+
+
+def anonymous_fast_path(view):
+    """
+    Запрос без cookie сессии обслуживается как запрос гостя: пользователь
+    не загружается и сессия не читается. Ответ помечается как общий для гостей,
+    чтобы его мог кэшировать обратный прокси.
+    """
+    def anonymous(request):
+        if settings.SESSION_COOKIE_NAME in request.COOKIES:
+            return False
+        request.user = AnonymousUser()
+        return True
+
+    if iscoroutinefunction(view):
+        @functools.wraps(view)
+        async def async_wrapper(request, *args, **kwargs):
+            if not anonymous(request):
+                return await view(request, *args, **kwargs)
+            return _public(await view(request, *args, **kwargs), request)
+        return async_wrapper
+
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not anonymous(request):
+            return view(request, *args, **kwargs)
+        return _public(view(request, *args, **kwargs), request)
+    return wrapper
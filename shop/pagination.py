@@ -0,0 +1,245 @@
+import base64
+import binascii
+import json
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import connections
+from django.db.models import Q
+
+# Допустимые сортировки каталога: поле сортировки и id для однозначного порядка
+ORDERINGS = {
+    'id': ('pk',),
+    'price': ('price', 'pk'),
+    '-price': ('-price', '-pk'),
+    'name': ('name', 'pk'),
+}
+DEFAULT_ORDERING = 'id'
+
+
+def _fields(ordering):
+    # Сортировка - имя из ORDERINGS или кортеж полей, последнее из них - pk
+    return ORDERINGS[ordering] if isinstance(ordering, str) else tuple(ordering)
+
+
+def _field_name(field):
+    return field.lstrip('-')
+
+
+def _reversed(fields):
+    return tuple(_field_name(field) if field.startswith('-') else f'-{field}' for field in fields)
+
+
+def _after(fields, values):
+    """
+    Условие "строка идет после курсора values" при сортировке по fields,
+    например (price > v) OR (price = v AND id > id_курсора).
+    """
+    condition = Q()
+    equal = {}
+    for field, value in zip(fields, values):
+        lookup = 'lt' if field.startswith('-') else 'gt'
+        condition |= Q(**equal, **{f'{_field_name(field)}__{lookup}': value})
+        equal[_field_name(field)] = value
+    return condition
+
+
+def encode_cursor(obj, ordering=DEFAULT_ORDERING):
+    # Для сортировки по id курсор - просто id, иначе - непрозрачная строка
+    fields = _fields(ordering)
+    if fields == ('pk',):
+        return obj.pk
+    values = [str(getattr(obj, _field_name(field))) for field in fields[:-1]] + [obj.pk]
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip('=')
+
+
+def decode_cursor(value, ordering=DEFAULT_ORDERING, model=None):
+    """
+    Значения полей сортировки из курсора или None, если курсор некорректный.
+    С model значения проверяются и приводятся к типам полей модели.
+    """
+    fields = _fields(ordering)
+    try:
+        if fields == ('pk',):
+            pk = int(value)
+            return (pk,) if pk >= 0 else None
+        values = json.loads(base64.urlsafe_b64decode(value + '=' * (-len(value) % 4)))
+    except (TypeError, ValueError, binascii.Error):
+        return None
+    if not isinstance(values, list) or len(values) != len(fields) or not isinstance(values[-1], int):
+        return None
+    if model is not None:
+        try:
+            values[:-1] = [model._meta.get_field(_field_name(field)).to_python(value)
+                           for field, value in zip(fields, values[:-1])]
+        except ValidationError:
+            return None
+    return tuple(values)
+
+
+class KeysetPage(object):
+    """
+    Страница выборки, полученная курсорной (keyset) пагинацией по первичному ключу.
+    """
+    def __init__(self, object_list, has_next, has_previous, ordering=DEFAULT_ORDERING):
+        self.object_list = object_list
+        self.has_next = has_next
+        self.has_previous = has_previous
+        self.ordering = ordering
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    @property
+    def next_cursor(self):
+        # Курсор "вперед" - последний элемент страницы
+        if self.has_next and self.object_list:
+            return encode_cursor(self.object_list[-1], self.ordering)
+        return None
+
+    @property
+    def prev_cursor(self):
+        # Курсор "назад" - первый элемент страницы
+        if self.has_previous and self.object_list:
+            return encode_cursor(self.object_list[0], self.ordering)
+        return None
+
+
+def keyset_page(queryset, after=None, before=None, per_page=None, ordering=DEFAULT_ORDERING):
+    """
+    Возвращает страницу queryset после (after) или до (before) курсора.
+    Вместо OFFSET используется условие по полям сортировки, поэтому стоимость
+    запроса не зависит от номера страницы. Курсоры - кортежи из decode_cursor,
+    для сортировки по id можно передать просто id.
+    """
+    per_page = per_page or settings.PRODUCT_LIST_PAGE_SIZE
+    fields = _fields(ordering)
+    if before is not None:
+        backward = _reversed(fields)
+        rows = list(queryset.filter(_after(backward, _values(before))).order_by(*backward)[:per_page + 1])
+        has_previous = len(rows) > per_page
+        rows = rows[:per_page]
+        rows.reverse()
+        return KeysetPage(rows, has_next=True, has_previous=has_previous, ordering=ordering)
+
+    if after is not None:
+        queryset = queryset.filter(_after(fields, _values(after)))
+    rows = list(queryset.order_by(*fields)[:per_page + 1])
+    has_next = len(rows) > per_page
+    return KeysetPage(rows[:per_page], has_next=has_next, has_previous=after is not None, ordering=ordering)
+
+
+async def akeyset_page(queryset, after=None, before=None, per_page=None, ordering=DEFAULT_ORDERING):
+    """
+    Асинхронный вариант keyset_page для async-представлений.
+    """
+    per_page = per_page or settings.PRODUCT_LIST_PAGE_SIZE
+    fields = _fields(ordering)
+    if before is not None:
+        backward = _reversed(fields)
+        rows = [row async for row in
+                queryset.filter(_after(backward, _values(before))).order_by(*backward)[:per_page + 1]]
+        has_previous = len(rows) > per_page
+        rows = rows[:per_page]
+        rows.reverse()
+        return KeysetPage(rows, has_next=True, has_previous=has_previous, ordering=ordering)
+
+    if after is not None:
+        queryset = queryset.filter(_after(fields, _values(after)))
+    rows = [row async for row in queryset.order_by(*fields)[:per_page + 1]]
+    has_next = len(rows) > per_page
+    return KeysetPage(rows[:per_page], has_next=has_next, has_previous=after is not None, ordering=ordering)
+
+
+def _values(cursor):
+    return cursor if isinstance(cursor, tuple) else (cursor,)
+
+
+def iter_keyset_chunks(queryset, after=None, chunk_size=None, ordering=DEFAULT_ORDERING):
+    """
+    Обходит queryset пачками по chunk_size записей, начиная после курсора after.
+    """
+    chunk_size = chunk_size or settings.PRODUCT_LIST_PAGE_SIZE
+    fields = _fields(ordering)
+    while True:
+        chunk_qs = queryset.order_by(*fields)
+        if after is not None:
+            chunk_qs = chunk_qs.filter(_after(fields, _values(after)))
+        chunk = list(chunk_qs[:chunk_size])
+        if not chunk:
+            return
+        yield chunk
+        if len(chunk) < chunk_size:
+            return
+        last = chunk[-1]
+        after = tuple(getattr(last, _field_name(field)) for field in fields[:-1]) + (last.pk,)
+
+
+async def aiter_keyset_chunks(queryset, after=None, chunk_size=None, ordering=DEFAULT_ORDERING):
+    """
+    Асинхронный вариант iter_keyset_chunks.
+    """
+    chunk_size = chunk_size or settings.PRODUCT_LIST_PAGE_SIZE
+    fields = _fields(ordering)
+    while True:
+        chunk_qs = queryset.order_by(*fields)
+        if after is not None:
+            chunk_qs = chunk_qs.filter(_after(fields, _values(after)))
+        chunk = [row async for row in chunk_qs[:chunk_size]]
+        if not chunk:
+            return
+        yield chunk
+        if len(chunk) < chunk_size:
+            return
+        last = chunk[-1]
+        after = tuple(getattr(last, _field_name(field)) for field in fields[:-1]) + (last.pk,)
+
+
+def get_ordering(request):
+    ordering = request.GET.get('sort', DEFAULT_ORDERING)
+    return ordering if ordering in ORDERINGS else DEFAULT_ORDERING
+
+
+def get_cursor(request, name, ordering=DEFAULT_ORDERING, model=None):
+    # Некорректный курсор в URL считаем отсутствующим
+    if name not in request.GET:
+        return None
+    return decode_cursor(request.GET[name], ordering, model)
+
+
+def get_page_size(request):
+    # Размер страницы можно передать в ?per_page=, но не больше максимума
+    try:
+        per_page = int(request.GET.get('per_page', settings.PRODUCT_LIST_PAGE_SIZE))
+    except ValueError:
+        per_page = settings.PRODUCT_LIST_PAGE_SIZE
+    return max(1, min(per_page, settings.PRODUCT_LIST_MAX_PAGE_SIZE))
+
+
+def table_estimate(model, using='default'):
+    """
+    Примерное число строк таблицы model без COUNT(*): по статистике PostgreSQL
+    или по наибольшему rowid в SQLite. None, если оценки нет.
+    """
+    connection = connections[using]
+    table = connection.ops.quote_name(model._meta.db_table)
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass', [table])
+        elif connection.vendor == 'sqlite':
+            cursor.execute(f'SELECT MAX(rowid) FROM {table}')
+        else:
+            return None
+        row = cursor.fetchone()
+    # reltuples = -1, если таблицу еще не анализировали
+    return row[0] if row and row[0] is not None and row[0] >= 0 else None
+
+
+def bounded_count(queryset, limit):
+    """
+    COUNT не больше чем по limit + 1 строкам: результат больше limit значит "больше limit".
+    """
+    return queryset.order_by()[:limit + 1].count()
@@ -0,0 +1,139 @@
+"""
+Отчеты о продажах и выгрузка заказов. Выручка считается агрегатами SQL по строкам
+заказов (цена * количество), выгрузка идет потоково курсором базы.
+"""
+import csv
+import json
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+from itertools import groupby
+
+from django.db.models import Count, DecimalField, F, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from .models import Order, OrderItem
+
+# Группировки отчета: ключи строки отчета (поля строки заказа и выражения)
+GROUPINGS = {
+    'day': ((), {'day': TruncDate('order__created')}),
+    'status': ((), {'status': F('order__status')}),
+    'product': (('product_id',), {'product_name': F('product__name')}),
+}
+EXPORT_FORMATS = ('csv', 'jsonl')
+CENT = Decimal('0.01')
+ORDER_FIELDS = ('id', 'order_number', 'created', 'status', 'paid', 'full_name', 'email', 'city', 'total', 'item_count')
+ITEM_FIELDS = ('product_id', 'product_name', 'quantity', 'price')
+
+
+class ReportError(ValueError):
+    """
+    Некорректные параметры отчета.
+    """
+
+
+def parse_period(since=None, until=None):
+    """
+    Границы периода [since 00:00, until + 1 день 00:00) по строкам YYYY-MM-DD.
+    """
+    bounds = []
+    for value, shift in ((since, 0), (until, 1)):
+        if not value:
+            bounds.append(None)
+            continue
+        day = parse_date(value) if isinstance(value, str) else value
+        if day is None:
+            raise ReportError(f'Некорректная дата: {value}')
+        bounds.append(timezone.make_aware(datetime.combine(day + timedelta(days=shift), time.min)))
+    return tuple(bounds)
+
+
+def filter_orders(queryset, since=None, until=None, status=None, prefix=''):
+    start, end = parse_period(since, until)
+    if start:
+        queryset = queryset.filter(**{f'{prefix}created__gte': start})
+    if end:
+        queryset = queryset.filter(**{f'{prefix}created__lt': end})
+    if status:
+        queryset = queryset.filter(**{f'{prefix}status': status})
+    return queryset
+
+
+def _plain(value):
+    # Значения для JSON и CSV: даты в ISO, Decimal строкой без потери точности
+    if isinstance(value, Decimal):
+        return str(value)
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return value
+
+
+def aggregate_items(items, group_by):
+    """
+    Выручка, число единиц товара и заказов по группам для выборки строк заказов.
+    """
+    if group_by not in GROUPINGS:
+        raise ReportError(f'Группировка: {", ".join(GROUPINGS)}')
+    fields, expressions = GROUPINGS[group_by]
+    return (items.values(*fields, **expressions)
+            .annotate(revenue=Sum(F('price') * F('quantity'), output_field=DecimalField(max_digits=14, decimal_places=2)),
+                      items=Sum('quantity'), orders=Count('order_id', distinct=True))
+            .order_by(*fields, *expressions))
+
+
+def format_rows(rows):
+    report = []
+    for row in rows:
+        # SQLite возвращает сумму без фиксированного числа знаков
+        row['revenue'] = (row['revenue'] or Decimal(0)).quantize(CENT)
+        report.append({key: _plain(value) for key, value in row.items()})
+    return report
+
+
+def revenue_report(group_by, since=None, until=None, status=None):
+    """
+    Выручка, число единиц товара и заказов по дням, статусам или товарам
+    одним агрегирующим запросом по строкам заказов.
+    """
+    items = filter_orders(OrderItem.objects.all(), since, until, status, prefix='order__')
+    return format_rows(aggregate_items(items, group_by))
+
+
+class _Echo(object):
+    # csv.writer пишет строку сюда и возвращает ее, без буфера в памяти
+    def write(self, value):
+        return value
+
+
+def export_lines(fmt, since=None, until=None, status=None, chunk_size=2000):
+    """
+    Строки выгрузки заказов со строками заказов: CSV - строка на строку заказа,
+    JSONL - заказ со списком строк. Заказы и строки читаются одним запросом
+    с LEFT JOIN курсором базы пачками по chunk_size. Параметры проверяются сразу,
+    строки генерируются по мере чтения.
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ReportError(f'Формат: {", ".join(EXPORT_FORMATS)}')
+    orders = filter_orders(Order.objects.all(), since, until, status)
+    rows = (orders.order_by('pk', 'items__id')
+            .values_list(*ORDER_FIELDS, 'items__product_id', 'items__product__name', 'items__quantity', 'items__price')
+            .iterator(chunk_size=chunk_size))
+    return _csv_lines(rows) if fmt == 'csv' else _jsonl_lines(rows)
+
+
+def _csv_lines(rows):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(ORDER_FIELDS + ITEM_FIELDS)
+    for row in rows:
+        yield writer.writerow(['' if value is None else _plain(value) for value in row])
+
+
+def _jsonl_lines(rows):
+    # Строки одного заказа идут подряд благодаря сортировке по id заказа
+    width = len(ORDER_FIELDS)
+    for _, group in groupby(rows, key=lambda row: row[0]):
+        group = list(group)
+        order = {field: _plain(value) for field, value in zip(ORDER_FIELDS, group[0][:width])}
+        order['items'] = [dict(zip(ITEM_FIELDS, map(_plain, row[width:]))) for row in group if row[width] is not None]
+        yield json.dumps(order, ensure_ascii=False) + '\n'
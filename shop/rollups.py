@@ -0,0 +1,193 @@
+"""
+Сводка продаж по дням, товарам и статусам заказов (SalesRollup). Сводка строится
+по заказам, созданным до начала текущего часа (cutoff), и обновляется по дням:
+пересчитываются только дни заказов, у которых updated больше отметки прошлого
+обновления. Отчет по сводке добавляет к ней живые данные с cutoff до текущего момента.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, time, timedelta
+
+import django
+from django.conf import settings
+from django.db import connections, reset_queries, transaction
+from django.db.models import DecimalField, F, Max, Min, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from .bulk import insert_rows
+from .models import Order, OrderItem, Product, RollupState, SalesRollup
+from .reports import ReportError, aggregate_items, filter_orders, format_rows
+
+ROLLUP = 'sales'
+ROLLUP_FIELDS = ('day', 'product', 'status', 'quantity', 'revenue')
+# Ключ строки отчета по сводке и то же значение для строки заказа; имена товаров
+# берутся отдельным запросом, без JOIN по всей сводке
+GROUPINGS = {
+    'day': ('day', TruncDate('order__created')),
+    'status': ('status', F('order__status')),
+    'product': ('product_id', F('product_id')),
+}
+
+
+def hour_start(moment):
+    return moment.replace(minute=0, second=0, microsecond=0)
+
+
+def _day_start(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def rebuild_days(start, end, cutoff, batch_size=5000):
+    """
+    Пересчитывает сводку за дни [start, end) по заказам, созданным до cutoff:
+    строки этих дней удаляются и вставляются заново одной транзакцией.
+    Возвращает число строк сводки.
+    """
+    created_until = min(_day_start(end), cutoff)
+    # Агрегат считается до транзакции записи, чтобы не держать блокировку на время чтения
+    # строк заказов; в памяти не больше дней * товаров * статусов строк
+    rollup = [(row['day'], row['product_id'], row['status'], row['units'], row['revenue'])
+              for row in (OrderItem.objects
+                          .filter(order__created__gte=_day_start(start), order__created__lt=created_until)
+                          .values('product_id', day=TruncDate('order__created'), status=F('order__status'))
+                          .annotate(revenue=Sum(F('price') * F('quantity'),
+                                                output_field=DecimalField(max_digits=14, decimal_places=2)),
+                                    units=Sum('quantity'))
+                          .order_by()
+                          .iterator(chunk_size=batch_size))]
+    with transaction.atomic():
+        SalesRollup.objects.filter(day__gte=start, day__lt=end).delete()
+        insert_rows(SalesRollup, ROLLUP_FIELDS, rollup, batch_size=batch_size)
+    reset_queries()
+    return len(rollup)
+
+
+def _days(start, end):
+    day = start
+    while day < end:
+        yield day
+        day += timedelta(days=1)
+
+
+def refresh_rollup(now=None):
+    """
+    Обновляет сводку: пересчитывает дни заказов, измененных после отметки
+    прошлого обновления (с запасом SALES_ROLLUP_OVERLAP секунд на транзакции,
+    закоммиченные позже), и дни между прошлым и новым cutoff. Первый вызов
+    строит сводку целиком. Возвращает {'days', 'rows'}.
+    """
+    now = now or timezone.now()
+    cutoff = hour_start(now)
+    state = RollupState.objects.filter(name=ROLLUP).first()
+    if state is None or state.cutoff is None:
+        return rebuild_rollup(now=now)
+    mark = Order.objects.aggregate(mark=Max('updated'))['mark']
+    days = set()
+    if state.updated_mark:
+        since = state.updated_mark - timedelta(seconds=settings.SALES_ROLLUP_OVERLAP)
+        days.update(Order.objects.filter(updated__gt=since, created__lt=cutoff)
+                    .values_list(TruncDate('created'), flat=True).distinct())
+    if cutoff > state.cutoff:
+        days.update(_days(timezone.localdate(state.cutoff), timezone.localdate(cutoff) + timedelta(days=1)))
+    rows = sum(rebuild_days(day, day + timedelta(days=1), cutoff) for day in sorted(days))
+    _save_state(mark, cutoff)
+    return {'days': len(days), 'rows': rows}
+
+
+def _save_state(mark, cutoff):
+    RollupState.objects.update_or_create(name=ROLLUP, defaults={'updated_mark': mark, 'cutoff': cutoff})
+
+
+def _rebuild_range(days):
+    return rebuild_days(*days)
+
+
+def rebuild_rollup(since=None, until=None, workers=1, chunk_days=31, now=None):
+    """
+    Пересчитывает сводку за дни с since по until включительно (по умолчанию за
+    всю историю) кусками по chunk_days дней в workers процессах.
+    Пересчет всей истории заново задает отметку и cutoff сводки, пересчет
+    части дней берет cutoff прошлого обновления, чтобы не задвоить живые данные;
+    пока всю историю не пересчитали ни разу, отчет сводку не использует.
+    Возвращает {'days', 'rows'}.
+    """
+    state = RollupState.objects.filter(name=ROLLUP).first()
+    full = since is None and until is None
+    if full or state is None or state.cutoff is None:
+        cutoff = hour_start(now or timezone.now())
+    else:
+        cutoff = state.cutoff
+    mark = Order.objects.aggregate(mark=Max('updated'))['mark']
+    bounds = Order.objects.filter(created__lt=cutoff).aggregate(first=Min('created'), last=Max('created'))
+    start = _parse_day(since) if since else (timezone.localdate(bounds['first']) if bounds['first'] else None)
+    end = _parse_day(until) if until else (timezone.localdate(bounds['last']) if bounds['last'] else None)
+    rows = days = 0
+    if start is not None and end is not None and start <= end:
+        end += timedelta(days=1)
+        days = (end - start).days
+        ranges = [(day, min(day + timedelta(days=chunk_days), end), cutoff) for day in _days(start, end)
+                  if (day - start).days % chunk_days == 0]
+        if workers > 1 and len(ranges) > 1:
+            # Процессы открывают свои соединения: унаследованные после fork использовать нельзя
+            connections.close_all()
+            with ProcessPoolExecutor(max_workers=workers, initializer=django.setup) as pool:
+                rows = sum(pool.map(_rebuild_range, ranges))
+        else:
+            rows = sum(map(_rebuild_range, ranges))
+    if full:
+        # Дни без заказов (например, удаленных) не попали ни в один кусок
+        stale = SalesRollup.objects.all()
+        if start is not None and end is not None:
+            stale = stale.exclude(day__gte=start, day__lt=end)
+        stale.delete()
+        _save_state(mark, cutoff)
+    return {'days': days, 'rows': rows}
+
+
+def _parse_day(value):
+    day = parse_date(value) if isinstance(value, str) else value
+    if day is None:
+        raise ReportError(f'Некорректная дата: {value}')
+    return day
+
+
+def rollup_report(group_by, since=None, until=None, status=None, live=True):
+    """
+    Отчет как shop.reports.revenue_report, но по сводке, без числа заказов.
+    С live к сводке добавляются строки заказов, созданных после ее cutoff.
+    """
+    if group_by not in GROUPINGS:
+        raise ReportError(f'Группировка: {", ".join(GROUPINGS)}')
+    key, source = GROUPINGS[group_by]
+    rollup = SalesRollup.objects.all()
+    if since:
+        rollup = rollup.filter(day__gte=_parse_day(since))
+    if until:
+        rollup = rollup.filter(day__lte=_parse_day(until))
+    if status:
+        rollup = rollup.filter(status=status)
+    state = RollupState.objects.filter(name=ROLLUP).first()
+    cutoff = state.cutoff if state else None
+    if cutoff is None:
+        rollup = rollup.none()
+    groups = {row[key]: row for row in rollup.values(key).annotate(revenue=Sum('revenue'), items=Sum('quantity'))}
+    if live:
+        items = filter_orders(OrderItem.objects.all(), since, until, status, prefix='order__')
+        if cutoff is None:
+            rows = ((row[key], row['revenue'], row['items']) for row in aggregate_items(items, group_by))
+        else:
+            # Строк после cutoff немного: они читаются по индексу даты заказа и складываются здесь,
+            # GROUP BY по товару SQLite выполнил бы просмотром всех строк по индексу товара
+            rows = (items.filter(order__created__gte=cutoff)
+                    .values_list(source, F('price') * F('quantity'), 'quantity').order_by())
+        for value, revenue, quantity in rows:
+            group = groups.setdefault(value, {key: value, 'revenue': 0, 'items': 0})
+            group['revenue'] += revenue or 0
+            group['items'] += quantity
+    rows = [groups[value] for value in sorted(groups)]
+    if group_by == 'product':
+        names = dict(Product.objects.filter(pk__in=groups).values_list('pk', 'name'))
+        rows = [{key: row[key], 'product_name': names.get(row[key]), 'revenue': row['revenue'], 'items': row['items']}
+                for row in rows]
+    return format_rows(rows)
@@ -0,0 +1,89 @@
+import contextvars
+import functools
+import time
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+
+from .models import CatalogFacet, Product
+from .page_cache import catalog_version
+
+# Модели каталога, которые можно читать с реплики
+REPLICA_MODELS = (Product, CatalogFacet)
+PRIMARY_UNTIL_SESSION_KEY = 'primary_until'
+
+_replica_allowed = contextvars.ContextVar('replica_allowed', default=False)
+
+
+def pin_to_primary(request):
+    """
+    После записи (например, оформления заказа) пользователь REPLICA_MAX_LAG секунд
+    читает с основной базы и видит свои изменения, даже если реплика отстает.
+    """
+    request.session[PRIMARY_UNTIL_SESSION_KEY] = time.time() + settings.REPLICA_MAX_LAG
+
+
+def _pinned(request):
+    # Без cookie сессии сессию не загружаем: у гостя нет своих записей
+    if settings.SESSION_COOKIE_NAME not in request.COOKIES:
+        return False
+    return request.session.get(PRIMARY_UNTIL_SESSION_KEY, 0) > time.time()
+
+
+def replica_reads(view):
+    """
+    Разрешает читать каталог с реплики в GET-запросах view. Запросы на запись
+    и пользователи, недавно что-то записавшие, остаются на основной базе.
+    """
+    def allowed(request):
+        return settings.REPLICA_DATABASE is not None and request.method in ('GET', 'HEAD')
+
+    if iscoroutinefunction(view):
+        @functools.wraps(view)
+        async def async_wrapper(request, *args, **kwargs):
+            # Сессия в Django 5.0 читается только синхронно
+            token = _replica_allowed.set(allowed(request) and not await sync_to_async(_pinned)(request))
+            try:
+                return await view(request, *args, **kwargs)
+            finally:
+                _replica_allowed.reset(token)
+        return async_wrapper
+
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        token = _replica_allowed.set(allowed(request) and not _pinned(request))
+        try:
+            return view(request, *args, **kwargs)
+        finally:
+            _replica_allowed.reset(token)
+    return wrapper
+
+
+def _catalog_settled():
+    # Каталог менялся позже, чем REPLICA_MAX_LAG секунд назад: реплика могла
+    # не успеть получить изменения, а страница из нее попала бы в кэш с новой версией.
+    # Версия каталога хранится в кэше страниц, общем для процессов сервера, поэтому
+    # изменение в одном процессе видят все; с кэшем в памяти (DEBUG) - только этот процесс
+    return time.time_ns() - catalog_version() > settings.REPLICA_MAX_LAG * 1e9
+
+
+class ReplicaRouter(object):
+    """
+    Чтение каталога из представлений с replica_reads идет на реплику
+    REPLICA_DATABASE, все остальное - на основную базу.
+    """
+    def db_for_read(self, model, **hints):
+        if model in REPLICA_MODELS and _replica_allowed.get() and _catalog_settled():
+            return settings.REPLICA_DATABASE
+        return 'default'
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Реплика - копия основной базы, связи между их объектами допустимы
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Схема реплики приходит вместе с данными из основной базы
+        return db == 'default'
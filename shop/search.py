@@ -0,0 +1,349 @@
+import math
+import re
+from collections import Counter
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+from .models import Product
+
+FTS_TABLE = 'shop_product_fts'
+# Число товаров с каждой основой слова. Встроенная статистика FTS5 (bm25, fts5vocab)
+# для частых слов читает весь список документов, поэтому ведем свою.
+TERMS_TABLE = 'shop_product_fts_terms'
+# Псевдотермин, который есть у каждого товара: его счетчик - размер индекса
+ALL_DOCUMENTS = ''
+
+CREATE_INDEX_SQL = (
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+    "name, characteristics, tokenize='unicode61 remove_diacritics 2', prefix='3 5 7')"
+)
+CREATE_TERMS_SQL = f'CREATE TABLE IF NOT EXISTS {TERMS_TABLE} (term TEXT PRIMARY KEY, docs INTEGER NOT NULL) WITHOUT ROWID'
+# Длины префиксов, для которых FTS5 строит отдельный индекс
+PREFIX_LENGTHS = (7, 5, 3)
+
+INSERT_SQL = f'INSERT INTO {FTS_TABLE} (rowid, name, characteristics) VALUES ({{p}}, {{p}}, {{p}})'
+ADD_TERM_SQL = (f'INSERT INTO {TERMS_TABLE} (term, docs) VALUES ({{p}}, {{p}}) '
+                'ON CONFLICT (term) DO UPDATE SET docs = docs + excluded.docs')
+# Параметры BM25 и вес совпадения в названии относительно описания
+BM25_K1 = 1.2
+BM25_B = 0.75
+NAME_WEIGHT = 10
+
+# Кандидаты - лучшие по bm25 FTS5 совпадения (меньше - лучше). Без ORDER BY FTS5
+# отдал бы первые совпадения по rowid, и лучшие товары могли не попасть в LIMIT
+CANDIDATES_SQL = (f'SELECT rowid, name, characteristics, bm25({FTS_TABLE}, {NAME_WEIGHT}, 1) AS score '
+                  f'FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH {{p}} ORDER BY score LIMIT {{p}}')
+
+TOKEN_RE = re.compile(r'\w+')
+
+VOWELS = 'аеиоуыэюя'
+
+# Окончания для стеммера Портера (Snowball) для русского языка
+PERFECTIVE_GERUND_1 = ('вшись', 'вши', 'в')
+PERFECTIVE_GERUND_2 = ('ившись', 'ывшись', 'ивши', 'ывши', 'ив', 'ыв')
+ADJECTIVE = ('ими', 'ыми', 'его', 'ого', 'ему', 'ому', 'ее', 'ие', 'ые', 'ое', 'ей', 'ий', 'ый', 'ой',
+             'ем', 'им', 'ым', 'ом', 'их', 'ых', 'ую', 'юю', 'ая', 'яя', 'ою', 'ею')
+PARTICIPLE_1 = ('ем', 'нн', 'вш', 'ющ', 'щ')
+PARTICIPLE_2 = ('ивш', 'ывш', 'ующ')
+REFLEXIVE = ('ся', 'сь')
+VERB_1 = ('ете', 'йте', 'ешь', 'нно', 'ла', 'на', 'ли', 'ем', 'ло', 'но', 'ет', 'ют', 'ны', 'ть', 'й', 'л', 'н')
+VERB_2 = ('ейте', 'уйте', 'ила', 'ыла', 'ена', 'ите', 'или', 'ыли', 'ило', 'ыло', 'ено', 'ует', 'уют', 'ены',
+          'ить', 'ыть', 'ишь', 'ей', 'уй', 'ил', 'ыл', 'им', 'ым', 'ен', 'ят', 'ит', 'ыт', 'ую', 'ю')
+NOUN = ('иями', 'ями', 'ами', 'ией', 'иям', 'ием', 'иях', 'ев', 'ов', 'ие', 'ье', 'еи', 'ии', 'ей', 'ой',
+        'ий', 'ям', 'ем', 'ам', 'ом', 'ах', 'ях', 'ию', 'ью', 'ия', 'ья', 'а', 'е', 'и', 'й', 'о', 'у', 'ы',
+        'ь', 'ю', 'я')
+SUPERLATIVE = ('ейше', 'ейш')
+DERIVATIONAL = ('ость', 'ост')
+
+
+def _region(word, start=0):
+    # Позиция после первой согласной, следующей за гласной (R1 в терминах Snowball)
+    for i in range(start + 1, len(word)):
+        if word[i] not in VOWELS and word[i - 1] in VOWELS:
+            return i + 1
+    return len(word)
+
+
+def _strip(word, start, endings, after_a=False):
+    """
+    Отрезает самое длинное из окончаний endings, лежащее целиком после start.
+    С after_a окончание должно идти после "а" или "я", которые остаются в слове.
+    """
+    for ending in sorted(endings, key=len, reverse=True):
+        if word.endswith(ending) and len(word) - len(ending) >= start:
+            if after_a:
+                pos = len(word) - len(ending) - 1
+                if pos < start or word[pos] not in 'ая':
+                    continue
+            return word[:-len(ending)]
+    return None
+
+
+def stem(word):
+    """
+    Основа русского слова по алгоритму Snowball. Слова без кириллицы
+    возвращаются без изменений.
+    """
+    word = word.lower().replace('ё', 'е')
+    rv = next((i + 1 for i, ch in enumerate(word) if ch in VOWELS), len(word))
+    if rv >= len(word):
+        return word
+    r2 = _region(word, _region(word))
+
+    # Шаг 1
+    result = _strip(word, rv, PERFECTIVE_GERUND_1, after_a=True) or _strip(word, rv, PERFECTIVE_GERUND_2)
+    if result is None:
+        word = _strip(word, rv, REFLEXIVE) or word
+        adjective = _strip(word, rv, ADJECTIVE)
+        if adjective is not None:
+            result = (_strip(adjective, rv, PARTICIPLE_1, after_a=True)
+                      or _strip(adjective, rv, PARTICIPLE_2) or adjective)
+        else:
+            result = (_strip(word, rv, VERB_1, after_a=True) or _strip(word, rv, VERB_2)
+                      or _strip(word, rv, NOUN))
+    word = result if result is not None else word
+
+    # Шаг 2
+    if word.endswith('и') and len(word) - 1 >= rv:
+        word = word[:-1]
+    # Шаг 3
+    word = _strip(word, r2, DERIVATIONAL) or word
+    # Шаг 4
+    if word.endswith('нн') and len(word) - 2 >= rv:
+        word = word[:-1]
+    else:
+        superlative = _strip(word, rv, SUPERLATIVE)
+        if superlative is not None:
+            word = superlative[:-1] if superlative.endswith('нн') else superlative
+        elif word.endswith('ь') and len(word) - 1 >= rv:
+            word = word[:-1]
+    return word
+
+
+def normalize(text):
+    # Текст для индекса: основы слов через пробел
+    return ' '.join(stem(token) for token in TOKEN_RE.findall(text or '') if token != '_')
+
+
+def parse_query(query):
+    """
+    Разбирает запрос на список (основа, префикс ли). Последнее слово
+    считается недописанным и ищется по префиксу.
+    """
+    terms = [(term, False) for term in dict.fromkeys(normalize(query).split())]
+    if terms:
+        terms[-1] = (terms[-1][0], len(terms[-1][0]) >= PREFIX_LENGTHS[-1])
+    return terms
+
+
+def match_expression(terms, truncate=True):
+    """
+    Запрос в синтаксисе FTS5: все слова должны встретиться. Префикс
+    укорачивается до ближайшей длины с префиксным индексом, лишние
+    совпадения потом отсеиваются при ранжировании. Без truncate
+    префикс ищется целиком.
+    """
+    parts = []
+    for term, is_prefix in terms:
+        if is_prefix and not truncate:
+            parts.append(f'"{term}"*')
+        elif is_prefix:
+            length = next(length for length in PREFIX_LENGTHS if length <= len(term))
+            parts.append(f'"{term[:length]}"*')
+        else:
+            parts.append(f'"{term}"')
+    return ' '.join(parts)
+
+
+def document_terms(name, characteristics):
+    # Набор основ товара вместе с псевдотермином, общим для всех товаров
+    return set(name.split()) | set(characteristics.split()) | {ALL_DOCUMENTS}
+
+
+def write_documents(cursor, documents, placeholder='%s'):
+    """
+    Добавляет в индекс уже нормализованные товары (id, название, описание)
+    и увеличивает счетчики их основ.
+    """
+    documents = list(documents)
+    cursor.executemany(INSERT_SQL.format(p=placeholder), documents)
+    counts = Counter()
+    for _, name, characteristics in documents:
+        counts.update(document_terms(name, characteristics))
+    cursor.executemany(ADD_TERM_SQL.format(p=placeholder), list(counts.items()))
+
+
+def _delete_document(cursor, product_id):
+    cursor.execute(f'SELECT name, characteristics FROM {FTS_TABLE} WHERE rowid = %s', [product_id])
+    row = cursor.fetchone()
+    if row is None:
+        return
+    cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [product_id])
+    cursor.executemany(f'UPDATE {TERMS_TABLE} SET docs = docs - 1 WHERE term = %s',
+                       [(term,) for term in document_terms(*row)])
+
+
+def is_available(using=connection):
+    return using.vendor == 'sqlite'
+
+
+def index_product(product, using=connection):
+    """
+    Добавляет товар в поисковый индекс или обновляет его запись.
+    """
+    if not is_available(using):
+        return
+    with using.cursor() as cursor:
+        _delete_document(cursor, product.pk)
+        write_documents(cursor, [(product.pk, normalize(product.name), normalize(product.characteristics))])
+
+
+def remove_product(product_id, using=connection):
+    if not is_available(using):
+        return
+    with using.cursor() as cursor:
+        _delete_document(cursor, product_id)
+
+
+def index_products(product_ids, batch_size=1000, using=connection):
+    """
+    Обновляет записи товаров product_ids в индексе пачками по batch_size,
+    как index_product для каждого, но без загрузки товаров по одному.
+    Возвращает число проиндексированных товаров.
+    """
+    if not is_available(using):
+        return 0
+    product_ids = list(product_ids)
+    indexed = 0
+    with transaction.atomic(using=using.alias), using.cursor() as cursor:
+        for position in range(0, len(product_ids), batch_size):
+            chunk = product_ids[position:position + batch_size]
+            for product_id in chunk:
+                _delete_document(cursor, product_id)
+            rows = Product.objects.using(using.alias).filter(pk__in=chunk).values_list('pk', 'name', 'characteristics')
+            documents = [(pk, normalize(name), normalize(characteristics)) for pk, name, characteristics in rows]
+            write_documents(cursor, documents)
+            indexed += len(documents)
+    return indexed
+
+
+def rebuild_index(batch_size=1000, using=connection):
+    """
+    Полностью перестраивает индекс по таблице товаров пачками по batch_size.
+    Перестройка идет одной транзакцией: до коммита поиск видит прежний индекс.
+    Возвращает число проиндексированных товаров.
+    """
+    if not is_available(using):
+        return 0
+    indexed = 0
+    last_id = 0
+    with transaction.atomic(using=using.alias), using.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE}')
+        cursor.execute(f'DELETE FROM {TERMS_TABLE}')
+        while True:
+            rows = list(Product.objects.filter(pk__gt=last_id).order_by('pk')
+                        .values_list('pk', 'name', 'characteristics')[:batch_size])
+            if not rows:
+                return indexed
+            write_documents(cursor, [(pk, normalize(name), normalize(characteristics))
+                                     for pk, name, characteristics in rows])
+            indexed += len(rows)
+            last_id = rows[-1][0]
+
+
+def _document_frequencies(cursor, terms, placeholder):
+    # Число товаров с каждой основой; для префикса - сумма по первым 100 основам с ним
+    frequencies = {}
+    exact = [term for term, is_prefix in terms if not is_prefix] + [ALL_DOCUMENTS]
+    cursor.execute(f'SELECT term, docs FROM {TERMS_TABLE} WHERE term IN ({", ".join([placeholder] * len(exact))})',
+                   exact)
+    frequencies.update(cursor.fetchall())
+    for term, is_prefix in terms:
+        if is_prefix:
+            cursor.execute(f'SELECT SUM(docs) FROM (SELECT docs FROM {TERMS_TABLE} '
+                           f'WHERE term >= {placeholder} AND term < {placeholder} LIMIT 100)',
+                           [term, term + '\uffff'])
+            frequencies[term] = cursor.fetchone()[0] or 0
+    return frequencies
+
+
+def rank(rows, terms, frequencies):
+    """
+    Упорядочивает кандидатов (rowid, название, описание, bm25 FTS5) по bm25,
+    а при равном bm25 - по своему BM25 с учетом префиксов. Совпадение в названии
+    весит NAME_WEIGHT совпадений в описании. Кандидаты, в которых префикс
+    найден только в укороченном виде, отбрасываются.
+    """
+    total = max(frequencies.get(ALL_DOCUMENTS, 0), 1)
+    idf = {term: math.log((total - frequencies.get(term, 0) + 0.5) / (frequencies.get(term, 0) + 0.5) + 1)
+           for term, _ in terms}
+    documents = [(rowid, fts_score, name, characteristics, name.split(), characteristics.split())
+                 for rowid, name, characteristics, fts_score in rows]
+    average_length = sum(len(name) + len(text) for *_, name, text in documents) / max(len(documents), 1) or 1
+    scored = []
+    for rowid, fts_score, name_line, text_line, name, text in documents:
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * (len(name) + len(text)) / average_length)
+        score = 0
+        for term, is_prefix in terms:
+            if is_prefix:
+                # Основы разделены одним пробелом: " префикс" встречается столько раз,
+                # сколько основ начинается с префикса
+                frequency = (NAME_WEIGHT * (' ' + name_line).count(' ' + term)
+                             + (' ' + text_line).count(' ' + term))
+            else:
+                frequency = NAME_WEIGHT * name.count(term) + text.count(term)
+            if not frequency:
+                break
+            score += idf[term] * frequency * (BM25_K1 + 1) / (frequency + norm)
+        else:
+            scored.append((fts_score, -score, rowid))
+    scored.sort()
+    return [rowid for *_, rowid in scored]
+
+
+def search_ids(cursor, query, limit, candidates=None, placeholder='%s'):
+    """
+    id товаров, подходящих под запрос, в порядке релевантности.
+    FTS5 сортирует совпадения по bm25 и отдает лучшие candidates,
+    здесь они только досортировываются и отсеиваются.
+    """
+    terms = parse_query(query)
+    if not terms:
+        return []
+    candidates = max(candidates or settings.SEARCH_CANDIDATES_LIMIT, limit)
+    cursor.execute(CANDIDATES_SQL.format(p=placeholder), [match_expression(terms), candidates])
+    rows = cursor.fetchall()
+    if not rows:
+        return []
+    return rank(rows, terms, _document_frequencies(cursor, terms, placeholder))[:limit]
+
+
+def search_products(query, limit=None):
+    """
+    Товары, подходящие под запрос, отсортированные по релевантности.
+    """
+    limit = limit or settings.SEARCH_RESULTS_LIMIT
+    if not is_available():
+        # На других СУБД индекса нет - простой поиск по названию
+        return list(Product.objects.filter(name__icontains=query).order_by('pk')[:limit]) if query.strip() else []
+    with connection.cursor() as cursor:
+        ids = search_ids(cursor, query, limit)
+    products = Product.objects.in_bulk(ids)
+    return [products[pk] for pk in ids if pk in products]
+
+
+def name_filter(query):
+    """
+    Условие для queryset товаров: все слова запроса есть в названии.
+    Товары отбираются по индексу, а не просмотром таблицы с LIKE.
+    """
+    terms = parse_query(query)
+    if not terms:
+        return Q()
+    if not is_available():
+        return Q(name__icontains=query.strip())
+    expression = f'name : ({match_expression(terms, truncate=False)})'
+    return Q(pk__in=RawSQL(f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s', [expression]))
@@ -0,0 +1,46 @@
+from django.db import transaction, IntegrityError
+from django.db.models import F
+
+from .models import Order, Sequence
+
+ORDER_NUMBER_SEQUENCE = 'order_number'
+
+
+class SequenceOverflowError(Exception):
+    """
+    Значение счетчика не помещается в поле, для которого оно берется.
+    """
+
+
+def next_value(name):
+    """
+    Атомарно увеличивает счетчик name и возвращает новое значение.
+    UPDATE блокирует строку счетчика до конца транзакции, в которой вызвана
+    функция, поэтому параллельные вызовы не получают одинаковых значений.
+    Внутри внешней транзакции блокировка держится до ее коммита и все вызовы
+    ждут друг друга: вызывать лучше вне долгих транзакций (place_order берет
+    номер заказа до транзакции оформления). Если внешняя транзакция
+    откатится, откатится и счетчик.
+    """
+    with transaction.atomic():
+        updated = Sequence.objects.filter(name=name).update(value=F('value') + 1)
+        if not updated:
+            # Первое обращение к счетчику - создаем строку
+            try:
+                with transaction.atomic():
+                    Sequence.objects.create(name=name, value=1)
+            except IntegrityError:
+                Sequence.objects.filter(name=name).update(value=F('value') + 1)
+        return Sequence.objects.filter(name=name).values_list('value', flat=True).get()
+
+
+def next_order_number():
+    """
+    Номер нового заказа: значение счетчика, дополненное нулями до 6 цифр.
+    Номер длиннее Order.order_number - ошибка, а не обрезка базой.
+    """
+    number = '{:06}'.format(next_value(ORDER_NUMBER_SEQUENCE))
+    max_length = Order._meta.get_field('order_number').max_length
+    if len(number) > max_length:
+        raise SequenceOverflowError(f'Номер заказа {number} длиннее {max_length} символов')
+    return number
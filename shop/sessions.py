@@ -0,0 +1,23 @@
+import time
+
+from django.contrib.sessions.models import Session
+from django.utils import timezone
+
+
+def clear_expired_sessions(batch_size=1000, pause=0.0, now=None):
+    """
+    Удаляет просроченные сессии пачками по batch_size. Каждая пачка выбирается
+    по индексу expire_date и удаляется отдельным коротким DELETE, между пачками
+    можно сделать паузу pause секунд, чтобы не держать базу заблокированной.
+    """
+    now = now or timezone.now()
+    deleted = 0
+    while True:
+        keys = list(Session.objects.filter(expire_date__lt=now)
+                    .order_by('expire_date').values_list('pk', flat=True)[:batch_size])
+        if keys:
+            deleted += Session.objects.filter(pk__in=keys).delete()[0]
+        if len(keys) < batch_size:
+            return deleted
+        if pause:
+            time.sleep(pause)
@@ -0,0 +1,42 @@
+from django.db.backends.signals import connection_created
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+
+from .models import Product
+from . import facets, images, metrics, search
+from .page_cache import invalidate_products
+from .tasks import enqueue
+
+
+@receiver(pre_save, sender=Product)
+def remember_facets(sender, instance, **kwargs):
+    # Счетчики, в которые товар входил до сохранения, чтобы обновить их на разницу
+    previous = None
+    if not instance._state.adding:
+        previous = Product.objects.filter(pk=instance.pk).values_list('price', 'quantity').first()
+    instance._previous_facets = facets.facet_keys(*previous) if previous else []
+
+
+@receiver(post_save, sender=Product)
+def index_product(sender, instance, raw=False, **kwargs):
+    # При загрузке фикстур (raw) индекс обновляется командой rebuild_search_index
+    if not raw:
+        search.index_product(instance)
+    facets.product_changed(getattr(instance, '_previous_facets', []),
+                           facets.facet_keys(instance.price, instance.quantity))
+    invalidate_products([instance.pk])
+    # Новое изображение обрабатывается в фоне, страница пока показывает исходное
+    if not raw and images.needs_processing(instance):
+        enqueue(images.process_product_image, product_id=instance.pk)
+
+
+@receiver(post_delete, sender=Product)
+def remove_product_from_index(sender, instance, **kwargs):
+    search.remove_product(instance.pk)
+    facets.product_changed(facets.facet_keys(instance.price, instance.quantity), [])
+    invalidate_products([instance.pk])
+
+
+@receiver(connection_created)
+def time_queries(sender, connection, **kwargs):
+    metrics.install_query_timer(connection)
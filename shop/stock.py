@@ -0,0 +1,144 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, When, Value, F, PositiveIntegerField
+from django.utils import timezone
+
+from .models import Product, StockReservation
+from .facets import apply_deltas, in_stock_keys
+from .page_cache import invalidate_products
+
+
+class OutOfStockError(Exception):
+    """
+    На складе не хватает товаров для корзины.
+    """
+    def __init__(self, product_ids):
+        self.product_ids = product_ids
+        super().__init__(f'Недостаточно товаров: {", ".join(map(str, product_ids))}')
+
+
+def _amount(lines):
+    # CASE id WHEN ... THEN количество END - количество для каждой строки корзины
+    return Case(*[When(pk=product_id, then=Value(quantity)) for product_id, quantity in lines.items()],
+                output_field=PositiveIntegerField())
+
+
+def cart_lines(quantities):
+    """
+    Суммирует количество по товарам: {id товара: количество}.
+    Принимает результат parse_cart.
+    """
+    lines = {}
+    for product_id, quantity in quantities.values():
+        if quantity > 0:
+            lines[product_id] = lines.get(product_id, 0) + quantity
+    return lines
+
+
+def invalidate_stock(product_ids, changed_availability):
+    """
+    Сбрасывает кэш страниц после изменения остатков. Версия каталога (списки товаров,
+    чтение с реплики в routers) меняется, только если товар закончился или снова появился:
+    иначе каждое оформление заказа сбрасывало бы все списки. Остаток в карточках
+    закэшированных списков может отставать до PAGE_CACHE_TIMEOUT.
+    """
+    invalidate_products(product_ids, catalog=bool(changed_availability))
+
+
+@transaction.atomic
+def decrement_stock(lines):
+    """
+    Списывает со склада всю корзину одним UPDATE с условием quantity >= n.
+    Если хотя бы одного товара не хватает, ничего не списывается.
+    """
+    if not lines:
+        return
+    amount = _amount(lines)
+    updated = Product.objects.filter(pk__in=lines, quantity__gte=amount).update(quantity=F('quantity') - amount)
+    if updated != len(lines):
+        available = dict(Product.objects.filter(pk__in=lines).values_list('pk', 'quantity'))
+        raise OutOfStockError([product_id for product_id, quantity in lines.items()
+                               if available.get(product_id, 0) < quantity])
+    # UPDATE не вызывает сигналов модели, поэтому счетчики каталога и кэш страниц
+    # обновляем сами: закончившиеся товары выбывают из счетчиков наличия
+    sold_out = list(Product.objects.filter(pk__in=lines, quantity=0).values_list('price', flat=True))
+    apply_deltas({key: -count for key, count in in_stock_keys(sold_out).items()})
+    invalidate_stock(lines, sold_out)
+
+
+@transaction.atomic
+def increment_stock(lines):
+    # Возврат товаров на склад, тоже одним UPDATE
+    if lines:
+        # Товары, которых не было в наличии, снова попадают в счетчики наличия
+        restocked = list(Product.objects.select_for_update()
+                         .filter(pk__in=lines, quantity=0).values_list('price', flat=True))
+        amount = _amount(lines)
+        Product.objects.filter(pk__in=lines).update(quantity=F('quantity') + amount)
+        apply_deltas(in_stock_keys(restocked))
+        invalidate_stock(lines, restocked)
+
+
+@transaction.atomic
+def release_reservations(queryset):
+    """
+    Возвращает на склад товары из резервов queryset и удаляет эти резервы.
+    """
+    rows = list(queryset.select_for_update().values_list('pk', 'product_id', 'quantity'))
+    lines = {}
+    for _, product_id, quantity in rows:
+        lines[product_id] = lines.get(product_id, 0) + quantity
+    increment_stock(lines)
+    StockReservation.objects.filter(pk__in=[pk for pk, _, _ in rows]).delete()
+    return len(rows)
+
+
+def reservation_key(user):
+    """
+    Ключ резерва покупателя. Ключ сессии не подходит: при входе он меняется,
+    и резерв под старым ключом висел бы до истечения срока.
+    """
+    return f'user:{user.pk}'
+
+
+@transaction.atomic
+def reserve_stock(key, lines, ttl=None):
+    """
+    Резервирует товары корзины под ключ key (см. reservation_key) на ttl секунд.
+    Если под key уже есть действующий резерв той же корзины, у него только продлевается срок,
+    иначе предыдущий резерв снимается. Возвращает True, если товары зарезервированы заново.
+    """
+    ttl = settings.STOCK_RESERVATION_TTL if ttl is None else ttl
+    now = timezone.now()
+    expires_at = now + timedelta(seconds=ttl)
+    current = StockReservation.objects.select_for_update().filter(key=key)
+    if lines and dict(current.filter(expires_at__gt=now).values_list('product_id', 'quantity')) == lines:
+        current.update(expires_at=expires_at)
+        return False
+    release_reservations(current)
+    decrement_stock(lines)
+    StockReservation.objects.bulk_create([
+        StockReservation(key=key, product_id=product_id, quantity=quantity, expires_at=expires_at)
+        for product_id, quantity in lines.items()
+    ])
+    return True
+
+
+def release_expired(now=None, batch_size=1000):
+    """
+    Возвращает на склад товары из просроченных резервов брошенных корзин.
+    Просроченные резервы выбираются по индексу expires_at пачками по batch_size,
+    каждая пачка - в своей короткой транзакции.
+    """
+    now = now or timezone.now()
+    released = 0
+    while True:
+        batch = StockReservation.objects.filter(
+            pk__in=list(StockReservation.objects.filter(expires_at__lte=now)
+                        .order_by('expires_at').values_list('pk', flat=True)[:batch_size]))
+        count = release_reservations(batch)
+        released += count
+        if count < batch_size:
+            return released
@@ -0,0 +1,193 @@
+import logging
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import Task
+
+logger = logging.getLogger(__name__)
+
+_registry = {}
+
+
+class UnknownTaskError(Exception):
+    """
+    Задача с таким именем не зарегистрирована.
+    """
+    def __init__(self, name):
+        self.name = name
+        super().__init__(f'Неизвестная задача: {name}')
+
+
+class TaskHandler(object):
+    def __init__(self, func, batch, max_attempts):
+        self.func = func
+        self.batch = batch
+        self.max_attempts = max_attempts
+
+    def run(self, payloads):
+        """
+        Выполняет задачи с аргументами payloads. Возвращает список того же размера:
+        None для выполненной задачи или исключение для неудачной.
+        """
+        if self.batch:
+            return self.func(payloads)
+        results = []
+        for payload in payloads:
+            try:
+                self.func(**payload)
+            except Exception as e:
+                results.append(e)
+            else:
+                results.append(None)
+        return results
+
+
+def task(name=None, batch=False, max_attempts=None):
+    """
+    Регистрирует функцию как задачу очереди. Функция пакетной задачи (batch=True)
+    получает список аргументов всех задач пачки и возвращает список результатов,
+    как TaskHandler.run, например, чтобы отправить все письма через одно соединение.
+    """
+    def decorator(func):
+        func.task_name = name or f'{func.__module__}.{func.__name__}'
+        _registry[func.task_name] = TaskHandler(func, batch, max_attempts)
+        return func
+    return decorator
+
+
+def get_handler(name):
+    try:
+        return _registry[name]
+    except KeyError:
+        raise UnknownTaskError(name)
+
+
+class DatabaseTaskBackend(object):
+    """
+    Задачи пишутся в таблицу Task одним INSERT и выполняются командой run_task_worker.
+    """
+    def enqueue(self, tasks):
+        Task.objects.bulk_create([Task(name=name, payload=payload) for name, payload in tasks])
+
+
+class ImmediateTaskBackend(object):
+    """
+    Задачи выполняются сразу в том же процессе, без таблицы и обработчика (для разработки).
+    """
+    def enqueue(self, tasks):
+        for name, payload in tasks:
+            error = get_handler(name).run([payload])[0]
+            if error is not None:
+                raise error
+
+
+TASK_BACKENDS = {
+    'db': DatabaseTaskBackend,
+    'immediate': ImmediateTaskBackend,
+}
+
+
+def get_backend():
+    return TASK_BACKENDS[settings.TASK_QUEUE_BACKEND]()
+
+
+def enqueue_many(tasks, using=None):
+    """
+    Ставит задачи [(функция или имя, аргументы)] в очередь после коммита текущей
+    транзакции: обработчик не увидит задачу раньше данных, на которые она ссылается,
+    а при откате задачи не ставятся. Ошибка постановки в очередь пишется в лог
+    и не ломает уже закоммиченный запрос.
+    """
+    tasks = [(getattr(func, 'task_name', func), payload) for func, payload in tasks]
+    for name, _ in tasks:
+        get_handler(name)
+    if tasks:
+        transaction.on_commit(lambda: get_backend().enqueue(tasks), using=using, robust=True)
+
+
+def enqueue(func, **payload):
+    enqueue_many([(func, payload)])
+
+
+@transaction.atomic
+def claim_tasks(batch_size, now=None):
+    """
+    Забирает до batch_size задач, которые пора выполнить, и задачи, зависшие
+    у упавшего обработчика дольше TASK_LOCK_TIMEOUT. Задачи отмечаются
+    выполняемыми в той же транзакции, поэтому два обработчика их не возьмут.
+    """
+    now = now or timezone.now()
+    stale = now - timedelta(seconds=settings.TASK_LOCK_TIMEOUT)
+    due = Task.objects.filter(Q(status=Task.QUEUED, run_at__lte=now) | Q(status=Task.RUNNING, locked_at__lt=stale))
+    if connection.features.has_select_for_update_skip_locked:
+        due = due.select_for_update(skip_locked=True)
+    ids = list(due.order_by('run_at').values_list('pk', flat=True)[:batch_size])
+    if not ids:
+        return []
+    Task.objects.filter(pk__in=ids).update(status=Task.RUNNING, locked_at=now, attempts=F('attempts') + 1)
+    return list(Task.objects.filter(pk__in=ids).order_by('run_at'))
+
+
+def retry_delay(attempts):
+    return timedelta(seconds=settings.TASK_RETRY_DELAY * 2 ** (attempts - 1))
+
+
+def run_pending(batch_size=None, now=None):
+    """
+    Выполняет одну пачку задач, задачи с одним именем - одним вызовом обработчика.
+    Выполненные задачи удаляются, неудачные откладываются для повтора, а после
+    последней попытки остаются в таблице со статусом failed. Возвращает число задач.
+    """
+    now = now or timezone.now()
+    tasks = claim_tasks(batch_size or settings.TASK_BATCH_SIZE, now)
+    groups = {}
+    for claimed in tasks:
+        groups.setdefault(claimed.name, []).append(claimed)
+
+    done, failed = [], []
+    for name, group in groups.items():
+        try:
+            handler = get_handler(name)
+            results = handler.run([claimed.payload for claimed in group])
+        except Exception as e:
+            handler = _registry.get(name)
+            results = [e] * len(group)
+        for claimed, error in zip(group, results):
+            if error is None:
+                done.append(claimed.pk)
+            else:
+                failed.append((claimed, handler, error))
+
+    Task.objects.filter(pk__in=done).delete()
+    for claimed, handler, error in failed:
+        max_attempts = (handler and handler.max_attempts) or settings.TASK_MAX_ATTEMPTS
+        logger.warning('Задача %s (%s) не выполнена, попытка %s из %s: %r',
+                       claimed.pk, claimed.name, claimed.attempts, max_attempts, error)
+        if claimed.attempts >= max_attempts:
+            changes = {'status': Task.FAILED}
+        else:
+            changes = {'status': Task.QUEUED, 'run_at': now + retry_delay(claimed.attempts)}
+        Task.objects.filter(pk=claimed.pk).update(locked_at=None, last_error=repr(error)[:2000], **changes)
+    return len(tasks)
+
+
+def run_worker(batch_size=None, poll=1.0, once=False):
+    """
+    Выполняет задачи, пока они есть. Если очередь пуста, ждет poll секунд,
+    а с once=True завершается. Возвращает число обработанных задач.
+    """
+    processed = 0
+    while True:
+        count = run_pending(batch_size)
+        processed += count
+        if not count:
+            if once:
+                return processed
+            # Долго работающий обработчик соблюдает CONN_MAX_AGE, как запросы
+            close_old_connections()
+            time.sleep(poll)
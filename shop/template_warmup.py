@@ -0,0 +1,62 @@
+"""
+Компиляция шаблонов при запуске процесса. С кэширующим загрузчиком скомпилированный
+шаблон хранится в памяти, и первый запрос к странице не тратит время на разбор
+шаблона и всех шаблонов, от которых он наследуется.
+"""
+import logging
+import os
+import time
+
+from django.conf import settings
+from django.template import engines
+from django.template.backends.django import DjangoTemplates
+
+logger = logging.getLogger('shop.templates')
+
+
+def _loader_dirs(loaders):
+    # Каталоги загрузчиков; кэширующий загрузчик берет шаблоны у вложенных
+    for loader in loaders:
+        if hasattr(loader, 'loaders'):
+            yield from _loader_dirs(loader.loaders)
+        elif hasattr(loader, 'get_dirs'):
+            yield from map(str, loader.get_dirs())
+
+
+def template_names(engine, prefixes):
+    """
+    Имена шаблонов в каталогах загрузчиков engine (DIRS и templates/ приложений),
+    начинающиеся с prefixes.
+    """
+    names = set()
+    for directory in _loader_dirs(engine.template_loaders):
+        for prefix in prefixes:
+            root = os.path.join(directory, prefix)
+            for path, _, files in os.walk(root):
+                for name in files:
+                    names.add(os.path.relpath(os.path.join(path, name), directory).replace(os.sep, '/'))
+    return sorted(names)
+
+
+def warm_templates(prefixes=None):
+    """
+    Загружает (компилирует) шаблоны с префиксами prefixes (по умолчанию
+    TEMPLATE_WARMUP_PREFIXES) всех движков Django. Возвращает число шаблонов.
+    """
+    prefixes = tuple(prefixes or settings.TEMPLATE_WARMUP_PREFIXES)
+    started = time.perf_counter()
+    count = 0
+    for backend in engines.all():
+        if not isinstance(backend, DjangoTemplates):
+            continue
+        for name in template_names(backend.engine, prefixes):
+            backend.engine.get_template(name)
+            count += 1
+    logger.info('Скомпилировано шаблонов: %d за %.1f мс', count, (time.perf_counter() - started) * 1000)
+    return count
+
+
+def warm_on_startup():
+    # Вызывается из main.wsgi и main.asgi, а не из AppConfig.ready: командам manage.py шаблоны не нужны
+    if settings.TEMPLATE_WARMUP:
+        warm_templates()
@@ -0,0 +1,29 @@
+from django import template
+from django.core.files.storage import default_storage
+
+from ..images import srcset
+
+register = template.Library()
+
+
+@register.inclusion_tag('shop/product_image.html')
+def product_image(product, sizes='100vw', loading='lazy', css_class='fit-picture'):
+    """
+    Изображение товара: миниатюры WebP и JPEG через srcset, если они готовы
+    для текущего источника, иначе исходный адрес. Ширина и высота задаются,
+    чтобы страница не прыгала при загрузке отложенных картинок.
+    """
+    context = {'product': product, 'sizes': sizes, 'loading': loading, 'css_class': css_class}
+    variants = product.image_variants or {}
+    if product.image and variants.get('source') == product.image:
+        # src для браузеров без srcset - средняя по ширине миниатюра, лучше JPEG
+        fallback = list((variants.get('jpeg') or variants.get('webp') or {}).values())
+        if fallback:
+            context.update({
+                'webp_srcset': srcset(variants, 'webp'),
+                'jpeg_srcset': srcset(variants, 'jpeg'),
+                'src': default_storage.url(fallback[len(fallback) // 2]),
+                'width': variants['width'],
+                'height': variants['height'],
+            })
+    return context
@@ -1,9 +1,64 @@
+import asyncio
+import json
+import os
+import re
+import sqlite3
+import shutil
+import tempfile
+import threading
+import time
+import warnings
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest import mock, skipUnless
+from asgiref.sync import sync_to_async
 from django.contrib.auth import get_user_model
-from django.urls import reverse
-from django.test import TestCase, Client
-from .models import Product, User, Order, OrderItem
+from django.core import mail
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.db import connection, connections, DatabaseError
+from django.db.models import Sum
+from django.conf import settings
+from django.contrib.sessions.backends.cached_db import SessionStore
+from django.core.cache import caches
+from django.core.cache.backends.base import CacheKeyWarning
+from django.core.cache.backends.filebased import FileBasedCache
+from django.template import engines
+from django.template.base import Template
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.urls import reverse, path, include
+from django.http import HttpResponse
+from django.test import TestCase, TransactionTestCase, Client, RequestFactory, override_settings
+from .models import (Product, User, Order, OrderItem, Sequence, StockReservation, CatalogFacet, StoredCart, Task,
+                     SalesRollup, OrderStatusChange)
+from .facets import get_facets, rebuild_facets
+from .sequences import ORDER_NUMBER_SEQUENCE, SequenceOverflowError
+from .stock import (decrement_stock, increment_stock, reservation_key, reserve_stock, release_expired,
+                    OutOfStockError)
+from .search import search_products, stem
+from .page_cache import get_cache, reset_stats, cache_stats, CSRF_MARKER, CATALOG_VERSION_KEY
+from .cache_backends import LRUFileBasedCache
+from .sessions import clear_expired_sessions
+from .cart import Cart, CartLimitError, hydrate_cart, encode_cart, decode_cart
+from .benchmarks import seed, seed_sales, run_client, find_regressions, template_profile_settings
+from .metrics import request_stats, reset_stats as reset_request_stats
+from .middleware import RequestMetricsMiddleware
+from . import async_views
+from .orders import place_order, MissingProductsError
+from .tasks import enqueue, run_pending, UnknownTaskError
+from .fake_smtp import FakeSMTPServer
+from .images import Image, ImageSourceError, fetch_source, process_source
+from .catalog_io import FIELDS as CATALOG_FIELDS, export_products, import_products, read_rows
+from .reports import ReportError, export_lines, revenue_report
+from .rollups import rebuild_rollup, refresh_rollup, rollup_report
+from .bulk import insert_rows
+from .order_status import HISTORY_FIELDS, InvalidTransitionError, bulk_advance, bulk_transition, transition
+from .template_warmup import warm_templates
 from .forms import UserRegistrationForm, LoginForm, OrderCreateForm
 from django.contrib.auth.hashers import check_password
+from django.contrib.sessions.models import Session
 
 User = get_user_model()
 
@@ -105,13 +160,13 @@ class ViewTests(TestCase):
         self.client.login(username='testuser', password='password123')
         response = self.client.post(reverse('add_to_cart', args=[self.product.pk]), {'quantity': 1})
         self.assertEqual(response.status_code, 302)  # Перенаправление на страницу корзины
-        self.assertIn(str(self.product.pk), self.client.session['cart'])
+        self.assertIn(self.product.pk, decode_cart(self.client.session['cart']))
 
     def test_remove_from_cart(self):
         self.client.login(username='testuser', password='password123')
         response = self.client.post(reverse('remove_from_cart',args=[self.product.pk]))
         self.assertEqual(response.status_code, 302)  # Перенаправление на страницу корзины
-        self.assertNotIn(str(self.product.pk), self.client.session['cart'])
+        self.assertNotIn(self.product.pk, decode_cart(self.client.session.get('cart')))
 
     def test_cart_view(self):
         self.client.login(username='testuser', password='password123')
@@ -138,6 +193,1533 @@ class ViewTests(TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertTemplateUsed(response, 'shop/order_success.html')
 
+class ProductListPaginationTests(TestCase):
+    def setUp(self):
+        self.products = [
+            Product.objects.create(name=f'Товар {i}', characteristics='', price=10 + i, quantity=1)
+            for i in range(5)
+        ]
+
+    def test_first_page(self):
+        response = self.client.get(reverse('product_list'), {'per_page': 2})
+        page = response.context['page']
+        self.assertEqual([p.pk for p in page], [p.pk for p in self.products[:2]])
+        self.assertTrue(page.has_next)
+        self.assertFalse(page.has_previous)
+        self.assertEqual(page.next_cursor, self.products[1].pk)
+
+    def test_next_and_prev_cursors(self):
+        response = self.client.get(reverse('product_list'), {'per_page': 2, 'after': self.products[1].pk})
+        page = response.context['page']
+        self.assertEqual([p.pk for p in page], [p.pk for p in self.products[2:4]])
+        response = self.client.get(reverse('product_list'), {'per_page': 2, 'before': page.prev_cursor})
+        self.assertEqual([p.pk for p in response.context['page']], [p.pk for p in self.products[:2]])
+        self.assertFalse(response.context['page'].has_previous)
+
+    def test_last_page(self):
+        response = self.client.get(reverse('product_list'), {'per_page': 2, 'after': self.products[3].pk})
+        page = response.context['page']
+        self.assertEqual([p.pk for p in page], [self.products[4].pk])
+        self.assertIsNone(page.next_cursor)
+
+    def test_invalid_cursor_is_ignored(self):
+        response = self.client.get(reverse('product_list'), {'after': 'abc', 'per_page': 1000})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['page']), 5)
+
+    def test_streaming_mode(self):
+        response = self.client.get(reverse('product_list'), {'stream': '1', 'per_page': 2})
+        self.assertTrue(response.streaming)
+        content = b''.join(response.streaming_content).decode()
+        for product in self.products:
+            self.assertIn(product.name, content)
+        self.assertNotIn('__product_cards__', content)
+
+class ProductListFilterTests(TestCase):
+    def setUp(self):
+        self.phone = Product.objects.create(name='Черный телефон', characteristics='', price=500, quantity=3)
+        self.laptop = Product.objects.create(name='Игровой ноутбук', characteristics='', price=60000, quantity=0)
+        self.case = Product.objects.create(name='Чехол для телефона', characteristics='', price=500, quantity=7)
+        self.watch = Product.objects.create(name='Часы', characteristics='', price=7000, quantity=1)
+
+    def get_ids(self, **params):
+        response = self.client.get(reverse('product_list'), params)
+        self.assertEqual(response.status_code, 200)
+        return [p.pk for p in response.context['page']]
+
+    def test_price_range_and_in_stock(self):
+        self.assertEqual(self.get_ids(min_price='1000'), [self.laptop.pk, self.watch.pk])
+        self.assertEqual(self.get_ids(min_price='500', max_price='7000'), [self.phone.pk, self.case.pk])
+        self.assertEqual(self.get_ids(min_price='1000', in_stock='1'), [self.watch.pk])
+        # Некорректные значения фильтров игнорируются
+        self.assertEqual(len(self.get_ids(min_price='abc', max_price='NaN')), 4)
+
+    def test_name_filter(self):
+        self.assertEqual(self.get_ids(q='телефоны'), [self.phone.pk, self.case.pk])
+        self.assertEqual(self.get_ids(q='игров'), [self.laptop.pk])
+
+    def test_sort_with_cursor(self):
+        self.assertEqual(self.get_ids(sort='-price'), [self.laptop.pk, self.watch.pk, self.case.pk, self.phone.pk])
+        # Товары с одинаковой ценой не теряются и не повторяются на границе страниц
+        response = self.client.get(reverse('product_list'), {'sort': 'price', 'per_page': 1})
+        seen = [p.pk for p in response.context['page']]
+        while response.context['page'].next_cursor:
+            response = self.client.get(reverse('product_list'), {
+                'sort': 'price', 'per_page': 1, 'after': response.context['page'].next_cursor})
+            seen += [p.pk for p in response.context['page']]
+        self.assertEqual(seen, [self.phone.pk, self.case.pk, self.watch.pk, self.laptop.pk])
+        response = self.client.get(reverse('product_list'), {
+            'sort': 'price', 'per_page': 2, 'before': response.context['page'].prev_cursor})
+        self.assertEqual([p.pk for p in response.context['page']], [self.case.pk, self.watch.pk])
+
+    def test_cursor_page_cache_key_is_memcached_safe(self):
+        response = self.client.get(reverse('product_list'), {'sort': 'price', 'per_page': 1})
+        with warnings.catch_warnings():
+            warnings.simplefilter('error', CacheKeyWarning)
+            response = self.client.get(reverse('product_list'), {
+                'sort': 'price', 'per_page': 1, 'after': response.context['page'].next_cursor})
+        self.assertEqual([p.pk for p in response.context['page']], [self.case.pk])
+
+    def test_links_keep_filters(self):
+        response = self.client.get(reverse('product_list'), {'in_stock': '1', 'sort': 'name', 'per_page': 1})
+        self.assertContains(response, '?in_stock=1&amp;sort=name&amp;per_page=1&amp;after=')
+
+    def test_tampered_sort_cursor_is_ignored(self):
+        self.assertEqual(len(self.get_ids(sort='price', after='WyJ4IiwgMV0')), 4)
+
+
+class CatalogFacetTests(TestCase):
+    def setUp(self):
+        self.cheap = Product.objects.create(name='Кабель', characteristics='', price=100, quantity=2)
+        self.expensive = Product.objects.create(name='Телевизор', characteristics='', price=70000, quantity=1)
+
+    def assertFacetsMatchRebuild(self):
+        facets = {key: count for key, count in get_facets().items() if count}
+        self.assertEqual(facets, {key: count for key, count in rebuild_facets().items() if count})
+
+    def test_counts_follow_saves_and_deletes(self):
+        facets = get_facets()
+        self.assertEqual((facets['total'], facets['in_stock'], facets['price:0-1000']), (2, 2, 1))
+        self.cheap.price = 2000
+        self.cheap.quantity = 0
+        self.cheap.save()
+        facets = get_facets()
+        self.assertEqual((facets['price:0-1000'], facets['price:1000-5000'], facets['in_stock']), (0, 1, 1))
+        self.expensive.delete()
+        self.assertEqual(get_facets()['total'], 1)
+        self.assertFacetsMatchRebuild()
+
+    def test_counts_follow_stock_updates(self):
+        decrement_stock({self.cheap.pk: 2, self.expensive.pk: 1})
+        facets = get_facets()
+        self.assertEqual((facets['in_stock'], facets['in_stock:price:50000-']), (0, 0))
+        increment_stock({self.expensive.pk: 1})
+        self.assertEqual(get_facets()['in_stock:price:50000-'], 1)
+        self.assertFacetsMatchRebuild()
+
+    def test_listing_shows_counts(self):
+        response = self.client.get(reverse('product_list'), {'in_stock': '1'})
+        self.assertEqual(response.context['facets']['total'], 2)
+        self.assertContains(response, 'от 50000 руб. (1)')
+
+    def test_rebuild_command(self):
+        CatalogFacet.objects.all().delete()
+        call_command('rebuild_catalog_facets', stdout=StringIO())
+        self.assertEqual(get_facets()['total'], 2)
+
+class CartHydrationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='buyer', email='buyer@example.com', password='password123')
+        self.products = [
+            Product.objects.create(name=f'Товар {i}', characteristics='', price=10, quantity=5)
+            for i in range(3)
+        ]
+        self.client.login(username='buyer', password='password123')
+
+    def set_cart(self, cart):
+        session = self.client.session
+        session['cart'] = cart
+        session.save()
+
+    def test_cart_view_totals(self):
+        self.set_cart({str(p.pk): 2 for p in self.products})
+        response = self.client.get(reverse('cart'))
+        self.assertEqual(len(response.context['products']), 3)
+        self.assertEqual(response.context['total_price'], 60)
+
+    def test_hydrate_cart_single_query(self):
+        cart = {str(p.pk): 1 for p in self.products}
+        with self.assertNumQueries(1):
+            contents = hydrate_cart(cart)
+        self.assertEqual(contents.total_price, 30)
+        self.assertEqual(len(contents), 3)
+
+    def test_stale_ids_are_dropped(self):
+        self.set_cart({str(self.products[0].pk): 1, '999999': 3})
+        response = self.client.get(reverse('cart'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['total_price'], 10)
+        self.assertNotIn(999999, decode_cart(self.client.session['cart']))
+
+    @override_settings(CART_SESSION_ID='cart_v1')
+    def test_cart_class_uses_hydration(self):
+        request = RequestFactory().get('/')
+        request.session = self.client.session
+        cart = Cart(request)
+        cart.add_to_cart(self.products[0], quantity=2)
+        cart.add_to_cart(self.products[1])
+        cart.lines[999999] = 1
+        self.assertEqual(cart.get_total_price(), 30)
+        self.assertNotIn(999999, cart.lines)
+        self.assertEqual(len(cart), 3)
+        self.assertEqual(request.session['cart_v1'], encode_cart({self.products[0].pk: 2, self.products[1].pk: 1}))
+
+class CartStorageTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='buyer', email='buyer@example.com', password='password123')
+        self.product = Product.objects.create(name='Товар', characteristics='', price=10, quantity=5)
+
+    def make_request(self):
+        self.client.force_login(self.user)
+        request = RequestFactory().get('/')
+        request.user = self.user
+        request.session = self.client.session
+        return request
+
+    def test_encoding(self):
+        self.assertEqual(encode_cart({12: 2, 5: 1}), '1|12:2,5:1')
+        self.assertEqual(decode_cart('1|12:2,5:1'), {12: 2, 5: 1})
+        self.assertEqual(decode_cart('1|12:2,x:1,7:0'), {12: 2})
+        # Старые корзины из сессии тоже читаются, неизвестные версии - нет
+        self.assertEqual(decode_cart({'12': 2, '5': {'quantity': 1, 'price': '10.00'}}), {12: 2, 5: 1})
+        self.assertEqual(decode_cart('2|12:2'), {})
+
+    @override_settings(CART_MAX_LINES=2)
+    def test_max_lines(self):
+        cart = Cart(self.make_request())
+        cart.add(1)
+        cart.add(2)
+        cart.add(2)
+        with self.assertRaises(CartLimitError):
+            cart.add(3)
+        self.assertEqual(decode_cart('1|1:1,2:1,3:1'), {1: 1, 2: 1})
+
+    def test_session_written_only_on_change(self):
+        request = self.make_request()
+        cart = Cart(request)
+        cart.add(self.product.pk, 2)
+        request.session.save()
+        request.session.modified = False
+        cart = Cart(request)
+        cart.add(self.product.pk, 2, update_quantity=True)
+        cart.get_contents()
+        self.assertFalse(request.session.modified)
+
+    @override_settings(CART_STORAGE='db')
+    def test_database_storage(self):
+        request = self.make_request()
+        Cart(request).add(self.product.pk, 3)
+        self.assertNotIn('cart', request.session)
+        self.assertEqual(decode_cart(StoredCart.objects.get(user=self.user).data), {self.product.pk: 3})
+        with CaptureQueriesContext(connection) as queries:
+            Cart(request).add(self.product.pk, 3, update_quantity=True)
+        self.assertEqual(len(queries), 1)
+        response = self.client.post(reverse('create_order'), {
+            'full_name': 'Иван Иванов', 'email': 'ivan@example.com', 'address': 'Ленина, 1',
+            'postal_code': '123456', 'city': 'Москва'})
+        self.assertEqual(response.context['order'].item_count, 3)
+        self.assertFalse(StoredCart.objects.exists())
+
+    @override_settings(CART_STORAGE='cache')
+    def test_cache_storage(self):
+        request = self.make_request()
+        Cart(request).add(self.product.pk, 2)
+        self.assertNotIn('cart', request.session)
+        self.assertEqual(Cart(request).lines, {self.product.pk: 2})
+
+class PlaceOrderTests(TestCase):
+    def setUp(self):
+        self.products = [
+            Product.objects.create(name=f'Товар {i}', characteristics='', price=10 + i, quantity=5)
+            for i in range(10)
+        ]
+        self.form_data = {
+            'full_name': 'Иван Иванов',
+            'email': 'ivan@example.com',
+            'address': 'Ленина, 1',
+            'postal_code': '123456',
+            'city': 'Москва'
+        }
+
+    def place(self, cart):
+        form = OrderCreateForm(data=self.form_data)
+        self.assertTrue(form.is_valid())
+        return place_order(form, cart)
+
+    def test_query_count_does_not_depend_on_cart_size(self):
+        small = {str(self.products[0].pk): 1}
+        large = {str(p.pk): 2 for p in self.products}
+        with CaptureQueriesContext(connection) as small_queries:
+            self.place(small)
+        with CaptureQueriesContext(connection) as large_queries:
+            order = self.place(large)
+        self.assertEqual(len(small_queries), len(large_queries))
+        self.assertEqual(order.items.count(), 10)
+        self.assertEqual(order.get_total_cost(), sum((p.price * 2 for p in self.products)))
+
+    def test_missing_product_leaves_no_rows(self):
+        cart = {str(self.products[0].pk): 1, '999999': 1}
+        with self.assertRaises(MissingProductsError) as cm:
+            self.place(cart)
+        self.assertEqual(cm.exception.product_ids, ['999999'])
+        self.assertFalse(Order.objects.exists())
+        self.assertFalse(OrderItem.objects.exists())
+
+    def test_failed_items_roll_back_order(self):
+        cart = {str(self.products[0].pk): 1}
+        with mock.patch.object(OrderItem.objects, 'bulk_create', side_effect=DatabaseError):
+            with self.assertRaises(DatabaseError):
+                self.place(cart)
+        self.assertFalse(Order.objects.exists())
+
+    def test_order_number_taken_before_checkout_transaction(self):
+        with CaptureQueriesContext(connection) as queries:
+            order = self.place({str(self.products[0].pk): 1})
+        sql = [q['sql'] for q in queries]
+        counter = next(i for i, q in enumerate(sql) if q.startswith('UPDATE "shop_sequence"'))
+        # Транзакция счетчика завершена до того, как оформление читает товары
+        released = next(i for i, q in enumerate(sql) if i > counter and q.startswith('RELEASE SAVEPOINT'))
+        products = next(i for i, q in enumerate(sql) if '"shop_product"' in q)
+        self.assertLess(released, products)
+        self.assertEqual(order.order_number, '000001')
+
+    def test_create_order_view_clears_cart(self):
+        User.objects.create_user(username='buyer', email='buyer@example.com', password='password123')
+        self.client.login(username='buyer', password='password123')
+        session = self.client.session
+        session['cart'] = {str(self.products[0].pk): 3}
+        session.save()
+        response = self.client.post(reverse('create_order'), self.form_data)
+        self.assertTemplateUsed(response, 'shop/order_success.html')
+        self.assertEqual(response.context['order'].items.get().quantity, 3)
+        self.assertNotIn('cart', self.client.session)
+
+class OrderNumberConcurrencyTests(TransactionTestCase):
+    """Параллельно создаем много заказов и проверяем, что номера не совпадают"""
+    threads = 8
+    orders_per_thread = 250
+
+    def create_orders(self, errors):
+        try:
+            for i in range(self.orders_per_thread):
+                Order.objects.create(full_name='Иван Иванов', email='ivan@example.com', address='Ленина, 1',
+                                     postal_code='123456', city='Москва')
+        except Exception as e:
+            errors.append(e)
+        finally:
+            connection.close()
+
+    def test_concurrent_orders_get_unique_numbers(self):
+        errors = []
+        workers = [threading.Thread(target=self.create_orders, args=(errors,)) for _ in range(self.threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self.assertEqual(errors, [])
+        numbers = list(Order.objects.values_list('order_number', flat=True))
+        self.assertEqual(len(numbers), self.threads * self.orders_per_thread)
+        self.assertEqual(len(set(numbers)), len(numbers))
+
+    def test_sequence_continues_after_existing_orders(self):
+        Sequence.objects.update_or_create(name=ORDER_NUMBER_SEQUENCE, defaults={'value': 41})
+        order = Order.objects.create(email='ivan@example.com')
+        self.assertEqual(order.order_number, '000042')
+
+    def test_order_number_past_six_digits(self):
+        Sequence.objects.update_or_create(name=ORDER_NUMBER_SEQUENCE, defaults={'value': 999998})
+        self.assertEqual(Order.objects.create(email='ivan@example.com').order_number, '999999')
+        order = Order.objects.create(email='ivan@example.com')
+        order.refresh_from_db()
+        self.assertEqual(order.order_number, '1000000')
+        # Номер, не помещающийся в поле, - ошибка, а не обрезанный номер
+        Sequence.objects.filter(name=ORDER_NUMBER_SEQUENCE).update(value=10 ** 12 - 1)
+        with self.assertRaises(SequenceOverflowError):
+            Order.objects.create(email='ivan@example.com')
+
+class StockReservationTests(TestCase):
+    def setUp(self):
+        self.first = Product.objects.create(name='Первый', characteristics='', price=10, quantity=5)
+        self.second = Product.objects.create(name='Второй', characteristics='', price=20, quantity=1)
+
+    def quantities(self):
+        return list(Product.objects.order_by('pk').values_list('quantity', flat=True))
+
+    def test_decrement_whole_basket_in_one_update(self):
+        with CaptureQueriesContext(connection) as queries:
+            decrement_stock({self.first.pk: 2, self.second.pk: 1})
+        updates = [q for q in queries if q['sql'].startswith('UPDATE "shop_product"')]
+        self.assertEqual(len(updates), 1)
+        self.assertEqual(self.quantities(), [3, 0])
+
+    def test_insufficient_stock_changes_nothing(self):
+        with self.assertRaises(OutOfStockError) as cm:
+            decrement_stock({self.first.pk: 2, self.second.pk: 2})
+        self.assertEqual(cm.exception.product_ids, [self.second.pk])
+        self.assertEqual(self.quantities(), [5, 1])
+
+    def test_reservation_expires_and_returns_stock(self):
+        reserve_stock('session-1', {self.first.pk: 3}, ttl=60)
+        self.assertEqual(self.quantities(), [2, 1])
+        self.assertEqual(release_expired(), 0)
+        self.assertEqual(release_expired(now=timezone.now() + timedelta(seconds=61)), 1)
+        self.assertEqual(self.quantities(), [5, 1])
+        self.assertFalse(StockReservation.objects.exists())
+
+    def test_release_command(self):
+        reserve_stock('session-1', {self.first.pk: 3}, ttl=0)
+        out = StringIO()
+        call_command('release_stock_reservations', stdout=out)
+        self.assertIn('1', out.getvalue())
+        self.assertEqual(self.quantities(), [5, 1])
+
+    def test_reserve_again_replaces_previous_reservation(self):
+        reserve_stock('session-1', {self.first.pk: 3})
+        reserve_stock('session-1', {self.first.pk: 4})
+        self.assertEqual(self.quantities(), [1, 1])
+
+    def test_reserve_same_cart_only_extends(self):
+        self.assertTrue(reserve_stock('session-1', {self.first.pk: 3}, ttl=60))
+        with CaptureQueriesContext(connection) as queries:
+            self.assertFalse(reserve_stock('session-1', {self.first.pk: 3}, ttl=600))
+        self.assertFalse([q for q in queries if 'shop_product' in q['sql']])
+        self.assertEqual(self.quantities(), [2, 1])
+        self.assertEqual(release_expired(now=timezone.now() + timedelta(seconds=61)), 0)
+
+    def test_form_refresh_and_relogin_keep_one_reservation(self):
+        user = User.objects.create_user(username='buyer', email='buyer@example.com', password='password123')
+        self.client.login(username='buyer', password='password123')
+        session = self.client.session
+        session['cart'] = {str(self.first.pk): 2}
+        session.save()
+        self.client.get(reverse('create_order'))
+        self.client.get(reverse('create_order'))
+        # Повторный вход меняет ключ сессии, но резерв привязан к пользователю
+        self.client.login(username='buyer', password='password123')
+        self.client.get(reverse('create_order'))
+        self.assertEqual(self.quantities(), [3, 1])
+        self.assertEqual(list(StockReservation.objects.values_list('key', flat=True)), [reservation_key(user)])
+
+    def test_order_consumes_reservation(self):
+        User.objects.create_user(username='buyer', email='buyer@example.com', password='password123')
+        self.client.login(username='buyer', password='password123')
+        session = self.client.session
+        session['cart'] = {str(self.first.pk): 2}
+        session.save()
+        self.client.get(reverse('create_order'))
+        self.assertEqual(self.quantities(), [3, 1])
+        self.client.post(reverse('create_order'), {
+            'full_name': 'Иван Иванов',
+            'email': 'ivan@example.com',
+            'address': 'Ленина, 1',
+            'postal_code': '123456',
+            'city': 'Москва'
+        })
+        self.assertEqual(self.quantities(), [3, 1])
+        self.assertFalse(StockReservation.objects.exists())
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_order_with_insufficient_stock_redirects_to_cart(self):
+        User.objects.create_user(username='buyer', email='buyer@example.com', password='password123')
+        self.client.login(username='buyer', password='password123')
+        session = self.client.session
+        session['cart'] = {str(self.second.pk): 2}
+        session.save()
+        response = self.client.post(reverse('create_order'), {
+            'full_name': 'Иван Иванов',
+            'email': 'ivan@example.com',
+            'address': 'Ленина, 1',
+            'postal_code': '123456',
+            'city': 'Москва'
+        })
+        self.assertRedirects(response, reverse('cart'))
+        self.assertFalse(Order.objects.exists())
+
+class OrderTotalsTests(TestCase):
+    def setUp(self):
+        self.product = Product.objects.create(name='Товар', characteristics='', price=100, quantity=10)
+        self.order = Order.objects.create(email='ivan@example.com')
+
+    def test_totals_follow_item_changes(self):
+        item = OrderItem.objects.create(order=self.order, product=self.product, quantity=2, price=100)
+        OrderItem.objects.create(order=self.order, product=self.product, quantity=1, price=50)
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.get_total_cost(), 250)
+        self.assertEqual(self.order.item_count, 3)
+
+        item.quantity = 3
+        item.save()
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.total, 350)
+
+        item.delete()
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.total, 50)
+        self.assertEqual(self.order.item_count, 1)
+
+    def test_get_total_cost_does_not_query(self):
+        with self.assertNumQueries(0):
+            self.order.get_total_cost()
+
+    def test_recompute_command(self):
+        OrderItem.objects.bulk_create([
+            OrderItem(order=self.order, product=self.product, quantity=2, price=100),
+            OrderItem(order=self.order, product=self.product, quantity=1, price=30),
+        ])
+        empty = Order.objects.create(email='petr@example.com', total=999)
+        call_command('recompute_order_totals', batch_size=1, stdout=StringIO())
+        self.order.refresh_from_db()
+        empty.refresh_from_db()
+        self.assertEqual(self.order.total, 230)
+        self.assertEqual(self.order.item_count, 3)
+        self.assertEqual(empty.total, 0)
+
+class ProductSearchTests(TestCase):
+    def setUp(self):
+        self.phone = Product.objects.create(name='Смартфон чёрный', characteristics='Беспроводная зарядка',
+                                            price=100, quantity=1)
+        self.cover = Product.objects.create(name='Чехол', characteristics='Подходит для смартфонов',
+                                            price=10, quantity=1)
+        self.kettle = Product.objects.create(name='Чайник', characteristics='Электрический', price=20, quantity=1)
+
+    def test_stemmer(self):
+        self.assertEqual(stem('смартфонов'), stem('смартфон'))
+        self.assertEqual(stem('Зелёная'), stem('зеленый'))
+        self.assertEqual(stem('iPhone'), 'iphone')
+
+    def test_inflected_forms_and_ranking(self):
+        # Совпадение в названии важнее совпадения в описании
+        self.assertEqual(search_products('смартфоны'), [self.phone, self.cover])
+
+    @override_settings(SEARCH_CANDIDATES_LIMIT=3)
+    def test_best_match_beyond_first_candidates(self):
+        # Ранние товары со словом только в описании не вытесняют новый товар со словом в названии
+        for i in range(5):
+            Product.objects.create(name=f'Лампа {i}', characteristics='Подходит к чайнику', price=5, quantity=1)
+        teapot = Product.objects.create(name='Чайник заварочный', characteristics='', price=7, quantity=1)
+        self.assertEqual(search_products('чайник', limit=2), [self.kettle, teapot])
+
+    def test_prefix_and_yo(self):
+        self.assertEqual(search_products('черн'), [self.phone])
+        self.assertEqual(search_products('беспроводной заряд'), [self.phone])
+        self.assertEqual(search_products('чайн'), [self.kettle])
+
+    def test_index_follows_save_and_delete(self):
+        self.kettle.name = 'Кофеварка'
+        self.kettle.save()
+        self.assertEqual(search_products('чайник'), [])
+        self.assertEqual(search_products('кофеварка'), [self.kettle])
+        self.kettle.delete()
+        self.assertEqual(search_products('кофеварка'), [])
+
+    def test_rebuild_index(self):
+        Product.objects.bulk_create([Product(name='Утюг', characteristics='', price=5, quantity=1)])
+        self.assertEqual(search_products('утюг'), [])
+        call_command('rebuild_search_index', stdout=StringIO())
+        self.assertEqual(len(search_products('утюг')), 1)
+        self.assertEqual(search_products('смартфон'), [self.phone, self.cover])
+
+    def test_search_page(self):
+        response = self.client.get(reverse('search'), {'q': 'чайник'})
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, 'shop/search.html')
+        self.assertEqual(response.context['products'], [self.kettle])
+
+class PageCacheTests(TestCase):
+    def setUp(self):
+        get_cache().clear()
+        reset_stats()
+        self.product = Product.objects.create(name='Чайник', characteristics='', price=20, quantity=3)
+
+    def test_product_detail_is_cached(self):
+        url = reverse('product_detail', args=[self.product.pk])
+        self.assertEqual(self.client.get(url)['X-Cache'], 'MISS')
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+        self.assertEqual(response['X-Cache'], 'HIT')
+        self.assertContains(response, 'Чайник')
+        self.assertEqual(cache_stats()['hits'], 1)
+        self.assertEqual(cache_stats()['misses'], 1)
+
+    def test_csrf_token_is_filled_per_request(self):
+        # Форма покупки с токеном есть только у вошедших
+        self.client.force_login(User.objects.create_user(username='buyer', password='password'))
+        url = reverse('product_detail', args=[self.product.pk])
+        self.client.get(url)
+        response = self.client.get(url)
+        self.assertNotContains(response, CSRF_MARKER)
+        self.assertContains(response, 'csrfmiddlewaretoken')
+
+    def test_invalidation_reaches_other_processes(self):
+        # Другой процесс открывает тот же кэш страниц своим экземпляром бэкенда
+        params = settings.CACHES[settings.PAGE_CACHE_ALIAS]
+        self.assertNotIn('locmem', params['BACKEND'])
+        other = LRUFileBasedCache(params['LOCATION'], {})
+        url = reverse('product_detail', args=[self.product.pk])
+        with mock.patch('shop.page_cache.get_cache', return_value=other):
+            self.assertEqual(self.client.get(url)['X-Cache'], 'MISS')
+        self.product.price = 25
+        self.product.save()
+        with mock.patch('shop.page_cache.get_cache', return_value=other):
+            response = self.client.get(url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertContains(response, 'Цена: 25')
+
+    def test_save_invalidates_product_and_list(self):
+        detail_url = reverse('product_detail', args=[self.product.pk])
+        self.client.get(detail_url)
+        self.client.get(reverse('product_list'))
+        self.product.price = 25
+        self.product.save()
+        response = self.client.get(detail_url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertContains(response, '25')
+        self.assertEqual(self.client.get(reverse('product_list'))['X-Cache'], 'MISS')
+
+    def test_other_products_stay_cached(self):
+        detail_url = reverse('product_detail', args=[self.product.pk])
+        self.client.get(detail_url)
+        Product.objects.create(name='Утюг', characteristics='', price=5, quantity=1)
+        self.assertEqual(self.client.get(detail_url)['X-Cache'], 'HIT')
+
+    def test_stock_change_invalidates(self):
+        detail_url = reverse('product_detail', args=[self.product.pk])
+        self.client.get(detail_url)
+        decrement_stock({self.product.pk: 2})
+        self.assertContains(self.client.get(detail_url), 'Количество: 1 шт.')
+
+    def test_stock_change_keeps_lists_until_availability_changes(self):
+        list_url = reverse('product_list')
+        self.client.get(list_url)
+        version = get_cache().get(CATALOG_VERSION_KEY)
+        with self.captureOnCommitCallbacks(execute=True):
+            decrement_stock({self.product.pk: 2})
+        # Остаток изменился, но товар в наличии: списки и чтение с реплики не сбрасываются
+        self.assertEqual(get_cache().get(CATALOG_VERSION_KEY), version)
+        self.assertEqual(self.client.get(list_url)['X-Cache'], 'HIT')
+        with self.captureOnCommitCallbacks(execute=True):
+            decrement_stock({self.product.pk: 1})
+        self.assertEqual(self.client.get(list_url)['X-Cache'], 'MISS')
+
+    def test_auth_state_is_part_of_key(self):
+        self.client.get(reverse('product_list'))
+        User.objects.create_user(username='buyer', email='buyer@example.com', password='password123')
+        self.client.login(username='buyer', password='password123')
+        response = self.client.get(reverse('product_list'))
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertContains(response, 'Личный кабинет')
+
+    def test_stats_endpoint_requires_staff(self):
+        response = self.client.get(reverse('cache_stats'))
+        self.assertEqual(response.status_code, 302)
+        User.objects.create_user(username='admin', email='admin@example.com', password='password123',
+                                 is_staff=True)
+        self.client.login(username='admin', password='password123')
+        self.assertEqual(self.client.get(reverse('cache_stats')).json()['misses'], 0)
+
+
+class LRUFileBasedCacheTests(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.cache = LRUFileBasedCache(self.dir, {'OPTIONS': {'MAX_ENTRIES': 3, 'CULL_FREQUENCY': 3}})
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_least_recently_used_entry_is_evicted(self):
+        for i, key in enumerate(['a', 'b', 'c']):
+            self.cache.set(key, key)
+            os.utime(self.cache._key_to_file(key), (1000 + i, 1000 + i))
+        self.assertEqual(self.cache.get('a'), 'a')
+        self.cache.set('d', 'd')
+        self.assertIsNone(self.cache.get('b'))
+        self.assertEqual(self.cache.get('a'), 'a')
+        self.assertEqual(self.cache.get('d'), 'd')
+
+class StorefrontBenchmarkTests(TestCase):
+    def test_seed_and_client_run(self):
+        customers = seed(products=30, users=2, cart_items=3)
+        self.assertEqual(len(customers), 2)
+        self.assertEqual(len(customers[0][1]), 3)
+        results = run_client(customers, ['index', 'cart_view', 'create_order'], requests=5)
+        for name in ('index', 'cart_view', 'create_order'):
+            self.assertEqual(results[name]['errors'], 0)
+            self.assertIn('p95', results[name])
+            self.assertIn('memory_kib', results[name])
+        self.assertEqual(Order.objects.count(), 5)
+
+    def test_regressions(self):
+        baseline = {'client': {'index': {'p95': 10.0, 'queries': 2, 'errors': 0}}}
+        self.assertEqual(find_regressions(baseline, {'client': {'index': {'p95': 12.0, 'queries': 2, 'errors': 0}}},
+                                          tolerance=0.25), [])
+        regressions = find_regressions(baseline, {'client': {'index': {'p95': 13.0, 'queries': 3, 'errors': 0}}},
+                                       tolerance=0.25)
+        self.assertEqual(len(regressions), 2)
+
+class RequestMetricsTests(TestCase):
+    def setUp(self):
+        reset_request_stats()
+        Product.objects.create(name='Товар', characteristics='', price=10, quantity=1)
+
+    def test_server_timing_and_stats(self):
+        response = self.client.get(reverse('product_list'))
+        self.assertIn('db;dur=', response['Server-Timing'])
+        self.assertIn('tpl;dur=', response['Server-Timing'])
+        stats = request_stats()['product_list']
+        self.assertEqual(stats['requests'], 1)
+        self.assertGreater(stats['queries_avg'], 0)
+        self.assertGreater(stats['template_ms_avg'], 0)
+        self.assertEqual(sum(stats['latency_histogram'].values()), 1)
+
+    @override_settings(REQUEST_METRICS_SAMPLE_RATE=0)
+    def test_sampling(self):
+        response = self.client.get(reverse('product_list'))
+        self.assertFalse(response.has_header('Server-Timing'))
+        self.assertEqual(request_stats(), {})
+
+    @override_settings(REQUEST_METRICS_N_PLUS_ONE_THRESHOLD=3)
+    def test_n_plus_one_is_flagged(self):
+        def view(request):
+            for pk in range(5):
+                Product.objects.filter(pk=pk).exists()
+            return HttpResponse()
+
+        with self.assertLogs('shop.middleware', level='WARNING'):
+            RequestMetricsMiddleware(view)(RequestFactory().get('/'))
+        stats = request_stats()['unresolved']
+        self.assertEqual(stats['n_plus_one'], 1)
+        self.assertEqual(stats['n_plus_one_examples'][0]['count'], 5)
+
+    def test_streaming_recorded_after_body(self):
+        response = self.client.get(reverse('product_list'), {'stream': '1'})
+        self.assertFalse(response.has_header('Server-Timing'))
+        self.assertEqual(request_stats(), {})
+        b''.join(response.streaming_content)
+        stats = request_stats()['product_list']
+        self.assertEqual(stats['requests'], 1)
+        # Запросы за товарами выполняются при отдаче тела и тоже засчитаны
+        self.assertGreater(stats['queries_avg'], 0)
+        self.assertGreater(stats['template_ms_avg'], 0)
+
+    def test_template_render_not_patched(self):
+        self.assertEqual(Template.render.__module__, 'django.template.base')
+
+    def test_stats_endpoint_is_staff_only(self):
+        self.assertEqual(self.client.get(reverse('request_metrics')).status_code, 302)
+        staff = User.objects.create_user(username='staff', email='staff@example.com', password='password123',
+                                         is_staff=True)
+        self.client.force_login(staff)
+        response = self.client.get(reverse('request_metrics'))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('request_metrics', response.json())
+
+class SessionCleanupTests(TestCase):
+    def test_expired_sessions_deleted_in_batches(self):
+        now = timezone.now()
+        for i in range(5):
+            Session.objects.create(session_key=f'expired{i}', session_data='', expire_date=now - timedelta(days=1))
+        Session.objects.create(session_key='active', session_data='', expire_date=now + timedelta(days=1))
+        with CaptureQueriesContext(connection) as queries:
+            deleted = clear_expired_sessions(batch_size=2, now=now)
+        self.assertEqual(deleted, 5)
+        self.assertEqual(list(Session.objects.values_list('session_key', flat=True)), ['active'])
+        self.assertEqual(len([q for q in queries if q['sql'].startswith('DELETE')]), 3)
+
+    def test_command(self):
+        Session.objects.create(session_key='expired', session_data='', expire_date=timezone.now() - timedelta(days=1))
+        out = StringIO()
+        call_command('clear_expired_sessions', batch_size=10, pause=0, stdout=out)
+        self.assertIn('1', out.getvalue())
+        self.assertFalse(Session.objects.exists())
+
+    def test_sessions_are_cached(self):
+        user = User.objects.create_user(username='buyer', email='buyer@example.com', password='password123')
+        self.client.force_login(user)
+        self.client.get(reverse('cart'))
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('cart'))
+        self.assertFalse([q for q in queries if 'django_session' in q['sql']])
+
+    def test_logout_reaches_other_processes(self):
+        # Другой процесс открывает тот же кэш сессий своим экземпляром бэкенда
+        params = settings.CACHES[settings.SESSION_CACHE_ALIAS]
+        self.assertNotIn('locmem', params['BACKEND'])
+        other = FileBasedCache(params['LOCATION'], {})
+        user = User.objects.create_user(username='buyer', email='buyer@example.com', password='password123')
+        self.client.force_login(user)
+        cache_key = SessionStore(self.client.session.session_key).cache_key
+        self.assertIsNotNone(other.get(cache_key))
+        self.client.post(reverse('logout'))
+        self.assertIsNone(other.get(cache_key))
+
+class DatabaseProfileTests(TestCase):
+    def test_sqlite_profile_pragmas(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('Профиль SQLite')
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode')
+            self.assertEqual(cursor.fetchone()[0], 'wal')
+            cursor.execute('PRAGMA synchronous')
+            self.assertEqual(cursor.fetchone()[0], 1)
+            cursor.execute('PRAGMA busy_timeout')
+            self.assertGreater(cursor.fetchone()[0], 0)
+        self.assertEqual(connection.transaction_mode, 'IMMEDIATE')
+
+class ReplicaRoutingTests(TransactionTestCase):
+    """Реплика - второй файл SQLite, данные в нее копируются из основной базы через sync_replica"""
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('Локальная реплика - файл SQLite')
+        for cache in caches.all():
+            cache.clear()
+        self.product = Product.objects.create(name='Телефон', characteristics='', price=100, quantity=5)
+        self.sync_replica()
+        # Меняем товар только в основной базе, как будто реплика отстала
+        Product.objects.filter(pk=self.product.pk).update(name='Телефон (обновлен)')
+
+    def sync_replica(self):
+        replica = connections['replica']
+        replica.close()
+        connection.ensure_connection()
+        target = sqlite3.connect(replica.settings_dict['NAME'])
+        try:
+            connection.connection.backup(target)
+        finally:
+            target.close()
+
+    @override_settings(REPLICA_DATABASE='replica', REPLICA_MAX_LAG=0)
+    def test_catalog_reads_go_to_replica(self):
+        response = self.client.get(reverse('product_detail', args=[self.product.pk]))
+        self.assertContains(response, 'Телефон')
+        self.assertNotContains(response, 'обновлен')
+        response = self.client.get(reverse('product_list'))
+        self.assertNotContains(response, 'обновлен')
+
+    @override_settings(REPLICA_DATABASE='replica', REPLICA_MAX_LAG=60)
+    def test_recent_catalog_change_reads_primary(self):
+        response = self.client.get(reverse('product_detail', args=[self.product.pk]))
+        self.assertContains(response, 'обновлен')
+
+    @override_settings(REPLICA_DATABASE='replica', REPLICA_MAX_LAG=60)
+    def test_catalog_change_in_other_process_reads_primary(self):
+        # Здесь каталог давно не менялся, а другой процесс только что изменил его
+        # и записал версию в общий кэш своим экземпляром бэкенда
+        get_cache().set(CATALOG_VERSION_KEY, 0, None)
+        params = settings.CACHES[settings.PAGE_CACHE_ALIAS]
+        LRUFileBasedCache(params['LOCATION'], {}).set(CATALOG_VERSION_KEY, time.time_ns(), None)
+        response = self.client.get(reverse('product_detail', args=[self.product.pk]))
+        self.assertContains(response, 'обновлен')
+
+    @override_settings(REPLICA_DATABASE=None)
+    def test_disabled_replica(self):
+        response = self.client.get(reverse('product_detail', args=[self.product.pk]))
+        self.assertContains(response, 'обновлен')
+
+    @override_settings(REPLICA_DATABASE='replica', REPLICA_MAX_LAG=0)
+    def test_read_your_writes_after_checkout(self):
+        user = User.objects.create_user(username='buyer', email='buyer@example.com', password='password123')
+        self.client.force_login(user)
+        self.client.post(reverse('add_to_cart', args=[self.product.pk]), {'quantity': 2})
+        with override_settings(REPLICA_MAX_LAG=60):
+            response = self.client.post(reverse('create_order'), {
+                'full_name': 'Иван Иванов', 'email': 'ivan@example.com', 'address': 'Ленина, 1',
+                'postal_code': '123456', 'city': 'Москва'})
+        self.assertTemplateUsed(response, 'shop/order_success.html')
+        for cache in caches.all():
+            cache.clear()
+        response = self.client.get(reverse('product_detail', args=[self.product.pk]))
+        # Остаток после заказа виден сразу, хотя реплика не обновлялась
+        self.assertContains(response, 'обновлен')
+        # Заказ записан в основную базу
+        self.assertEqual(Order.objects.using('default').count(), 1)
+
+class AsyncUrls:
+    """URL-схема как при ASYNC_VIEWS=1: каталог и корзина - асинхронные представления"""
+    urlpatterns = [
+        path('product_list', async_views.product_list, name='product_list'),
+        path('product/<int:pk>/', async_views.product_detail, name='product_detail'),
+        path('add_to_cart/<int:product_id>/', async_views.add_to_cart, name='add_to_cart'),
+        path('cart', async_views.cart_view, name='cart'),
+        path('', include('main.urls')),
+    ]
+
+
+@override_settings(ROOT_URLCONF=AsyncUrls)
+class AsyncViewTests(TestCase):
+    def setUp(self):
+        for cache in caches.all():
+            cache.clear()
+        self.user = User.objects.create_user(username='buyer', email='buyer@example.com', password='password123')
+        self.products = [
+            Product.objects.create(name=f'Товар {i}', characteristics='', price=10 + i, quantity=5)
+            for i in range(3)
+        ]
+
+    async def test_product_list(self):
+        response = await self.async_client.get(reverse('product_list'), {'per_page': 2, 'sort': '-price'})
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Товар 2')
+        self.assertNotContains(response, 'Товар 0')
+        response = await self.async_client.get(reverse('product_list'), {'stream': '1'})
+        content = b''.join([chunk async for chunk in response.streaming_content]).decode()
+        self.assertIn('Товар 0', content)
+
+    async def test_product_detail(self):
+        response = await self.async_client.get(reverse('product_detail', args=[self.products[0].pk]))
+        self.assertContains(response, 'Товар 0')
+        response = await self.async_client.get(reverse('product_detail', args=[999999]))
+        self.assertEqual(response.status_code, 404)
+
+    async def test_page_cache_used_off_event_loop(self):
+        cache, threads = get_cache(), []
+
+        def on_loop():
+            try:
+                asyncio.get_running_loop()
+            except RuntimeError:
+                return False
+            return True
+
+        def spy(method):
+            def wrapper(*args, **kwargs):
+                threads.append(on_loop())
+                return method(*args, **kwargs)
+            return wrapper
+
+        with mock.patch.object(cache, 'get', spy(cache.get)), mock.patch.object(cache, 'set', spy(cache.set)):
+            await self.async_client.get(reverse('product_detail', args=[self.products[0].pk]))
+            await self.async_client.get(reverse('product_list'))
+        self.assertTrue(threads)
+        self.assertNotIn(True, threads)
+
+    async def test_queries_counted_in_server_timing(self):
+        # Асинхронный ORM выполняет запросы в потоке sync_to_async с его собственным соединением
+        response = await self.async_client.get(reverse('product_detail', args=[self.products[0].pk]))
+        queries = int(re.search(r'desc="(\d+) queries"', response['Server-Timing']).group(1))
+        self.assertGreater(queries, 0)
+
+    async def test_cart_requires_login(self):
+        response = await self.async_client.get(reverse('cart'))
+        self.assertEqual(response.status_code, 302)
+        self.assertIn('/login', response['Location'])
+
+    async def test_add_to_cart_and_cart_view(self):
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.post(reverse('add_to_cart', args=[self.products[1].pk]), {'quantity': 2})
+        self.assertRedirects(response, reverse('cart'), fetch_redirect_response=False)
+        response = await self.async_client.get(reverse('cart'))
+        self.assertContains(response, 'Товар 1')
+        self.assertContains(response, '22')
+        await self.async_client.post(reverse('cart'), {'product_id_1': self.products[1].pk, 'quantity_1': 0})
+        session = await self.async_client.asession()
+        self.assertEqual(decode_cart(await sync_to_async(session.get)('cart')), {})
+
+class TaskQueueTests(TestCase):
+    def setUp(self):
+        self.product = Product.objects.create(name='Телефон', characteristics='', price=1500, quantity=5)
+        rebuild_facets()
+        self.form_data = {'full_name': 'Иван Иванов', 'email': 'ivan@example.com', 'address': 'Ленина, 1',
+                          'postal_code': '123456', 'city': 'Москва'}
+
+    def place(self, email='ivan@example.com'):
+        form = OrderCreateForm(data={**self.form_data, 'email': email})
+        self.assertTrue(form.is_valid())
+        with self.captureOnCommitCallbacks(execute=True):
+            return place_order(form, {str(self.product.pk): 1})
+
+    def smtp_settings(self, smtp):
+        return override_settings(EMAIL_BACKEND='django.core.mail.backends.smtp.EmailBackend', EMAIL_HOST=smtp.host,
+                                 EMAIL_PORT=smtp.port, EMAIL_USE_TLS=False, EMAIL_HOST_USER='', EMAIL_HOST_PASSWORD='')
+
+    def test_checkout_enqueues_after_commit(self):
+        form = OrderCreateForm(data=self.form_data)
+        self.assertTrue(form.is_valid())
+        with self.captureOnCommitCallbacks() as callbacks:
+            place_order(form, {str(self.product.pk): 1})
+            self.assertFalse(Task.objects.exists())
+        with CaptureQueriesContext(connection) as queries:
+            for callback in callbacks:
+                callback()
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(sorted(Task.objects.values_list('name', flat=True)),
+                         ['recompute_order_totals', 'send_order_confirmation', 'sync_stock'])
+        self.assertEqual(mail.outbox, [])
+
+    def test_worker_sends_batch_over_one_connection(self):
+        orders = [self.place() for _ in range(3)]
+        with FakeSMTPServer() as smtp, self.smtp_settings(smtp):
+            self.assertEqual(run_pending(), 9)
+        self.assertEqual(smtp.connections, 1)
+        self.assertEqual(len(smtp.messages), 3)
+        self.assertIn(orders[0].order_number, smtp.messages[0]['data'])
+        self.assertFalse(Task.objects.exists())
+
+    @override_settings(TASK_MAX_ATTEMPTS=2, TASK_RETRY_DELAY=60)
+    def test_failed_task_retried_then_kept_as_failed(self):
+        self.place(email='broken@example.com')
+        self.place()
+        with FakeSMTPServer(reject=['broken@example.com']) as smtp, self.smtp_settings(smtp), \
+                self.assertLogs('shop.tasks', 'WARNING'):
+            run_pending()
+            self.assertEqual(len(smtp.messages), 1)
+            task = Task.objects.get()
+            self.assertEqual((task.status, task.attempts), (Task.QUEUED, 1))
+            self.assertGreater(task.run_at, timezone.now() + timedelta(seconds=50))
+            self.assertEqual(run_pending(), 0)
+            run_pending(now=timezone.now() + timedelta(minutes=5))
+        task.refresh_from_db()
+        self.assertEqual((task.status, task.attempts), (Task.FAILED, 2))
+        self.assertIn('broken@example.com', task.last_error)
+
+    def test_stale_running_task_is_reclaimed(self):
+        Task.objects.create(name='recompute_order_totals', payload={'order_id': 0}, status=Task.RUNNING,
+                            locked_at=timezone.now() - timedelta(hours=1), attempts=1)
+        self.assertEqual(run_pending(), 1)
+        self.assertFalse(Task.objects.exists())
+
+    def test_sync_stock_recounts_facets(self):
+        self.place()
+        CatalogFacet.objects.filter(key='in_stock').update(count=100)
+        with FakeSMTPServer() as smtp, self.smtp_settings(smtp):
+            call_command('run_task_worker', once=True, stdout=StringIO())
+        self.assertEqual(get_facets(), rebuild_facets())
+
+    def test_unknown_task_rejected(self):
+        with self.assertRaises(UnknownTaskError):
+            enqueue('no_such_task')
+
+@skipUnless(Image, 'Нужен Pillow')
+class ProductImageTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        override = override_settings(MEDIA_ROOT=media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.source = self.store_image('imports/phone.png', (1000, 500))
+
+    def store_image(self, name, size):
+        buffer = BytesIO()
+        Image.new('RGBA', size, (200, 30, 30, 128)).save(buffer, 'PNG')
+        return default_storage.save(name, ContentFile(buffer.getvalue()))
+
+    def test_variants_named_by_content_hash(self):
+        variants = process_source(self.source)
+        self.assertEqual(list(variants['webp']), ['200', '400', '800'])
+        self.assertEqual((variants['width'], variants['height']), (1000, 500))
+        with default_storage.open(variants['jpeg']['400']) as f:
+            self.assertEqual(Image.open(f).size, (400, 200))
+        self.assertIn(variants['hash'], variants['webp']['800'])
+        with mock.patch.object(default_storage, 'save') as save:
+            self.assertEqual(process_source(self.source), variants)
+        save.assert_not_called()
+
+    def test_small_image_not_upscaled(self):
+        variants = process_source(self.store_image('imports/small.png', (300, 300)))
+        self.assertEqual(list(variants['jpeg']), ['200'])
+
+    def test_saved_product_processed_in_background(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            product = Product.objects.create(name='Телефон', characteristics='', price=100, quantity=1,
+                                             image=self.source)
+        response = self.client.get(reverse('product_detail', args=[product.pk]))
+        self.assertContains(response, f'src="{product.image}"')
+        run_pending()
+        product.refresh_from_db()
+        self.assertEqual(product.image_variants['source'], self.source)
+        response = self.client.get(reverse('product_detail', args=[product.pk]))
+        self.assertContains(response, '<source type="image/webp"')
+        self.assertContains(response, ' 800w')
+        response = self.client.get(reverse('product_list'))
+        self.assertContains(response, 'loading="lazy"')
+        self.assertContains(response, 'width="1000" height="500"')
+
+    def test_command_fetches_shared_source_once(self):
+        products = [Product.objects.create(name=f'Товар {i}', characteristics='', price=100, quantity=1,
+                                           image=self.source) for i in range(2)]
+        Product.objects.create(name='Битый', characteristics='', price=100, quantity=1, image='imports/missing.png')
+        out, err = StringIO(), StringIO()
+        call_command('process_product_images', workers=2, stdout=out, stderr=err)
+        self.assertIn('Источников: 1, с ошибками: 1, товаров обновлено: 2', out.getvalue())
+        self.assertIn('missing.png', err.getvalue())
+        for product in products:
+            product.refresh_from_db()
+            self.assertEqual(product.image_variants['source'], self.source)
+        out = StringIO()
+        call_command('process_product_images', workers=1, stdout=out, stderr=StringIO())
+        self.assertNotIn('товаров обновлено: 2', out.getvalue())
+
+    def test_sources_outside_storage_are_source_errors(self):
+        for source in ('../x.png', '/etc/passwd', 'file:///etc/passwd'):
+            with self.subTest(source=source), self.assertRaises(ImageSourceError):
+                fetch_source(source)
+        Product.objects.create(name='Товар', characteristics='', price=100, quantity=1, image=self.source)
+        Product.objects.create(name='Чужой', characteristics='', price=100, quantity=1, image='../secret.png')
+        out, err = StringIO(), StringIO()
+        call_command('process_product_images', workers=2, stdout=out, stderr=err)
+        self.assertIn('Источников: 1, с ошибками: 1, товаров обновлено: 1', out.getvalue())
+        self.assertIn('secret.png', err.getvalue())
+
+class CatalogImportExportTests(TestCase):
+    CSV = ('sku,name,characteristics,price,quantity,image\n'
+           'A-1,Телефон,Черный,1500,3,\n'
+           'A-2,Ноутбук,,60000.5,0,https://example.com/n.jpg\n'
+           'A-3,,Без названия,10,1,\n'
+           'A-4,Чехол,,abc,1,\n'
+           'A-1,Телефон новый,Белый,1400,5,\n')
+
+    def test_import_upserts_by_sku(self):
+        Product.objects.create(sku='A-2', name='Старый ноутбук', characteristics='', price=1, quantity=1)
+        errors = []
+        stats = import_products(read_rows(StringIO(self.CSV), 'csv'), batch_size=2, errors=errors.append)
+        self.assertEqual((stats['rows'], stats['saved'], stats['errors']), (5, 3, 2))
+        self.assertEqual([e.line for e in errors], [4, 5])
+        self.assertEqual(Product.objects.count(), 2)
+        phone = Product.objects.get(sku='A-1')
+        self.assertEqual((phone.name, phone.price, phone.quantity), ('Телефон новый', 1400, 5))
+        laptop = Product.objects.get(sku='A-2')
+        self.assertEqual((laptop.name, str(laptop.price), laptop.image),
+                         ('Ноутбук', '60000.50', 'https://example.com/n.jpg'))
+        self.assertEqual(get_facets()['in_stock'], 1)
+        self.assertEqual([p.sku for p in search_products('ноутбук')], ['A-2'])
+
+    def test_non_finite_price_is_row_error(self):
+        rows = 'sku,name,price,quantity\nB-1,Кабель,NaN,1\nB-2,Кабель,-Infinity,1\nB-3,Кабель,5,1\n'
+        errors = []
+        stats = import_products(read_rows(StringIO(rows), 'csv'), errors=errors.append)
+        self.assertEqual((stats['saved'], stats['errors']), (1, 2))
+        self.assertEqual([e.line for e in errors], [2, 3])
+
+    def test_import_reindexes_only_imported_products(self):
+        other = Product.objects.create(sku='Z-1', name='Утюг', characteristics='', price=5, quantity=1)
+        rows = 'sku,name,price,quantity\nA-1,Телефон,10,1\n'
+        with CaptureQueriesContext(connection) as queries:
+            import_products(read_rows(StringIO(rows), 'csv'))
+        # Индекс не перестраивается целиком
+        self.assertNotIn('DELETE FROM shop_product_fts', [q['sql'] for q in queries])
+        self.assertEqual(search_products('утюг'), [other])
+        self.assertEqual([p.sku for p in search_products('телефон')], ['A-1'])
+        self.assertEqual((get_facets()['total'], get_facets()['in_stock']), (2, 2))
+
+    def test_duplicate_sku_in_one_batch(self):
+        stats = import_products(read_rows(StringIO(self.CSV), 'csv'), batch_size=100)
+        self.assertEqual(stats['saved'], 2)
+        self.assertEqual(Product.objects.get(sku='A-1').name, 'Телефон новый')
+
+    def test_export_import_round_trip(self):
+        import_products(read_rows(StringIO(self.CSV), 'csv'))
+        exported = StringIO()
+        self.assertEqual(export_products(exported, 'jsonl')['rows'], 2)
+        before = list(Product.objects.order_by('sku').values(*CATALOG_FIELDS))
+        Product.objects.all().delete()
+        exported.seek(0)
+        self.assertEqual(import_products(read_rows(exported, 'jsonl'))['errors'], 0)
+        self.assertEqual(list(Product.objects.order_by('sku').values(*CATALOG_FIELDS)), before)
+
+    def test_commands(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        source = os.path.join(directory, 'catalog.csv')
+        with open(source, 'w', encoding='utf-8') as f:
+            f.write(self.CSV)
+        out, err = StringIO(), StringIO()
+        call_command('import_products', source, stdout=out, stderr=err)
+        self.assertIn('сохранено товаров: 2, с ошибками: 2', out.getvalue())
+        self.assertIn('Строка 4', err.getvalue())
+        target = os.path.join(directory, 'export.jsonl')
+        call_command('export_products', target, stdout=StringIO())
+        with open(target, encoding='utf-8') as f:
+            self.assertEqual(len(f.readlines()), 2)
+
+class OrderAdminTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_superuser(username='admin', email='admin@example.com', password='password')
+        self.client.force_login(self.admin)
+        self.product = Product.objects.create(name='Телефон', characteristics='', price=10, quantity=1000)
+
+    def create_orders(self, count, items=2, **fields):
+        orders = []
+        for i in range(count):
+            order = Order.objects.create(full_name=f'Покупатель {i}', email='buyer@example.com', address='Ленина, 1',
+                                         postal_code='123456', city='Москва', **fields)
+            OrderItem.objects.bulk_create([OrderItem(order=order, product=self.product, quantity=1, price=10)
+                                           for _ in range(items)])
+            orders.append(order)
+        return orders
+
+    def changelist(self, **params):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('admin:shop_order_changelist'), params)
+        self.assertEqual(response.status_code, 200)
+        self.queries = queries
+        return response, len(queries)
+
+    def test_changelist_query_count_is_bounded(self):
+        self.create_orders(3)
+        self.changelist()
+        _, few = self.changelist()
+        self.create_orders(70)
+        response, many = self.changelist()
+        self.assertEqual(few, many)
+        self.assertLessEqual(many, 8)
+        self.assertEqual(len(response.context['cl'].result_list), 50)
+        self.assertFalse([q for q in self.queries if 'COUNT(' in q['sql'] and 'LIMIT' not in q['sql']])
+
+    def test_cursor_pagination(self):
+        orders = self.create_orders(60)
+        response, _ = self.changelist()
+        cl = response.context['cl']
+        self.assertEqual(cl.result_list[0], orders[-1])
+        self.assertContains(response, 'Вперед')
+        response = self.client.get(reverse('admin:shop_order_changelist') + cl.next_url)
+        second = response.context['cl']
+        self.assertEqual(list(second.result_list), orders[9::-1])
+        self.assertFalse(second.keyset_page.has_next)
+        response = self.client.get(reverse('admin:shop_order_changelist') + second.prev_url)
+        self.assertEqual(list(response.context['cl'].result_list), list(cl.result_list))
+
+    @override_settings(ADMIN_EXACT_COUNT_LIMIT=5)
+    def test_estimated_counts(self):
+        self.create_orders(8, items=0)
+        self.create_orders(1, items=0, paid=True)
+        response, _ = self.changelist()
+        self.assertEqual(response.context['cl'].result_count_display, '≈9')
+        response, _ = self.changelist(paid__exact=0)
+        self.assertEqual(response.context['cl'].result_count_display, '>5')
+        response, _ = self.changelist(paid__exact=1)
+        self.assertEqual(response.context['cl'].result_count_display, '1')
+
+    def test_column_sort_uses_pages(self):
+        self.create_orders(3, items=0)
+        response, _ = self.changelist(o='2')
+        self.assertIsNone(response.context['cl'].keyset_page)
+        self.assertEqual(response.context['cl'].result_count, 3)
+
+    def test_inline_queries_do_not_depend_on_items(self):
+        small, large = self.create_orders(1, items=1)[0], self.create_orders(1, items=15)[0]
+        self.client.get(reverse('admin:shop_order_change', args=[small.pk]))
+        counts = []
+        for order in (small, large):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(reverse('admin:shop_order_change', args=[order.pk]))
+            self.assertContains(response, 'Телефон')
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+
+    def test_totals_are_read_only(self):
+        order = self.create_orders(1, items=2)[0]
+        response = self.client.get(reverse('admin:shop_order_change', args=[order.pk]))
+        form = response.context['adminform'].form
+        self.assertNotIn('total', form.fields)
+        self.assertNotIn('item_count', form.fields)
+
+class SalesReportTests(TestCase):
+    def setUp(self):
+        self.phone = Product.objects.create(name='Телефон', characteristics='', price=100, quantity=100)
+        self.case = Product.objects.create(name='Чехол', characteristics='', price=10, quantity=100)
+        day = timezone.make_aware(timezone.datetime(2024, 3, 1, 12))
+        self.first = self.create_order(day, 'created', [(self.phone, 2, 100), (self.case, 1, 10)])
+        self.second = self.create_order(day + timedelta(days=1), 'delivered', [(self.phone, 1, 90)])
+        self.empty = self.create_order(day + timedelta(days=1), 'created', [])
+
+    def create_order(self, created, status, items):
+        order = Order.objects.create(full_name='Иван', email='buyer@example.com', address='Ленина, 1',
+                                     postal_code='123456', city='Москва', status=status)
+        OrderItem.objects.bulk_create([OrderItem(order=order, product=product, quantity=quantity, price=price)
+                                       for product, quantity, price in items])
+        Order.objects.filter(pk=order.pk).update(created=created)
+        return order
+
+    def test_revenue_by_day_status_and_product(self):
+        self.assertEqual(revenue_report('day'), [
+            {'day': '2024-03-01', 'revenue': '210.00', 'items': 3, 'orders': 1},
+            {'day': '2024-03-02', 'revenue': '90.00', 'items': 1, 'orders': 1},
+        ])
+        self.assertEqual([(row['status'], row['revenue']) for row in revenue_report('status')],
+                         [('created', '210.00'), ('delivered', '90.00')])
+        self.assertEqual(revenue_report('product'), [
+            {'product_id': self.phone.pk, 'product_name': 'Телефон', 'revenue': '290.00', 'items': 3, 'orders': 2},
+            {'product_id': self.case.pk, 'product_name': 'Чехол', 'revenue': '10.00', 'items': 1, 'orders': 1},
+        ])
+        self.assertEqual(revenue_report('day', since='2024-03-02', until='2024-03-02')[0]['revenue'], '90.00')
+        self.assertEqual(revenue_report('product', status='delivered')[0]['items'], 1)
+        with self.assertRaises(ReportError):
+            revenue_report('week')
+        with self.assertRaises(ReportError):
+            revenue_report('day', since='вчера')
+
+    def test_export_csv_and_jsonl(self):
+        lines = list(export_lines('csv'))
+        self.assertTrue(lines[0].startswith('id,order_number,created'))
+        # Строка на каждую строку заказа и одна строка для заказа без товаров
+        self.assertEqual(len(lines), 5)
+        self.assertIn('Чехол', lines[2])
+        orders = [json.loads(line) for line in export_lines('jsonl', chunk_size=1)]
+        self.assertEqual([order['id'] for order in orders], [self.first.pk, self.second.pk, self.empty.pk])
+        self.assertEqual(orders[0]['items'], [
+            {'product_id': self.phone.pk, 'product_name': 'Телефон', 'quantity': 2, 'price': '100.00'},
+            {'product_id': self.case.pk, 'product_name': 'Чехол', 'quantity': 1, 'price': '10.00'},
+        ])
+        self.assertEqual(orders[2]['items'], [])
+        self.assertEqual(len(list(export_lines('jsonl', until='2024-03-01'))), 1)
+
+    def test_staff_endpoints(self):
+        response = self.client.get(reverse('sales_report'))
+        self.assertEqual(response.status_code, 302)
+        admin = User.objects.create_superuser(username='admin', email='admin@example.com', password='password')
+        self.client.force_login(admin)
+        response = self.client.get(reverse('sales_report'), {'group_by': 'status'})
+        self.assertEqual(len(response.json()['rows']), 2)
+        self.assertEqual(self.client.get(reverse('sales_report'), {'group_by': 'week'}).status_code, 400)
+        response = self.client.get(reverse('export_orders'), {'format': 'jsonl'})
+        self.assertTrue(response.streaming)
+        self.assertEqual(len(b''.join(response.streaming_content).splitlines()), 3)
+        self.assertEqual(self.client.get(reverse('export_orders'), {'format': 'xml'}).status_code, 400)
+
+    def test_commands_and_seed(self):
+        out = StringIO()
+        call_command('sales_report', '--group-by', 'product', '--json', stdout=out)
+        self.assertEqual(len(json.loads(out.getvalue())), 2)
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'orders.jsonl')
+        call_command('export_orders', path, stdout=StringIO())
+        with open(path, encoding='utf-8') as f:
+            self.assertEqual(len(f.readlines()), 3)
+        self.assertEqual(seed_sales(25, items_per_order=10, products=3), 3)
+        self.assertEqual(OrderItem.objects.count(), 28)
+        seeded = OrderItem.objects.filter(order__gt=self.empty.pk)
+        self.assertEqual(sum(item.price * item.quantity for item in seeded),
+                         Order.objects.filter(pk__gt=self.empty.pk).aggregate(Sum('total'))['total__sum'])
+
+
+class SalesRollupTests(TestCase):
+    def setUp(self):
+        self.phone = Product.objects.create(name='Телефон', characteristics='', price=100, quantity=100)
+        self.case = Product.objects.create(name='Чехол', characteristics='', price=10, quantity=100)
+        self.day = timezone.make_aware(timezone.datetime(2024, 3, 1, 10))
+        self.now = self.day + timedelta(days=2, hours=2, minutes=30)
+        self.first = self.create_order(self.day, [(self.phone, 2, 100), (self.case, 1, 10)])
+        self.second = self.create_order(self.day + timedelta(days=1), [(self.phone, 1, 90)], status='delivered')
+        # Заказ текущего часа в сводку не попадает, отчет берет его из живых данных
+        self.recent = self.create_order(self.now - timedelta(minutes=10), [(self.case, 3, 10)])
+
+    def create_order(self, created, items, status='created'):
+        order = Order.objects.create(full_name='Иван', email='buyer@example.com', address='Ленина, 1',
+                                     postal_code='123456', city='Москва', status=status)
+        OrderItem.objects.bulk_create([OrderItem(order=order, product=product, quantity=quantity, price=price)
+                                       for product, quantity, price in items])
+        Order.objects.filter(pk=order.pk).update(created=created)
+        return order
+
+    def live(self, group_by, **filters):
+        return [{key: value for key, value in row.items() if key != 'orders'}
+                for row in revenue_report(group_by, **filters)]
+
+    def test_rollup_matches_live_report(self):
+        self.assertEqual(refresh_rollup(self.now)['rows'], 3)
+        self.assertFalse(SalesRollup.objects.filter(day=self.now.date()).exists())
+        for group_by in ('day', 'status', 'product'):
+            self.assertEqual(rollup_report(group_by), self.live(group_by))
+        self.assertEqual(rollup_report('day', since='2024-03-02', status='delivered'),
+                         self.live('day', since='2024-03-02', status='delivered'))
+        self.assertEqual([row['day'] for row in rollup_report('day', live=False)], ['2024-03-01', '2024-03-02'])
+
+    def test_refresh_picks_up_changed_orders(self):
+        refresh_rollup(self.now)
+        first = Order.objects.get(pk=self.first.pk)
+        first.status = 'shipped'
+        first.save()
+        OrderItem.objects.create(order=self.second, product=self.case, quantity=4, price=10)
+        self.assertEqual(refresh_rollup(self.now)['days'], 2)
+        self.assertEqual(rollup_report('status', live=False), [
+            {'status': 'delivered', 'revenue': '130.00', 'items': 5},
+            {'status': 'shipped', 'revenue': '210.00', 'items': 3},
+        ])
+        # Новый cutoff добавляет в сводку заказы прошедших часов
+        refresh_rollup(self.now + timedelta(hours=12))
+        self.assertEqual(rollup_report('day', live=False)[-1], {'day': '2024-03-03', 'revenue': '30.00', 'items': 3})
+        self.assertEqual(rollup_report('product'), self.live('product'))
+
+    def test_rebuild(self):
+        refresh_rollup(self.now)
+        fields = ('day', 'product', 'status', 'quantity', 'revenue')
+        before = list(SalesRollup.objects.order_by(*fields).values(*fields))
+        SalesRollup.objects.all().delete()
+        self.assertEqual(rebuild_rollup(since='2024-03-02', until='2024-03-02')['rows'], 1)
+        self.assertEqual(rebuild_rollup(chunk_days=1, now=self.now), {'days': 2, 'rows': 3})
+        self.assertEqual(list(SalesRollup.objects.order_by(*fields).values(*fields)), before)
+        with self.assertRaises(ReportError):
+            rebuild_rollup(since='вчера')
+
+    def test_staff_endpoint_and_commands(self):
+        call_command('rebuild_sales_rollup', '--workers', '1', stdout=StringIO())
+        out = StringIO()
+        call_command('refresh_sales_rollup', stdout=out)
+        self.assertIn('строк сводки', out.getvalue())
+        admin = User.objects.create_superuser(username='admin', email='admin@example.com', password='password')
+        self.client.force_login(admin)
+        response = self.client.get(reverse('sales_report'), {'group_by': 'product', 'source': 'rollup'})
+        self.assertEqual(response.json()['rows'], self.live('product'))
+
+
+class OrderStatusTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_superuser(username='admin', email='admin@example.com', password='password')
+        self.orders = [Order.objects.create(full_name='Иван', email='buyer@example.com', address='Ленина, 1',
+                                            postal_code='123456', city='Москва') for _ in range(4)]
+
+    def statuses(self):
+        return list(Order.objects.order_by('pk').values_list('status', flat=True))
+
+    def test_transition(self):
+        order = self.orders[0]
+        transition(order, 'preparing', user=self.admin)
+        self.assertEqual(Order.objects.get(pk=order.pk).status, 'preparing')
+        change = OrderStatusChange.objects.get(order=order)
+        self.assertEqual((change.from_status, change.to_status, change.user), ('created', 'preparing', self.admin))
+        with self.assertRaises(InvalidTransitionError):
+            transition(order, 'delivered')
+        # Заказ изменили параллельно: прежний статус в UPDATE не совпадает
+        stale = Order.objects.get(pk=self.orders[1].pk)
+        transition(self.orders[1], 'preparing')
+        with self.assertRaises(InvalidTransitionError):
+            transition(stale, 'preparing')
+
+    def test_bulk_transition_uses_one_update_per_status(self):
+        transition(self.orders[0], 'preparing')
+        with CaptureQueriesContext(connection) as queries:
+            moved = bulk_transition(Order.objects.all(), 'preparing')
+        self.assertEqual(moved, 3)
+        self.assertEqual(len([q for q in queries if q['sql'].startswith('UPDATE')]), 1)
+        self.assertEqual(self.statuses(), ['preparing'] * 4)
+        self.assertEqual(OrderStatusChange.objects.filter(to_status='preparing').count(), 4)
+        self.assertEqual(bulk_transition(Order.objects.all(), 'delivered'), 0)
+        with self.assertRaises(InvalidTransitionError):
+            bulk_transition(Order.objects.all(), 'lost')
+
+    def test_insert_rows_reads_rows_in_batches(self):
+        def rows():
+            for order in self.orders:
+                yield order.pk, 'created', 'preparing', timezone.now(), None
+
+        with CaptureQueriesContext(connection) as queries:
+            inserted = insert_rows(OrderStatusChange, HISTORY_FIELDS, rows(), batch_size=3)
+        self.assertEqual(inserted, 4)
+        # executemany попадает в журнал запросов как "N times: INSERT ..."
+        self.assertEqual([q['sql'].split(':')[0] for q in queries if 'INSERT INTO' in q['sql']],
+                         ['3 times', '1 times'])
+        self.assertEqual(OrderStatusChange.objects.count(), 4)
+
+    def test_bulk_advance_moves_one_step(self):
+        transition(self.orders[0], 'preparing')
+        self.assertEqual(bulk_advance(Order.objects.all()), {'delivered': 0, 'waiting': 0, 'shipped': 1, 'preparing': 3})
+        self.assertEqual(self.statuses(), ['shipped', 'preparing', 'preparing', 'preparing'])
+
+    def test_admin(self):
+        self.client.force_login(self.admin)
+        url = reverse('admin:shop_order_changelist')
+        response = self.client.post(url, {'action': 'transition_to_preparing',
+                                          '_selected_action': [order.pk for order in self.orders[:2]]}, follow=True)
+        self.assertContains(response, 'Переведено в статус')
+        self.assertEqual(self.statuses(), ['preparing', 'preparing', 'created', 'created'])
+        self.client.post(url, {'action': 'advance_status', '_selected_action': [order.pk for order in self.orders]})
+        self.assertEqual(self.statuses(), ['shipped', 'shipped', 'preparing', 'preparing'])
+        response = self.client.get(reverse('admin:shop_order_change', args=[self.orders[0].pk]))
+        choices = [value for value, _ in response.context['adminform'].form.fields['status'].choices]
+        self.assertEqual(choices, ['shipped', 'waiting'])
+        self.assertContains(response, 'Собирается')
+
+    def test_command(self):
+        out = StringIO()
+        call_command('transition_orders', '--to', 'preparing', '--ids', f'{self.orders[0].pk},{self.orders[1].pk}',
+                     stdout=out)
+        self.assertIn('Переведено заказов: 2', out.getvalue())
+        call_command('transition_orders', '--advance', '--status', 'preparing', stdout=StringIO())
+        self.assertEqual(self.statuses(), ['shipped', 'shipped', 'created', 'created'])
+
+
+class TemplateCachingTests(TestCase):
+    def setUp(self):
+        self.product = Product.objects.create(name='Телефон', characteristics='Описание', price=100, quantity=5)
+        self.user = User.objects.create_user(username='buyer', password='password')
+        self.profile = override_settings(**template_profile_settings('production'))
+        self.profile.enable()
+        caches['template_fragments'].clear()
+
+    def tearDown(self):
+        self.profile.disable()
+
+    def test_production_profile_uses_cached_loader(self):
+        loaders = template_profile_settings('production')['TEMPLATES'][0]['OPTIONS']['loaders']
+        self.assertEqual(loaders[0][0], 'django.template.loaders.cached.Loader')
+        self.assertNotIn('loaders', template_profile_settings('default')['TEMPLATES'][0]['OPTIONS'])
+
+    def test_warm_templates(self):
+        self.assertGreater(warm_templates(), 0)
+        loader = engines['django'].engine.template_loaders[0]
+        self.assertIn('shop/base.html', loader.get_template_cache)
+
+    def test_header_fragment_depends_on_authentication(self):
+        anonymous = self.client.get(reverse('product_list')).content.decode()
+        self.assertIn(reverse('register'), anonymous)
+        self.client.force_login(self.user)
+        content = self.client.get(reverse('product_list')).content.decode()
+        self.assertIn(reverse('account'), content)
+        self.assertNotIn(reverse('register'), content)
+
+    def test_product_card_fragment_follows_product(self):
+        self.assertContains(self.client.get(reverse('product_list')), 'Цена: 100')
+        Product.objects.filter(pk=self.product.pk).update(price=250)
+        self.assertContains(self.client.get(reverse('product_list')), 'Цена: 250')
+
+
+class AnonymousFastPathTests(TestCase):
+    def setUp(self):
+        self.product = Product.objects.create(name='Телефон', characteristics='Описание', price=100, quantity=5)
+        self.user = User.objects.create_user(username='buyer', password='password')
+        get_cache().clear()
+
+    def pages(self):
+        return [reverse('home'), reverse('product_list'), reverse('product_detail', args=[self.product.pk])]
+
+    def test_no_session_or_user_queries_without_cookie(self):
+        for url in self.pages():
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            tables = ' '.join(query['sql'] for query in queries.captured_queries)
+            self.assertNotIn('django_session', tables)
+            self.assertNotIn('shop_user', tables)
+            self.assertIn('public', response['Cache-Control'])
+            self.assertIn('Cookie', response['Vary'])
+            self.assertFalse(response.cookies)
+
+    def test_logged_in_user_gets_private_page(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('product_detail', args=[self.product.pk]))
+        self.assertNotIn('public', response.get('Cache-Control', ''))
+        self.assertContains(response, 'csrfmiddlewaretoken')
+        self.assertContains(response, reverse('account'))
+
+    def test_guest_product_page_has_no_csrf_form(self):
+        response = self.client.get(reverse('product_detail', args=[self.product.pk]))
+        self.assertNotContains(response, 'csrfmiddlewaretoken')
+        self.assertContains(response, reverse('login'))
+
+
 class ProductModelTest(TestCase):
     def setUp(self):
         self.product = Product.objects.create(
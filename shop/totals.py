@@ -0,0 +1,39 @@
+from django.db.models import F, Sum, OuterRef, Subquery, DecimalField, PositiveIntegerField, Value
+from django.db.models.functions import Coalesce
+
+from .models import Order, OrderItem
+
+
+def _items_aggregate(expression, output_field):
+    # Подзапрос с агрегатом по строкам заказа из внешнего запроса
+    return Coalesce(Subquery(
+        OrderItem.objects.filter(order=OuterRef('pk')).order_by().values('order')
+        .annotate(value=Sum(expression, output_field=output_field)).values('value'),
+        output_field=output_field,
+    ), Value(0), output_field=output_field)
+
+
+def recompute_totals(queryset):
+    """
+    Пересчитывает сохраненные суммы заказов queryset одним UPDATE
+    с агрегатами по строкам заказа, без загрузки заказов в Python.
+    """
+    return queryset.update(
+        total=_items_aggregate(F('price') * F('quantity'), DecimalField(max_digits=12, decimal_places=2)),
+        item_count=_items_aggregate(F('quantity'), PositiveIntegerField()),
+    )
+
+
+def recompute_all_totals(batch_size=1000):
+    """
+    Пересчитывает суммы всех заказов пачками по batch_size по возрастанию id.
+    Возвращает число обработанных заказов.
+    """
+    processed = 0
+    last_id = 0
+    while True:
+        ids = list(Order.objects.filter(pk__gt=last_id).order_by('pk').values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            return processed
+        processed += recompute_totals(Order.objects.filter(pk__gte=ids[0], pk__lte=ids[-1]))
+        last_id = ids[-1]
@@ -1,5 +1,9 @@
+from django.conf import settings
 from django.urls import path
-from . import views
+from . import views, async_views
+
+# Под ASGI каталог и корзина обслуживаются асинхронными представлениями
+catalog = async_views if settings.ASYNC_VIEWS else views
 from django.contrib.auth import views as auth_views
 
 urlpatterns = [
@@ -7,12 +11,17 @@ urlpatterns = [
     path('account', views.account, name='account'),
     path('register/', views.register, name='register'),
     path('login/', views.login, name='login'),
-    path('product_list', views.product_list, name='product_list'),
-    path('product/<int:pk>/', views.product_detail, name='product_detail'),
+    path('product_list', catalog.product_list, name='product_list'),
+    path('product/<int:pk>/', catalog.product_detail, name='product_detail'),
+    path('search', views.search, name='search'),
+    path('cache_stats', views.cache_stats, name='cache_stats'),
+    path('request_metrics', views.request_metrics, name='request_metrics'),
+    path('sales_report', views.sales_report, name='sales_report'),
+    path('export_orders', views.export_orders, name='export_orders'),
     path('logout/', views.user_logout, name='logout'),
-    path('add_to_cart/<int:product_id>/', views.add_to_cart, name='add_to_cart'),
+    path('add_to_cart/<int:product_id>/', catalog.add_to_cart, name='add_to_cart'),
     path('remove_from_cart/<int:product_id>',views.remove_from_cart, name='remove_from_cart'),
-    path('cart', views.cart_view, name='cart'),
+    path('cart', catalog.cart_view, name='cart'),
     path('create_order', views.create_order, name='create_order'),
     path('order_success/<int:order_id>', views.order_success, name='order_success'),
     path('reset_password/',
@@ -1,16 +1,34 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from .models import Product, User, Order, OrderItem
 from .forms import UserRegistrationForm, LoginForm, OrderCreateForm
+from .cart import Cart, CartLimitError
+from .orders import place_order, MissingProductsError
+from .stock import reservation_key, reserve_stock, OutOfStockError
+from .search import search_products
+from .page_cache import anonymous_fast_path, cached_page, catalog_version, product_version, cache_stats as page_cache_stats
+from .metrics import request_stats as request_metrics_stats, reset_stats as reset_request_metrics
+from .pagination import keyset_page, iter_keyset_chunks, get_cursor, get_page_size, DEFAULT_ORDERING
+from .filters import get_filters, filter_products, filter_query, price_facets
+from .facets import get_facets
+from .routers import replica_reads, pin_to_primary
+from .reports import ReportError, revenue_report, export_lines
+from .rollups import rollup_report
+from django.conf import settings
 from django.contrib.auth import logout
 from django.contrib import messages
-from django.http import HttpResponse
+from django.http import HttpResponse, StreamingHttpResponse, JsonResponse
+from django.template.loader import render_to_string
 from django.contrib.auth.decorators import login_required
+from django.contrib.admin.views.decorators import staff_member_required
 
+STREAM_MARKER = '__product_cards__'
 
+
+@anonymous_fast_path
+@replica_reads
 def index(request):
     #Эта функция отображает главную страницу
-    products = Product.objects.all()
-    return render(request, 'shop/index.html', {'products':products})
+    return render(request, 'shop/index.html')
 
 
 @login_required
@@ -56,13 +74,112 @@ def login(request):
     return render(request, 'registration/login.html', {'form': form})
 
 
+@anonymous_fast_path
+@replica_reads
 def product_list(request):
-    products = Product.objects.all()
-    return render(request, 'shop/product_list.html', {'products': products})
+    filters = get_filters(request)
+    ordering = filters.get('sort', DEFAULT_ORDERING)
+    products = filter_products(Product.objects.all(), filters)
+    after = get_cursor(request, 'after', ordering, Product)
+    per_page = get_page_size(request)
+    if settings.PRODUCT_LIST_STREAMING or request.GET.get('stream') == '1':
+        return stream_product_list(request, products, after, per_page, ordering)
+    before = get_cursor(request, 'before', ordering, Product)
+
+    def get_context():
+        page = keyset_page(products, after=after, before=before, per_page=per_page, ordering=ordering)
+        return {'products': page.object_list, 'page': page, 'per_page': per_page, 'filters': filters,
+                'page_query': filter_query(filters, per_page=per_page),
+                'facets': price_facets(filters, get_facets())}
+
+    key = product_list_cache_key(request, filters, after, before, per_page)
+    return cached_page(request, key, 'shop/product_list.html', get_context)
+
+
+def product_list_cache_key(request, filters, after, before, per_page):
+    # Изменение каталога меняет его версию, и страницы списка перестраиваются. Остатки
+    # меняют версию, только если товар закончился или появился (shop.stock.invalidate_stock).
+    # Курсоры в ключе - строки из URL: repr разобранного курсора (Decimal с пробелами
+    # и кавычками) не годится в ключ memcached
+    cursors = [request.GET[name] if value is not None else '' for name, value in (('after', after), ('before', before))]
+    return f'product_list:{catalog_version()}:{filter_query(filters)}:{cursors[0]}:{cursors[1]}:{per_page}'
+
+
+def product_detail_cache_key(pk):
+    return f'product_detail:{pk}:{product_version(pk)}'
+
+
+def stream_page_parts(request):
+    # Страница рендерится один раз с маркером на месте сетки карточек,
+    # затем карточки отдаются пачками по мере чтения из базы
+    page = render_to_string('shop/product_list.html', {'streaming': True, 'stream_marker': STREAM_MARKER},
+                            request=request)
+    return page.split(STREAM_MARKER, 1)
+
+
+def stream_product_list(request, products, after, per_page, ordering=DEFAULT_ORDERING):
+    head, tail = stream_page_parts(request)
+
+    def content():
+        yield head
+        for chunk in iter_keyset_chunks(products, after=after, chunk_size=per_page, ordering=ordering):
+            yield render_to_string('shop/product_cards.html', {'products': chunk})
+        yield tail
+
+    return StreamingHttpResponse(content())
+
+
+def search(request):
+    query = request.GET.get('q', '').strip()
+    products = search_products(query) if query else []
+    return render(request, 'shop/search.html', {'products': products, 'query': query})
 
+
+@anonymous_fast_path
+@replica_reads
 def product_detail(request, pk):
-    product = get_object_or_404(Product, pk=pk)
-    return render(request, 'shop/product_detail.html', {'product': product})
+    return cached_page(request, product_detail_cache_key(pk), 'shop/product_detail.html',
+                       lambda: {'product': get_object_or_404(Product, pk=pk)})
+
+
+@staff_member_required
+def cache_stats(request):
+    return JsonResponse(page_cache_stats())
+
+
+@staff_member_required
+def request_metrics(request):
+    # Статистика запросов по именам URL; POST сбрасывает накопленное
+    if request.method == 'POST':
+        reset_request_metrics()
+    return JsonResponse(request_metrics_stats(), json_dumps_params={'ensure_ascii': False})
+
+
+@staff_member_required
+def sales_report(request):
+    # ?group_by=day|status|product&since=YYYY-MM-DD&until=YYYY-MM-DD&status=;
+    # ?source=rollup - по сводке продаж с живыми данными после ее последнего обновления
+    report = rollup_report if request.GET.get('source') == 'rollup' else revenue_report
+    try:
+        rows = report(request.GET.get('group_by', 'day'), request.GET.get('since'),
+                      request.GET.get('until'), request.GET.get('status'))
+    except ReportError as e:
+        return JsonResponse({'error': str(e)}, status=400, json_dumps_params={'ensure_ascii': False})
+    return JsonResponse({'rows': rows}, json_dumps_params={'ensure_ascii': False})
+
+
+@staff_member_required
+def export_orders(request):
+    # Заказы со строками потоком CSV или JSONL, ответ не собирается в памяти
+    fmt = request.GET.get('format', 'csv')
+    try:
+        lines = export_lines(fmt, request.GET.get('since'), request.GET.get('until'), request.GET.get('status'))
+    except ReportError as e:
+        return JsonResponse({'error': str(e)}, status=400, json_dumps_params={'ensure_ascii': False})
+    content_type = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    response = StreamingHttpResponse(lines, content_type=f'{content_type}; charset=utf-8')
+    response['Content-Disposition'] = f'attachment; filename="orders.{fmt}"'
+    return response
 
 
 @login_required
@@ -70,13 +187,11 @@ def add_to_cart(request, product_id):
     if request.method == 'POST':
         quantity = int(request.POST.get('quantity', 1))
         product = get_object_or_404(Product, id=product_id)
-        # Получение текущей корзины из сессии
-        cart = request.session.get('cart', {})
-        if product_id in cart:
-            cart[product_id] += quantity  # Увеличиваем количество, если товар уже в корзине
-        else:
-            cart[product_id] = quantity # Добавляем товар в корзину
-        request.session['cart'] = cart  # Сохраняем обновленную корзину в сессии
+        cart = Cart(request)
+        try:
+            cart.add(product.id, quantity)  # Увеличиваем количество, если товар уже в корзине
+        except CartLimitError as e:
+            messages.error(request, str(e))
         return redirect('cart')  # Перенаправляем пользователя на страницу корзины
     return HttpResponse("Only POST method is allowed", status=405)
 
@@ -84,40 +199,29 @@ def add_to_cart(request, product_id):
 @login_required
 def remove_from_cart(request, product_id):
     if request.method == 'POST':
-        cart = request.session.get('cart',{})
-        quantity = int(request.POST.get('quantity', 1))
-        if product_id in cart:
-            del cart[product_id]
-        request.session['cart'] = cart
+        Cart(request).remove(product_id)
         return redirect('cart')
 
 
 @login_required
 def cart_view(request):
-    cart = request.session.get('cart', {})
-    products = []
-    total_price = 0
+    cart = Cart(request)
     if request.method == 'POST':
         # Обновление корзины
         index = 1
         while f'product_id_{index}' in request.POST:
-            product_id = request.POST[f'product_id_{index}']
+            product_id = int(request.POST[f'product_id_{index}'])
             new_quantity = int(request.POST.get(f'quantity_{index}', 0))
             if new_quantity <= 0:
-                remove_from_cart(request, product_id=product_id)
-            else:
-                cart[product_id] = new_quantity  # Обновляем количество
+                cart.remove(product_id)
+            elif product_id in cart.lines:
+                cart.add(product_id, new_quantity, update_quantity=True)  # Обновляем количество
             index += 1
-
-        request.session['cart'] = cart  # Сохраняем обновленную корзину в сессии
         return redirect('cart')  # Перенаправляем пользователя на страницу корзины
 
-    for product_id, quantity in cart.items():
-        product = get_object_or_404(Product, id=product_id)
-        total_price += product.price * quantity
-        products.append({'product': product, 'quantity': quantity})
-
-    return render(request, 'shop/cart.html', {'products': products, 'total_price': total_price})
+    # Все товары корзины загружаются одним запросом, удаленные товары тихо убираются
+    contents = cart.get_contents()
+    return render(request, 'shop/cart.html', {'products': contents.items, 'total_price': contents.total_price})
 
 
 def user_logout(request):
@@ -127,26 +231,35 @@ def user_logout(request):
 
 @login_required
 def create_order(request):
+    cart = Cart(request)
     if request.method == 'POST':
-        cart = request.session.get('cart')
         form = OrderCreateForm(request.POST)
         if form.is_valid():
-            order = form.save()
-            order.save()
-            for key, value in cart.items():
-                try:
-                    product = Product.objects.get(pk=key)
-                    price = product.price * value
-                    order_item = OrderItem(order=order, product=product, quantity=value, price=price)
-                    order_item.save()
-                except Product.DoesNotExist:
+            try:
+                order = place_order(form, cart.lines, reservation_key=reservation_key(request.user))
+            except MissingProductsError as e:
+                for key in e.product_ids:
                     messages.error(request, f'Продукт с ID {key} не найден.')
-                    return redirect('cart')  # Или другая подходящая страница
+                return redirect('cart')  # Или другая подходящая страница
+            except OutOfStockError as e:
+                for product_id in e.product_ids:
+                    messages.error(request, f'Товара с ID {product_id} недостаточно на складе.')
+                return redirect('cart')
             messages.success(request, 'Ваш заказ был оформлен!')
             cart.clear()
+            # Остатки на складе изменились: пользователь должен видеть их сразу, а не с реплики
+            pin_to_primary(request)
             return render(request, 'shop/order_success.html', {'order': order})
     else:
         form = OrderCreateForm()
+        # Резервируем товары корзины, пока пользователь заполняет форму. Резерв привязан
+        # к пользователю, повторное открытие формы с той же корзиной только продлевает его
+        try:
+            reserve_stock(reservation_key(request.user), dict(cart.lines))
+        except OutOfStockError as e:
+            for product_id in e.product_ids:
+                messages.error(request, f'Товара с ID {product_id} недостаточно на складе.')
+            return redirect('cart')
     return render(request, 'shop/order_create.html', {'form': form})
 
 